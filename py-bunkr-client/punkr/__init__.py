@@ -1 +1,22 @@
-from .punkr import Punkr, PunkrException, Command, SecretType
+import importlib
+
+# the package namespace is resolved lazily (PEP 562): `punkr.Punkr` only imports the client, the
+# connection pool, the shared cache and the ssh agent are imported when first looked up
+_LAZY_MODULES = (".punkr", ".pool", ".shared_cache", ".ssh_agent")
+
+
+def __getattr__(name):
+    if name == "__all__":
+        return sorted({attr for module in _LAZY_MODULES for attr in dir(_module(module)) if not attr.startswith("_")})
+    for module in _LAZY_MODULES:
+        try:
+            return getattr(_module(module), name)
+        except AttributeError:
+            pass
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(__getattr__("__all__")))
+
+def _module(name):
+    return importlib.import_module(name, __name__)
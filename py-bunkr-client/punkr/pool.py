@@ -0,0 +1,101 @@
+import queue
+import socket
+import threading
+
+from .rpc_client import RpcTcpClient
+from .punkr import exec_command, PunkrException, READ_ONLY_COMMANDS
+
+DEFAULT_POOL_SIZE = 8
+
+
+class ConnectionPool(object):
+    """
+    ConnectionPool keeps connections to the Bunkr daemon open and reuses them across commands.
+    Concurrent callers each get a connection of their own, up to `size` of them, instead of
+    connecting to the daemon for every command. Idle connections the daemon closed are dropped
+    before they are reused, and only read-only commands are retried when a reused connection fails
+    mid-command, as the daemon may have run the others already
+    """
+
+    def __init__(self, address, size=DEFAULT_POOL_SIZE):
+        """
+        :param address: path of the Bunkr daemon unix socket
+        :param size: maximum number of open connections
+        """
+        self.address = address
+        self.size = size
+        self.__idle = queue.LifoQueue()
+        self.__slots = threading.BoundedSemaphore(size)
+
+    def execute(self, command, *args):
+        """
+        run a bunkr command over a pooled connection
+        :param command: Command to run
+        :param args: command arguments
+        :return: The result returned from the Bunkr command
+        :raises: PunkrException wrapping the error returning from the Bunkr command
+        """
+        with self.__slots:
+            client, reused = self.__acquire()
+            try:
+                return self.__run(client, command, args)
+            except (OSError, ValueError):
+                if not reused or command not in READ_ONLY_COMMANDS:
+                    raise
+            # the daemon may have closed the connection while it was idle, retry once on a new one
+            return self.__run(self.__connect(), command, args)
+
+    def close(self):
+        """
+        close the idle connections
+        """
+        while True:
+            try:
+                self.__idle.get_nowait().disconnect()
+            except queue.Empty:
+                return
+
+    def __acquire(self):
+        while True:
+            try:
+                client = self.__idle.get_nowait()
+            except queue.Empty:
+                return self.__connect(), False
+            if self.__idle_open(client):
+                return client, True
+            client.disconnect()
+
+    @staticmethod
+    def __idle_open(client):
+        # an idle connection has nothing to read: an end of file means the daemon closed it
+        try:
+            client.socket.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        return False
+
+    def __run(self, client, command, args):
+        try:
+            result = exec_command(client, command, *args)
+        except PunkrException:
+            # the command failed in Bunkr, the connection is still good
+            self.__idle.put(client)
+            raise
+        except BaseException:
+            client.disconnect()
+            raise
+        self.__idle.put(client)
+        return result
+
+    def __connect(self):
+        client = RpcTcpClient(self.address)
+        client.connect()
+        return client
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
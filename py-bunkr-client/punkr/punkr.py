@@ -34,6 +34,11 @@ class Command(enum.Enum):
     SIGNIN = "sigin"
     CONFIRM_SIGNIN = "confirm-signin"
 
+# commands whose results are shared through a SharedResultCache
+CACHED_COMMANDS = (Command.LIST_SECRETS, Command.SSH_PUBLIC_DATA, Command.SECRET_INFO)
+# commands that do not change the state of Bunkr, any other one invalidates the cache
+READ_ONLY_COMMANDS = CACHED_COMMANDS + (Command.LIST_DEVICES, Command.LIST_GROUPS, Command.ACCESS, Command.SIGN_ECDSA, Command.NOOP)
+
 class SecretType(enum.Enum):
     ECDSASECP256k1Key = "ECDSA-SECP256k1"
     ECDSAP256Key = "ECDSA-P256"
@@ -50,20 +55,50 @@ def build_operation_args(command, *args):
         "Args": args,
     }
 
+def exec_command(client, command, *args):
+    """
+    exec_command sends a bunkr command through a connected rpc client
+    :param client: connected RPC client
+    :param command: Command to run
+    :param args: arguments to be injected in the JSON RPC Command object
+    :return: The result returned from the Bunkr command
+    :raises: PunkrException wrapping the error returning from the Bunkr command
+    """
+    # Build message
+    message = str(
+        JsonProtocol(
+            _JSON_RPC_PROTOCOL,
+            _RPC_CALL,
+            build_operation_args(command, *args)
+        )
+    )
+    data = client.send(message)
+    # Check if we had any error with the communications
+    if data["error"] is not None:
+        raise PunkrException(data["error"])
+    # check if we had some operation error
+    operation_error = data["result"]["Error"]
+    if operation_error != "":
+        raise PunkrException(operation_error)
+    # result is wrapped by the jsonrpc protocol (result) and the Result go object (Result)
+    result = data["result"]["Result"]
+    return result
+
 class Punkr(object):
     """
     Punkr (Python Bunkr) is the wrapper class around Bunkr operations
     Internally it uses a custom RPC TCP client to communicate with a daemonized Bunkr
     """
 
-    def __init__(self, address):
+    def __init__(self, address, cache=None):
         """
         Class init method
         :param address:
-        :param port:
+        :param cache: optional SharedResultCache sharing the results of the read-only commands
         """
         self.__address  = address
         self.__client   = RpcTcpClient(address)
+        self.__cache    = cache
 
     def __exec_cmd(self, client, command, *args):
         """
@@ -74,24 +109,44 @@ class Punkr(object):
         :return: The result returned from the Bunkr command
         :raises: PunkrException wrapping the error returning from the Bunkr command
         """
-        # Build message
-        message = str(
-            JsonProtocol(
-                _JSON_RPC_PROTOCOL,
-                _RPC_CALL,
-                build_operation_args(command, *args)
-            )
-        )
-        data = client.send(message)
-        # Check if we had any error with the communications
-        if data["error"] is not None:
-            raise PunkrException(data["error"])
-        # check if we had some operation error
-        operation_error = data["result"]["Error"]
-        if operation_error != "":
-            raise PunkrException(operation_error)
-        # result is wrapped by the jsonrpc protocol (result) and the Result go object (Result)
-        result = data["result"]["Result"]
+        try:
+            return exec_command(client, command, *args)
+        finally:
+            if self.__cache is not None and command not in READ_ONLY_COMMANDS:
+                self.__cache.invalidate()
+
+    def __cached_cmd(self, command, *args):
+        """
+        __cached_cmd runs a read-only command through the cache, if any
+        :return: The result returned from the Bunkr command, or its cached copy
+        :raises: PunkrException wrapping the error returning from the Bunkr command
+        """
+        def fetch():
+            with self.__client as client:
+                return self.__exec_cmd(client, command, *args)
+        if self.__cache is None:
+            return fetch()
+        from .shared_cache import cache_key
+        return self.__cache.get_or_fetch(cache_key(command, args), fetch)
+
+    async def __async_cached_cmd(self, command, *args):
+        """
+        __async_cached_cmd is the asynchronous replica of __cached_cmd, concurrent misses are not
+        merged to avoid blocking the event loop
+        """
+        async def fetch():
+            async with self.__client as client:
+                return await self.__async_exec_cmd(client, command, *args)
+        if self.__cache is None:
+            return await fetch()
+        from .shared_cache import cache_key
+        key = cache_key(command, args)
+        found, result = self.__cache.get(key)
+        if found:
+            return result
+        counter = self.__cache.counter()
+        result = await fetch()
+        self.__cache.put(key, result, counter)
         return result
 
 
@@ -112,7 +167,11 @@ class Punkr(object):
                 build_operation_args(command, *args)
             )
         )
-        data = await client.async_send(message)
+        try:
+            data = await client.async_send(message)
+        finally:
+            if self.__cache is not None and command not in READ_ONLY_COMMANDS:
+                self.__cache.invalidate()
         # Check if we had any error with the operation
         if data["error"] is not None:
             raise PunkrException(data["error"])
@@ -204,8 +263,7 @@ class Punkr(object):
             }
         }
         """
-        with self.__client as client:
-            return self.__exec_cmd(client, Command.LIST_SECRETS)
+        return self.__cached_cmd(Command.LIST_SECRETS)
 
     def list_devices(self):
         """
@@ -422,8 +480,7 @@ class Punkr(object):
             "msg" : "<feedback message>",
         }
         """
-        with self.__client as client:
-            return self.__exec_cmd(client, Command.SECRET_INFO, secret_name)
+        return self.__cached_cmd(Command.SECRET_INFO, secret_name)
 
     def sign_ecdsa(self, secret_name, hash_content):
         """
@@ -453,8 +510,7 @@ class Punkr(object):
             }
         }
         """
-        with self.__client as client:
-            return self.__exec_cmd(client, Command.SSH_PUBLIC_DATA, secret_name)
+        return self.__cached_cmd(Command.SSH_PUBLIC_DATA, secret_name)
 
     def sigin(self, email, device_name):
         """
@@ -573,8 +629,7 @@ class Punkr(object):
             }
         }
         """
-        async with self.__client as client:
-            return await self.__async_exec_cmd(client, Command.LIST_SECRETS)
+        return await self.__async_cached_cmd(Command.LIST_SECRETS)
 
     async def async_list_devices(self):
         """
@@ -791,8 +846,7 @@ class Punkr(object):
             "msg" : "<feedback message>",
         }
         """
-        async with self.__client as client:
-            return await self.__async_exec_cmd(client, Command.SECRET_INFO, secret_name)
+        return await self.__async_cached_cmd(Command.SECRET_INFO, secret_name)
 
     async def async_sign_ecdsa(self, secret_name, hash_content):
         """
@@ -822,8 +876,7 @@ class Punkr(object):
             }
         }
         """
-        async with self.__client as client:
-            return await self.__async_exec_cmd(client, Command.SSH_PUBLIC_DATA, secret_name)
+        return await self.__async_cached_cmd(Command.SSH_PUBLIC_DATA, secret_name)
 
     async def async_sigin(self, email, device_name):
         """
@@ -867,19 +920,27 @@ class Punkr(object):
             ret = await result
             yield ret
 
-    async def async_ordered_batch_commands(self, *args):
+    async def async_ordered_batch_commands(self, *args, max_concurrency=None, return_exceptions=False):
         """
         async_batch_commands receives a variable number of arguments of the type:
         `(Command, [<args list>])`
         where `operation_name` is the name of a command registered in the `Command` enum,
         and the second tuple element is a list with the operation arguments`
+        :param max_concurrency: optional, maximum number of commands in flight at the same time
+        :param return_exceptions: if set, failed commands return their exception in place of the result
         :returns: ordered command results
         """
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
         async def wrapped_command(command_name, *arguments):
             async with RpcTcpClient(self.__address) as client:
                 return await self.__async_exec_cmd(client, command_name, *arguments)
-        commands = [wrapped_command(command_name, *arguments) for command_name, arguments in args]
-        return await asyncio.gather(*commands)
+        async def limited_command(command_name, *arguments):
+            if semaphore is None:
+                return await wrapped_command(command_name, *arguments)
+            async with semaphore:
+                return await wrapped_command(command_name, *arguments)
+        commands = [limited_command(command_name, *arguments) for command_name, arguments in args]
+        return await asyncio.gather(*commands, return_exceptions=return_exceptions)
 
 
 if __name__ == "__main__":
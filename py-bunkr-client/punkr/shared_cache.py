@@ -0,0 +1,224 @@
+import os
+import copy
+import json
+import mmap
+import time
+import zlib
+import fcntl
+import struct
+import threading
+
+DEFAULT_TTL = 30
+DEFAULT_CAPACITY = 4 * 1024 * 1024
+
+_MAGIC = b"PKRC"
+_FORMAT = 1
+# magic, format, invalidation counter, generation, data length
+_HEADER = struct.Struct(">4sIQQQ")
+_FETCH_SLOTS = 1024
+
+
+class SharedResultCache(object):
+    """
+    SharedResultCache shares the results of Punkr read-only commands between the processes of a
+    host through an mmap'd file, so pre-fork workers keep one copy and make one daemon fetch per
+    `ttl`. The file holds a header with an invalidation counter and a write generation, followed
+    by the json entries. Entries remember the counter they were fetched under: a mutating command
+    bumps it, which makes every entry stale in every process at once. Writers hold an exclusive
+    flock and readers a shared one; processes only decode the entries again when the generation
+    changes. Changes made outside of Punkr (e.g. the bunkr cli) are only seen once the ttl expires
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, capacity=DEFAULT_CAPACITY):
+        """
+        :param path: cache file, shared by the processes using the same path
+        :param ttl: seconds a result is served from the cache
+        :param capacity: bytes of the cache file, results that do not fit are not cached
+        """
+        self.path = path
+        self.ttl = ttl
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.__pid = None
+        self.__file = None
+        self.__map = None
+        self.__generation = None
+        self.__entries = {}
+        self.__lock = threading.Lock()
+        self.__fetch_locks = [threading.Lock() for _ in range(_FETCH_SLOTS)]
+
+    def get(self, key):
+        """
+        :param key: cache key, see `cache_key`
+        :return: (True, result) if a fresh result is cached, (False, None) otherwise
+        """
+        with self.__lock:
+            with self.__locked(fcntl.LOCK_SH):
+                counter = self.__refresh()
+                entry = self.__entries.get(key)
+            if entry is None or entry[0] != counter or entry[1] < time.time():
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            return True, copy.deepcopy(entry[2])
+
+    def counter(self):
+        """
+        :return: current invalidation counter
+        """
+        with self.__lock:
+            with self.__locked(fcntl.LOCK_SH):
+                return self.__refresh()
+
+    def put(self, key, result, counter):
+        """
+        :param key: cache key, see `cache_key`
+        :param result: json serializable command result
+        :param counter: invalidation counter read before fetching the result, a result fetched
+            across an invalidation is stored stale
+        :return: None
+        """
+        with self.__lock:
+            with self.__locked(fcntl.LOCK_EX):
+                current = self.__refresh()
+                now = time.time()
+                entries = {k: e for k, e in self.__entries.items() if e[0] == current and e[1] >= now}
+                entries[key] = [counter, now + self.ttl, result]
+                self.__write(current, entries)
+
+    def invalidate(self):
+        """
+        make every cached result stale, in all the processes
+        :return: None
+        """
+        with self.__lock:
+            with self.__locked(fcntl.LOCK_EX):
+                self.__write(self.__refresh() + 1, {})
+
+    def get_or_fetch(self, key, fetch):
+        """
+        serve a result from the cache, or fetch it once for all the processes waiting for it
+        :param key: cache key, see `cache_key`
+        :param fetch: callable returning the result, called on a miss
+        :return: result
+        """
+        found, result = self.get(key)
+        if found:
+            return result
+        slot = zlib.crc32(key.encode()) % _FETCH_SLOTS
+        # threads of a process wait on the slot lock, processes on a byte range lock of the slot
+        with self.__fetch_locks[slot]:
+            with self.__lock:
+                self.__open()
+                fd = self.__file
+            with _FileLock(fd, fcntl.LOCK_EX, slot):
+                found, result = self.get(key)
+                if found:
+                    return result
+                counter = self.counter()
+                result = fetch()
+                self.put(key, result, counter)
+                return copy.deepcopy(result)
+
+    def stats(self):
+        """
+        :return: {"hits", "misses"} of this process
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self.__lock:
+            self.__close()
+
+    def __open(self):
+        # a forked worker reopens the file, flocks of an inherited descriptor are shared with the parent
+        if self.__pid == os.getpid():
+            return
+        self.__close()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < _HEADER.size + 1:
+                os.ftruncate(fd, max(self.capacity, _HEADER.size + 1))
+                os.pwrite(fd, _HEADER.pack(_MAGIC, _FORMAT, 0, 0, 0), 0)
+            size = os.fstat(fd).st_size
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self.__file = fd
+        self.__map = mmap.mmap(fd, size)
+        self.__generation = None
+        self.__entries = {}
+        self.__pid = os.getpid()
+
+    def __close(self):
+        if self.__map is not None:
+            self.__map.close()
+            os.close(self.__file)
+        self.__map = None
+        self.__file = None
+        self.__pid = None
+
+    def __locked(self, operation):
+        self.__open()
+        return _FileLock(self.__file, operation)
+
+    def __refresh(self):
+        """
+        decode the entries if another process wrote them, the caller holds the file lock
+        :return: current invalidation counter
+        """
+        magic, version, counter, generation, length = _HEADER.unpack_from(self.__map, 0)
+        if magic != _MAGIC or version != _FORMAT:
+            raise ValueError(f"{self.path} is not a punkr cache file")
+        if generation != self.__generation:
+            data = self.__map[_HEADER.size:_HEADER.size + length]
+            self.__entries = json.loads(data) if length else {}
+            self.__generation = generation
+        return counter
+
+    def __write(self, counter, entries):
+        data = json.dumps(entries, separators=(",", ":")).encode()
+        if _HEADER.size + len(data) > len(self.__map):
+            # the new result does not fit, keep the previous entries
+            return
+        generation = (self.__generation or 0) + 1
+        self.__map[_HEADER.size:_HEADER.size + len(data)] = data
+        _HEADER.pack_into(self.__map, 0, _MAGIC, _FORMAT, counter, generation, len(data))
+        self.__entries = entries
+        self.__generation = generation
+
+
+class _FileLock(object):
+    """
+    flock of the whole file, or lockf of one byte past the file size when a slot is given
+    """
+    def __init__(self, fd, operation, slot=None):
+        self.fd = fd
+        self.operation = operation
+        self.slot = slot
+
+    def __enter__(self):
+        if self.slot is None:
+            fcntl.flock(self.fd, self.operation)
+        else:
+            fcntl.lockf(self.fd, self.operation, 1, self.__offset(), os.SEEK_SET)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.slot is None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        else:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.__offset(), os.SEEK_SET)
+
+    def __offset(self):
+        # record locks do not need the byte to exist, slots are placed past the mapped data
+        return 1 << 40 | self.slot
+
+
+def cache_key(command, args):
+    """
+    :param command: punkr Command
+    :param args: command arguments
+    :return: key of the command result in a SharedResultCache
+    """
+    return json.dumps([command.value, list(args)])
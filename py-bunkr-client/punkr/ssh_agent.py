@@ -0,0 +1,313 @@
+import os
+import json
+import stat
+import socket
+import base64
+import struct
+import hashlib
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+from .punkr import Command, PunkrException
+from .pool import ConnectionPool, DEFAULT_POOL_SIZE
+
+DEFAULT_AGENT_ADDRESS = "/tmp/punkr_ssh_agent.sock"
+
+# ssh-agent protocol messages (draft-miller-ssh-agent)
+SSH_AGENT_FAILURE = 5
+SSH_AGENTC_REQUEST_IDENTITIES = 11
+SSH_AGENT_IDENTITIES_ANSWER = 12
+SSH_AGENTC_SIGN_REQUEST = 13
+SSH_AGENT_SIGN_RESPONSE = 14
+
+# digest of each supported key type (RFC 5656), Bunkr ssh keys are ECDSA-P256
+KEY_DIGESTS = {
+    "ecdsa-sha2-nistp256": hashlib.sha256,
+}
+
+_MAX_MESSAGE_LENGTH = 256 * 1024
+
+
+def pack_string(data):
+    if isinstance(data, str):
+        data = data.encode()
+    return struct.pack(">I", len(data)) + data
+
+
+def pack_mpint(number):
+    if number == 0:
+        return pack_string(b"")
+    data = number.to_bytes(number.bit_length() // 8 + 1, "big")
+    return pack_string(data)
+
+
+def unpack_string(data, offset=0):
+    """
+    :return: (string bytes, offset after the string)
+    """
+    if offset + 4 > len(data):
+        raise ValueError("Truncated ssh agent message")
+    length, = struct.unpack_from(">I", data, offset)
+    end = offset + 4 + length
+    if end > len(data):
+        raise ValueError("Truncated ssh agent message")
+    return data[offset + 4:end], end
+
+
+class PublicKeyIndex(object):
+    """
+    PublicKeyIndex maps the ssh public key blobs of Bunkr secrets to their secret names. It is
+    optionally persisted as json `{secret name: authorized_keys line}`, so identities are listed
+    without asking the daemon
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: json file the index is persisted in, in memory only if None
+        """
+        self.path = path
+        self.__keys = {}
+        self.__lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                for secret_name, public_key in json.load(f).items():
+                    self.add(secret_name, public_key, save=False)
+
+    def add(self, secret_name, public_key, save=True):
+        """
+        :param secret_name: Bunkr secret name of the key
+        :param public_key: authorized_keys line of the key, `<type> <b64 blob> [comment]`
+        :param save: flag to persist the index
+        :return: public key blob
+        """
+        fields = public_key.split()
+        if len(fields) < 2 or fields[0] not in KEY_DIGESTS:
+            raise ValueError(f"Unsupported ssh public key for secret {secret_name}: {public_key}")
+        blob = base64.b64decode(fields[1])
+        with self.__lock:
+            self.__keys = {b: k for b, k in self.__keys.items() if k["secret_name"] != secret_name}
+            self.__keys[blob] = {"secret_name": secret_name, "type": fields[0], "public_key": public_key}
+        if save:
+            self.save()
+        return blob
+
+    def remove(self, secret_name):
+        with self.__lock:
+            self.__keys = {b: k for b, k in self.__keys.items() if k["secret_name"] != secret_name}
+        self.save()
+
+    def get(self, blob):
+        """
+        :param blob: public key blob
+        :return: {"secret_name", "type", "public_key"}, None if the key is unknown
+        """
+        with self.__lock:
+            return self.__keys.get(blob)
+
+    def identities(self):
+        """
+        :return: list of (public key blob, secret name)
+        """
+        with self.__lock:
+            return [(blob, key["secret_name"]) for blob, key in self.__keys.items()]
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.__lock:
+            data = {key["secret_name"]: key["public_key"] for key in self.__keys.values()}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def socket_answers(address):
+    """
+    :param address: path of a unix socket
+    :return: True if a server accepts connections on the socket
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(address)
+        except OSError:
+            return False
+    return True
+
+
+class SSHAgent(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    SSHAgent is an ssh-agent protocol server whose keys live in Bunkr.
+    Identities are listed from a PublicKeyIndex of the imported secrets, without a daemon round
+    trip, and sign requests are turned into SIGN-ECDSA commands over a ConnectionPool. Every
+    client connection is served in its own thread, so ssh sessions to many hosts sign concurrently
+    """
+    daemon_threads = True
+
+    def __init__(self, bunkr_address, agent_address=DEFAULT_AGENT_ADDRESS, index_path=None, pool_size=DEFAULT_POOL_SIZE):
+        """
+        :param bunkr_address: path of the Bunkr daemon unix socket
+        :param agent_address: path of the agent unix socket, to be set as SSH_AUTH_SOCK
+        :param index_path: json file persisting the imported public keys, in memory only if None
+        :param pool_size: maximum number of connections to the Bunkr daemon
+        :raises: RuntimeError if an agent is already listening on the address, or it is not a socket
+        """
+        if os.path.lexists(agent_address):
+            if not stat.S_ISSOCK(os.lstat(agent_address).st_mode):
+                raise RuntimeError(f"Refusing to replace {agent_address}: it is not a socket")
+            if socket_answers(agent_address):
+                raise RuntimeError(f"An agent is already running on {agent_address}")
+            # left over by an agent that did not stop cleanly
+            os.remove(agent_address)
+        self.address = agent_address
+        self.pool = ConnectionPool(bunkr_address, pool_size)
+        self.index = PublicKeyIndex(index_path)
+        # the socket is created owner only, a chmod after bind would leave it open to other users meanwhile
+        umask = os.umask(0o177)
+        try:
+            super().__init__(agent_address, _AgentHandler)
+        finally:
+            os.umask(umask)
+
+    def import_key(self, secret_name):
+        """
+        add the ssh public key of a Bunkr secret to the agent
+        :param secret_name: name of the ECDSA ssh key secret
+        :return: authorized_keys line of the key
+        :raises: PunkrException, ValueError if the key type is not supported
+        """
+        result = self.pool.execute(Command.SSH_PUBLIC_DATA, secret_name)
+        public_key = base64.b64decode(result["public_data"]["public_key"]).decode().strip()
+        self.index.add(secret_name, public_key)
+        return public_key
+
+    def refresh(self):
+        """
+        fetch again the public keys of all the indexed secrets, concurrently
+        :return: {secret name: error message} of the secrets that could not be refreshed
+        """
+        secret_names = [secret_name for _, secret_name in self.index.identities()]
+        errors = {}
+        with ThreadPoolExecutor(self.pool.size) as executor:
+            for secret_name, future in [(s, executor.submit(self.import_key, s)) for s in secret_names]:
+                try:
+                    future.result()
+                except (Exception, PunkrException) as e:
+                    errors[secret_name] = str(e)
+        return errors
+
+    def identities(self):
+        """
+        :return: SSH_AGENT_IDENTITIES_ANSWER payload
+        """
+        identities = self.index.identities()
+        return bytes([SSH_AGENT_IDENTITIES_ANSWER]) + struct.pack(">I", len(identities)) + b"".join(
+            pack_string(blob) + pack_string(secret_name) for blob, secret_name in identities
+        )
+
+    def sign(self, blob, data):
+        """
+        :param blob: public key blob of the signing key
+        :param data: data to sign
+        :return: SSH_AGENT_SIGN_RESPONSE payload
+        :raises: KeyError if the key is unknown, PunkrException if Bunkr fails to sign
+        """
+        key = self.index.get(blob)
+        if key is None:
+            raise KeyError("Unknown ssh key")
+        digest = KEY_DIGESTS[key["type"]](data).digest()
+        result = self.pool.execute(Command.SIGN_ECDSA, key["secret_name"], str(base64.b64encode(digest), "utf-8"))
+        r = int(base64.b64decode(result["r"]))
+        s = int(base64.b64decode(result["s"]))
+        signature = pack_string(key["type"]) + pack_string(pack_mpint(r) + pack_mpint(s))
+        return bytes([SSH_AGENT_SIGN_RESPONSE]) + pack_string(signature)
+
+    def handle_message(self, message):
+        """
+        :param message: ssh agent request payload, without the length prefix
+        :return: response payload
+        """
+        try:
+            if message[:1] == bytes([SSH_AGENTC_REQUEST_IDENTITIES]):
+                return self.identities()
+            if message[:1] == bytes([SSH_AGENTC_SIGN_REQUEST]):
+                blob, offset = unpack_string(message, 1)
+                data, _ = unpack_string(message, offset)
+                return self.sign(blob, data)
+        except (Exception, PunkrException) as e:
+            print(f"ssh agent request failed with: {e}")
+        # keys are managed through Bunkr, adding, removing and locking them is not supported
+        return bytes([SSH_AGENT_FAILURE])
+
+    def start(self):
+        """
+        serve requests in a background thread
+        :return: self
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """
+        stop serving, remove the socket and close the daemon connections
+        """
+        self.shutdown()
+        self.server_close()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class _AgentHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            header = self.__read(4)
+            if header is None:
+                return
+            length, = struct.unpack(">I", header)
+            if length > _MAX_MESSAGE_LENGTH:
+                return
+            message = self.__read(length)
+            if message is None:
+                return
+            response = self.server.handle_message(message)
+            self.request.sendall(struct.pack(">I", len(response)) + response)
+
+    def __read(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+
+if __name__ == "__main__":
+    import argparse
+    import signal
+    import sys
+    parser = argparse.ArgumentParser(description="ssh-agent serving the ssh keys stored in Bunkr")
+    parser.add_argument("keys", nargs="*", help="names of the ssh key secrets to import")
+    parser.add_argument("--bunkr", default="/tmp/bunkr_daemon.sock", help="Bunkr daemon socket")
+    parser.add_argument("--socket", default=DEFAULT_AGENT_ADDRESS, help="agent socket, to be set as SSH_AUTH_SOCK")
+    parser.add_argument("--index", default=os.path.expanduser("~/.bunkr/punkr_ssh_agent.json"), help="public key index file")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE, help="maximum connections to the Bunkr daemon")
+    args = parser.parse_args()
+    try:
+        agent = SSHAgent(args.bunkr, args.socket, args.index, args.pool_size)
+    except RuntimeError as e:
+        parser.error(str(e))
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for secret_name in args.keys:
+            print(agent.import_key(secret_name))
+        print(f"SSH_AUTH_SOCK={args.socket}; export SSH_AUTH_SOCK;")
+        agent.serve_forever()
+    finally:
+        agent.server_close()
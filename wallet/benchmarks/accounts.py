@@ -0,0 +1,67 @@
+"""
+Account memory benchmark over synthetic wallets.
+Compares the accounts held as json dicts (the previous `Wallet.wallet` list) with the compact
+`accounts.Account` records loaded from the json and SQLite wallet stores.
+
+Run from the wallet directory: `python -m benchmarks.accounts`
+"""
+import os, gc, json, time, random, argparse, tempfile, tracemalloc
+
+from bitcoin.wallet import P2PKHBitcoinAddress
+
+from bunkrwallet.storage import JsonWalletStore, SQLiteWalletStore
+
+def synthetic_wallet(rng, n_accounts):
+	"""
+	:return: [header, *accounts] in the json wallet format
+	"""
+	statuses = ("fresh", "in use", "used")
+	accounts = []
+	for _ in range(n_accounts):
+		address = str(P2PKHBitcoinAddress.from_bytes(rng.randbytes(20)))
+		accounts.append({"address": address, "pubkey_hex": "02" + rng.randbytes(32).hex(), "secret_name": address, "status": rng.choice(statuses)})
+	return [{"NETWORK": "BTC", "LAST_UPDATE_TIME": str(round(time.time()))}, *accounts]
+
+def measure(load):
+	"""
+	:return: (bytes retained by the loaded accounts, seconds to load them)
+	"""
+	gc.collect()
+	tracemalloc.start()
+	start = time.perf_counter()
+	accounts = load()
+	seconds = time.perf_counter() - start
+	retained = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	del accounts
+	return retained, seconds
+
+def run(seed=0, n_accounts=100000):
+	rng = random.Random(seed)
+	wallet_file = synthetic_wallet(rng, n_accounts)
+	with tempfile.TemporaryDirectory() as directory:
+		json_path = os.path.join(directory, "w.json")
+		with open(json_path, 'w') as f:
+			json.dump(wallet_file, f)
+		sqlite_store = SQLiteWalletStore(os.path.join(directory, "w.db"))
+		sqlite_store.create(wallet_file[0], wallet_file[1:])
+		def load_dicts():
+			with open(json_path, 'r') as f:
+				return json.load(f)[1:]
+		results = {
+			"json dicts": measure(load_dicts),
+			"json store": measure(lambda: JsonWalletStore(json_path).load()[1]),
+			"sqlite store": measure(lambda: sqlite_store.load()[1]),
+		}
+		sqlite_store.close()
+	return {name: {"bytes_per_account": retained/n_accounts, "mb": retained/2**20, "load_seconds": seconds} for name, (retained, seconds) in results.items()}
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--accounts", type=int, default=100000)
+	args = parser.parse_args()
+	results = run(args.seed, args.accounts)
+	print(f"{'accounts as':<14} {'bytes/account':>14} {'MB':>8} {'load s':>8}")
+	for name, r in results.items():
+		print(f"{name:<14} {r['bytes_per_account']:>14.0f} {r['mb']:>8.1f} {r['load_seconds']:>8.2f}")
@@ -0,0 +1,161 @@
+"""
+Benchmark of the `bunkrwallet.btc` cryptographic and encoding primitives, offline.
+Every case is timed with `timeit` alongside a fixed calibration loop of pure Python big integer
+work, and scored as the ratio of the two: the median ratio of `--repeat` runs. Scores, unlike
+seconds, carry over between runs on a busy or throttled machine. They are compared with the
+baseline stored in `benchmarks/btc_baseline.json`: the run fails when a case scores more than
+`--threshold`, plus the spread measured between its repeats, above its baseline. Scores still
+depend on the interpreter and the cpu, regenerate the baseline with `--save` on each machine.
+
+Run from the wallet directory: `python -m benchmarks.btc`
+"""
+import os, sys, json, random, timeit, argparse, platform, statistics
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "btc_baseline.json")
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_REPEAT = 5
+# fewer repeats do not measure the noise the threshold is widened by
+MIN_REPEAT = 3
+INPUT_COUNTS = (1, 10, 100, 500)
+BASELINE_FORMAT = 2
+# secp256k1 field prime, the calibration loop does the modular arithmetic the primitives are made of
+_P = 2**256 - 2**32 - 977
+
+def calibration():
+	"""
+	fixed workload the cases are scored against
+	"""
+	n = 1
+	for i in range(16):
+		n = pow(n + i, _P - 2, _P)
+	return format(n, "064x")
+
+def cases(seed=0):
+	"""
+	:return: {case name: callable running the primitive once}
+	"""
+	from bitcoin.core import COutPoint, CMutableTxIn, CMutableTxOut, CMutableTransaction, lx
+	from bitcoin.wallet import CBitcoinAddress
+	from bunkrwallet import btc
+	btc.SelectParams("testnet")
+	rng = random.Random(seed)
+	private = rng.randrange(1, btc.N)
+	point = private*btc.G
+	public = btc.convert_point_to_public(point)
+	address = btc.convert_public_to_address(public, True)
+	payload = "6f" + rng.getrandbits(192).to_bytes(24, "big").hex()
+	encoded = btc.b58encode(payload)
+	digest = rng.getrandbits(256)
+	signature = btc.EC_sign(digest, private)
+
+	def transaction(n_inputs):
+		inputs = [CMutableTxIn(COutPoint(lx(f"{i:064x}"), 0)) for i in range(n_inputs)]
+		return CMutableTransaction(inputs, [CMutableTxOut(10000, CBitcoinAddress(address).to_scriptPubKey())])
+
+	benchmarks = {
+		"gen_EC_keypair": btc.gen_EC_keypair,
+		"EC_sign": lambda: btc.EC_sign(digest, private),
+		"EC_verify": lambda: btc.EC_verify(digest, signature, point),
+		"convert_point_to_public": lambda: btc.convert_point_to_public(point),
+		"convert_public_to_address": lambda: btc.convert_public_to_address(public, True),
+		"b58encode": lambda: btc.b58encode(payload),
+		"b58decode": lambda: btc.b58decode(encoded),
+		"rs_signature_to_DER": lambda: btc.rs_signature_to_DER(*signature),
+	}
+	for n in INPUT_COUNTS:
+		tx = transaction(n)
+		benchmarks[f"prepare_signatures[{n}]"] = lambda tx=tx, n=n: btc.prepare_signatures(tx, [public]*n)
+		benchmarks[f"apply_signatures[{n}]"] = lambda tx=tx, n=n: btc.apply_signatures(tx, [public]*n, [signature]*n)
+	return benchmarks
+
+def measure(benchmark, repeat=DEFAULT_REPEAT):
+	"""
+	:param benchmark: callable to time
+	:param repeat: timed runs, each paired with a run of the calibration loop
+	:return: {"seconds": median seconds per call, "score": median ratio to the calibration loop,
+		"noise": spread of the ratios relative to their median}
+	"""
+	timer, reference = timeit.Timer(benchmark), timeit.Timer(calibration)
+	number, _ = timer.autorange()
+	reference_number, _ = reference.autorange()
+	seconds, scores = [], []
+	for _ in range(repeat):
+		unit = reference.timeit(reference_number) / reference_number
+		seconds.append(timer.timeit(number) / number)
+		scores.append(seconds[-1] / unit)
+	score = statistics.median(scores)
+	return {"seconds": statistics.median(seconds), "score": score, "noise": (max(scores) - min(scores)) / score}
+
+def run(names=None, repeat=DEFAULT_REPEAT, seed=0):
+	"""
+	:param names: cases to run, all of them if None
+	:param repeat: timed runs per case, see `measure`
+	:return: {case name: {"seconds", "score", "noise"}}
+	"""
+	return {name: measure(benchmark, repeat) for name, benchmark in cases(seed).items() if names is None or name in names}
+
+def load_baseline(path=BASELINE_PATH):
+	"""
+	:return: {case name: {"score", "noise"}}, empty if there is no baseline or it holds seconds
+		of a previous format, which do not compare with scores
+	"""
+	if not os.path.exists(path):
+		return {}
+	with open(path, "r") as f:
+		baseline = json.load(f)
+	return baseline["results"] if baseline.get("format") == BASELINE_FORMAT else {}
+
+def save_baseline(results, path=BASELINE_PATH):
+	"""
+	:param results: {case name: {"score", "noise", ...}}
+	"""
+	results = {name: {"score": result["score"], "noise": result["noise"]} for name, result in results.items()}
+	with open(path, "w") as f:
+		json.dump({"format": BASELINE_FORMAT, "python": platform.python_version(), "machine": platform.machine(),
+			"processor": platform.processor(), "results": results}, f, indent=2, sort_keys=True)
+		f.write("\n")
+
+def regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+	"""
+	:param results: {case name: {"score", "noise"}}
+	:param baseline: {case name: {"score", "noise"}}
+	:param threshold: tolerated slowdown on top of the noise of the case, 0.25 for 25%
+	:return: {case name: ratio of the score to the baseline} of the cases slower than the threshold
+		plus the larger spread measured between the repeats, now or in the baseline
+	"""
+	slower = {}
+	for name, result in results.items():
+		if name not in baseline:
+			continue
+		reference = baseline[name]
+		tolerance = threshold + max(result["noise"], reference.get("noise", 0.0))
+		if result["score"] > reference["score"] * (1 + tolerance):
+			slower[name] = result["score"] / reference["score"]
+	return slower
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("cases", nargs="*", help="cases to run, all of them by default")
+	parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+	parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+	parser.add_argument("--baseline", default=BASELINE_PATH)
+	parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+	args = parser.parse_args()
+	if args.repeat < MIN_REPEAT:
+		parser.error(f"--repeat must be at least {MIN_REPEAT}, the spread of the repeats is part of the threshold")
+	results = run(args.cases or None, args.repeat)
+	baseline = load_baseline(args.baseline)
+	slower = regressions(results, baseline, args.threshold)
+	if not baseline:
+		print(f"No baseline in {args.baseline}, record one for this machine with --save")
+	print(f"{'case':<26} {'us/call':>12} {'score':>10} {'baseline':>10} {'change':>8} {'noise':>6}")
+	for name, result in results.items():
+		reference = baseline.get(name)
+		change = f"{result['score']/reference['score'] - 1:>+8.0%}" if reference else f"{'':>8}"
+		print(f"{name:<26} {result['seconds']*1e6:>12.2f} {result['score']:>10.4f} {reference['score'] if reference else float('nan'):>10.4f} {change} {result['noise']:>6.0%}{'  REGRESSION' if name in slower else ''}")
+	if args.save:
+		save_baseline({**baseline, **results}, args.baseline)
+		print(f"Baseline saved to {args.baseline}")
+	elif slower:
+		print(f"{len(slower)} case(s) more than {args.threshold:.0%}, plus their noise, slower than the baseline")
+		sys.exit(1)
@@ -0,0 +1,76 @@
+"""
+Coin selection benchmark over synthetic UTXO sets.
+Compares `coinselect.select_coins` with the previous account greedy selection
+(shuffle the accounts and take whole accounts until the target is covered).
+
+Run from the wallet directory: `python -m benchmarks.coinselect`
+"""
+import time, random, argparse, statistics
+
+from bunkrwallet.coinselect import select_coins
+
+def synthetic_wallet(rng, kind, n_accounts, utxos_per_account):
+	"""
+	:return: {address: [utxos]}
+	"""
+	def value():
+		if kind == "uniform":
+			return rng.randint(1000, 1000000)
+		if kind == "exponential":
+			return int(rng.expovariate(1/200000)) + 546
+		# mostly small deposits and a few large ones
+		return rng.randint(546, 20000) if rng.random() < 0.9 else rng.randint(500000, 5000000)
+	return {
+		f"addr{a}": [{"value": value(), "index": i, "txid": f"{a:032x}{i:032x}"} for i in range(rng.randint(1, utxos_per_account))]
+		for a in range(n_accounts)
+	}
+
+def account_greedy(wallet, target, rng):
+	accounts = list(wallet.values())
+	rng.shuffle(accounts)
+	selected, total = [], 0
+	for utxos in accounts:
+		selected.extend(utxos)
+		total += sum(u["value"] for u in utxos)
+		if total >= target:
+			return selected
+	raise ValueError("not enough funds")
+
+def run(seed=0, rounds=200, n_accounts=200, utxos_per_account=5):
+	rng = random.Random(seed)
+	results = {}
+	for kind in ("uniform", "exponential", "fragmented"):
+		stats = {"greedy_inputs": [], "inputs": [], "changeless": 0, "waste": [], "seconds": []}
+		for _ in range(rounds):
+			wallet = synthetic_wallet(rng, kind, n_accounts, utxos_per_account)
+			utxos = [dict(u, address=a) for a, us in wallet.items() for u in us]
+			target = rng.randint(10000, sum(u["value"] for u in utxos)//4)
+			stats["greedy_inputs"].append(len(account_greedy(wallet, target, rng)))
+			start = time.perf_counter()
+			selected, change = select_coins(utxos, target)
+			stats["seconds"].append(time.perf_counter() - start)
+			stats["inputs"].append(len(selected))
+			if change == 0:
+				stats["changeless"] += 1
+				stats["waste"].append(sum(u["value"] for u in selected) - target)
+		results[kind] = {
+			"greedy_mean_inputs": statistics.mean(stats["greedy_inputs"]),
+			"mean_inputs": statistics.mean(stats["inputs"]),
+			"changeless_ratio": stats["changeless"]/rounds,
+			"mean_changeless_waste": statistics.mean(stats["waste"]) if stats["waste"] else 0,
+			"mean_ms": 1000*statistics.mean(stats["seconds"]),
+			"max_ms": 1000*max(stats["seconds"]),
+		}
+	return results
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--rounds", type=int, default=200)
+	parser.add_argument("--accounts", type=int, default=200)
+	parser.add_argument("--utxos-per-account", type=int, default=5)
+	args = parser.parse_args()
+	results = run(args.seed, args.rounds, args.accounts, args.utxos_per_account)
+	print(f"{'utxo set':<12} {'greedy inputs':>14} {'inputs':>8} {'changeless':>11} {'waste':>8} {'mean ms':>8} {'max ms':>8}")
+	for kind, r in results.items():
+		print(f"{kind:<12} {r['greedy_mean_inputs']:>14.1f} {r['mean_inputs']:>8.1f} {r['changeless_ratio']:>11.0%} {r['mean_changeless_waste']:>8.0f} {r['mean_ms']:>8.2f} {r['max_ms']:>8.2f}")
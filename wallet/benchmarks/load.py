@@ -0,0 +1,223 @@
+"""
+End to end load test of BunkrWallet, offline.
+A FakeBunkrServer stands in for the Bunkr daemon and a FakeChainServer for the blockcypher and
+chain.so apis, both with a tunable latency. The harness creates wallets, grows them to the given
+number of addresses and funds them with synthetic UTXOs, then drives `create_wallet`,
+`add_addresses`, `show_balance` and `send` (followed by `push_transaction`) at a target rate from
+a pool of worker threads. Operations arrive on a fixed schedule, so their latency, measured from
+the scheduled arrival, includes the time they queue behind a saturated pool.
+
+Run from the wallet directory: `python -m benchmarks.load`
+"""
+import io, os, json, time, random, argparse, tempfile, itertools, threading, contextlib
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from bunkrwallet.chain import ChainClient
+from bunkrwallet.scheduler import RequestScheduler
+from bunkrwallet.testing import FakeBunkrServer, FakeChainServer
+from bunkrwallet.wallet import BunkrWallet
+
+DEFAULT_MIX = {"show_balance": 0.6, "send": 0.25, "add_addresses": 0.1, "create_wallet": 0.05}
+OPERATIONS = ("create_wallet", "add_addresses", "show_balance", "send", "push_transaction")
+PERCENTILES = (50, 90, 99)
+
+def percentile(values, p):
+	"""
+	:param values: sorted values
+	:param p: percentile, 0 to 100
+	:return: nearest rank percentile, None if there are no values
+	"""
+	if not values:
+		return None
+	return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+class LoadRecorder(object):
+	"""
+	LoadRecorder collects the latencies and errors of the operations run by the workers
+	"""
+	def __init__(self):
+		self.latencies = {}
+		self.errors = {}
+		self.__lock = threading.Lock()
+
+	@contextlib.contextmanager
+	def record(self, operation, since=None):
+		"""
+		record the latency of the block, or its error
+		:param operation: operation name
+		:param since: perf_counter time the latency is measured from, the start of the block if None
+		"""
+		start = since if since is not None else time.perf_counter()
+		try:
+			yield
+		except Exception as e:
+			with self.__lock:
+				self.errors.setdefault(operation, []).append(f"{type(e).__name__}: {e}")
+			return
+		latency = time.perf_counter() - start
+		with self.__lock:
+			self.latencies.setdefault(operation, []).append(latency)
+
+	def report(self, elapsed):
+		"""
+		:param elapsed: seconds of the driven phase
+		:return: {operation: {"count", "errors", "throughput", "p50", "p90", "p99", "max"}}, in seconds
+		"""
+		with self.__lock:
+			report = {}
+			for operation in OPERATIONS:
+				latencies = sorted(self.latencies.get(operation, []))
+				errors = self.errors.get(operation, [])
+				if not latencies and not errors:
+					continue
+				report[operation] = dict(
+					count=len(latencies),
+					errors=len(errors),
+					throughput=len(latencies) / elapsed if elapsed else None,
+					**{f"p{p}": percentile(latencies, p) for p in PERCENTILES},
+					max=latencies[-1] if latencies else None,
+				)
+				if errors:
+					report[operation]["first_error"] = errors[0]
+			return report
+
+def run(wallets=4, addresses=50, funded=0.5, utxos=2, rate=10.0, duration=10.0, concurrency=8, mix=DEFAULT_MIX,
+		bunkr_latency=0.002, chain_latency=0.02, seed=0):
+	"""
+	:param wallets: wallets created before the driven phase
+	:param addresses: addresses of each of those wallets
+	:param funded: fraction of those addresses holding UTXOs, the others are left for change and deposits
+	:param utxos: synthetic UTXOs funding each address
+	:param rate: operations per second of the driven phase
+	:param duration: seconds of the driven phase
+	:param concurrency: worker threads running the operations
+	:param mix: {operation: weight} of the driven phase
+	:param bunkr_latency: seconds added to every Bunkr command
+	:param chain_latency: seconds added to every chain api request
+	:param seed: random seed of the UTXO values and the operation schedule
+	:return: {"setup": report, "load": report, "elapsed": seconds, "bunkr_calls": {command: n}, "chain_requests": n}
+	"""
+	rng = random.Random(seed)
+	rng_lock = threading.Lock()
+	with tempfile.TemporaryDirectory() as directory, \
+			FakeChainServer(chain_latency) as chain, \
+			FakeBunkrServer(os.path.join(directory, "bunkr.sock"), bunkr_latency) as bunkr, \
+			contextlib.redirect_stdout(io.StringIO()):
+		backend = ChainClient(chain.blockcypher_url, chain.chainso_url, scheduler=RequestScheduler({}))
+		bunkr_wallet = BunkrWallet("wallets", bunkr.address, directory, backend)
+		names = (f"wallet{i}" for i in itertools.count())
+		names_lock = threading.Lock()
+
+		def create_wallet():
+			with names_lock:
+				name = next(names)
+			return bunkr_wallet.create_wallet(name, testnet=True)
+
+		def send(wallet, recorder, since):
+			with rng_lock:
+				receiver = rng.choice(list(bunkr_wallet.wallets.values()))
+				value = rng.randint(1000, 50000)
+			transaction = None
+			with recorder.record("send", since):
+				target = receiver.show_fresh_address()
+				transaction = wallet.send([{"address": target, "value": value}], 1000)
+			if transaction is not None:
+				with recorder.record("push_transaction"):
+					wallet.push_transaction(transaction)
+
+		setup = LoadRecorder()
+		start = time.perf_counter()
+		with ThreadPoolExecutor(concurrency) as executor:
+			wait([executor.submit(_recorded, setup, "create_wallet", None, create_wallet) for _ in range(wallets)])
+			grown = []
+			for wallet in list(bunkr_wallet.wallets.values()):
+				missing = addresses - len(wallet.addresses())
+				# large batches are split so the workers add them concurrently
+				while missing > 0:
+					n = min(missing, 25)
+					grown.append(executor.submit(_recorded, setup, "add_addresses", None, lambda wallet=wallet, n=n: wallet.add_addresses(n)))
+					missing -= n
+			wait(grown)
+		for wallet in bunkr_wallet.wallets.values():
+			wallet_addresses = wallet.addresses()
+			for address in wallet_addresses[:round(len(wallet_addresses) * funded)]:
+				for _ in range(utxos):
+					chain.add_utxo(address, rng.randint(10000, 1000000))
+		setup_elapsed = time.perf_counter() - start
+		# wallets created under load are not funded, only the setup ones send
+		senders = list(bunkr_wallet.wallets.values())
+
+		load = LoadRecorder()
+		operations, weights = zip(*mix.items())
+		start = time.perf_counter()
+		with ThreadPoolExecutor(concurrency) as executor:
+			futures = []
+			for i in itertools.count():
+				due = start + i / rate
+				if due - start >= duration:
+					break
+				time.sleep(max(0.0, due - time.perf_counter()))
+				with rng_lock:
+					operation = rng.choices(operations, weights)[0]
+					wallet = rng.choice(list(bunkr_wallet.wallets.values()))
+				if operation == "send":
+					with rng_lock:
+						sender = rng.choice(senders)
+					futures.append(executor.submit(send, sender, load, due))
+					continue
+				task = {
+					"create_wallet": create_wallet,
+					"add_addresses": lambda wallet=wallet: wallet.add_addresses(1),
+					"show_balance": wallet.show_balance,
+				}[operation]
+				futures.append(executor.submit(_recorded, load, operation, due, task))
+			wait(futures)
+		elapsed = time.perf_counter() - start
+		return {
+			"setup": setup.report(setup_elapsed),
+			"load": load.report(elapsed),
+			"elapsed": elapsed,
+			"bunkr_calls": dict(bunkr.calls),
+			"chain_requests": chain.requests,
+		}
+
+def _recorded(recorder, operation, since, task):
+	with recorder.record(operation, since):
+		task()
+
+def _format(report):
+	lines = [f"{'operation':<18} {'count':>6} {'errors':>6} {'ops/s':>8} " + " ".join(f"{f'p{p} ms':>9}" for p in PERCENTILES) + f" {'max ms':>9}"]
+	for operation, stats in report.items():
+		ms = lambda seconds: f"{seconds*1000:>9.1f}" if seconds is not None else f"{'-':>9}"
+		lines.append(f"{operation:<18} {stats['count']:>6} {stats['errors']:>6} {stats['throughput']:>8.2f} "
+			+ " ".join(ms(stats[f'p{p}']) for p in PERCENTILES) + f" {ms(stats['max'])}")
+		if "first_error" in stats:
+			lines.append(f"  first error: {stats['first_error']}")
+	return "\n".join(lines)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--wallets", type=int, default=4)
+	parser.add_argument("--addresses", type=int, default=50, help="addresses per wallet")
+	parser.add_argument("--funded", type=float, default=0.5, help="fraction of the addresses holding UTXOs")
+	parser.add_argument("--utxos", type=int, default=2, help="UTXOs per address")
+	parser.add_argument("--rate", type=float, default=10.0, help="operations per second")
+	parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+	parser.add_argument("--concurrency", type=int, default=8)
+	parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX, help="json {operation: weight}")
+	parser.add_argument("--bunkr-latency", type=float, default=0.002, help="seconds per Bunkr command")
+	parser.add_argument("--chain-latency", type=float, default=0.02, help="seconds per chain api request")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--json", action="store_true", help="print the report as json")
+	args = parser.parse_args()
+	results = run(args.wallets, args.addresses, args.funded, args.utxos, args.rate, args.duration, args.concurrency, args.mix,
+		args.bunkr_latency, args.chain_latency, args.seed)
+	if args.json:
+		print(json.dumps(results, indent=2))
+	else:
+		print(f"Setup: {args.wallets} wallets of {args.addresses} addresses")
+		print(_format(results["setup"]))
+		print(f"\nLoad: {args.rate} ops/s for {results['elapsed']:.1f}s, {args.concurrency} workers")
+		print(_format(results["load"]))
+		print(f"\nBunkr commands: {results['bunkr_calls']}")
+		print(f"Chain api requests: {results['chain_requests']}")
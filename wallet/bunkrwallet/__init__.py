@@ -1 +1,22 @@
-from .wallet import *
\ No newline at end of file
+import importlib
+
+# the package namespace is resolved lazily (PEP 562): `bunkrwallet.BunkrWallet` only imports the
+# wallet module, the bitcoin primitives and the Bunkr client are imported when first looked up
+_LAZY_MODULES = (".wallet", ".btc", "punkr")
+
+
+def __getattr__(name):
+	if name == "__all__":
+		return sorted({attr for module in _LAZY_MODULES for attr in dir(_module(module)) if not attr.startswith("_")})
+	for module in _LAZY_MODULES:
+		try:
+			return getattr(_module(module), name)
+		except AttributeError:
+			pass
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+	return sorted(set(globals()) | set(__getattr__("__all__")))
+
+def _module(name):
+	return importlib.import_module(name, __name__)
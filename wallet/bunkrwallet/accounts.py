@@ -0,0 +1,76 @@
+import sys
+from collections.abc import Mapping
+
+ACCOUNT_FIELDS = ("address", "pubkey_hex", "secret_name", "status")
+
+
+class Account(Mapping):
+	"""
+	Account is the compact record of a wallet address: raw public key bytes instead of hex, no
+	secret name when it is the address (the default), interned status strings and no per record
+	dict. It reads like the `{"address", "pubkey_hex", "secret_name", "status"}` dict it replaces
+	"""
+	__slots__ = ("address", "pubkey", "_secret_name", "_status")
+
+	def __init__(self, address, pubkey_hex, secret_name=None, status="fresh"):
+		"""
+		:param address: bitcoin address
+		:param pubkey_hex: hex encoded public key
+		:param secret_name: bunkr secret name, the address if None
+		:param status: "fresh", "in use" or "used"
+		"""
+		self.address = address
+		self.pubkey = bytes.fromhex(pubkey_hex)
+		self._secret_name = None if secret_name == address else secret_name
+		self._status = sys.intern(status)
+
+	@classmethod
+	def from_dict(cls, acct):
+		"""
+		:param acct: account dict, or Account
+		:return: Account
+		"""
+		if isinstance(acct, cls):
+			return acct
+		return cls(acct["address"], acct["pubkey_hex"], acct["secret_name"], acct["status"])
+
+	@property
+	def pubkey_hex(self):
+		return self.pubkey.hex()
+
+	@property
+	def secret_name(self):
+		return self._secret_name if self._secret_name is not None else self.address
+
+	@property
+	def status(self):
+		return self._status
+
+	@status.setter
+	def status(self, status):
+		self._status = sys.intern(status)
+
+	def to_dict(self):
+		"""
+		:return: the json wallet format of the account
+		"""
+		return {field: self[field] for field in ACCOUNT_FIELDS}
+
+	def __getitem__(self, field):
+		if field not in ACCOUNT_FIELDS:
+			raise KeyError(field)
+		return getattr(self, field)
+
+	def __setitem__(self, field, value):
+		if field != "status":
+			raise KeyError(f"Account field {field} is read only")
+		self.status = value
+
+	def __iter__(self):
+		return iter(ACCOUNT_FIELDS)
+
+	def __len__(self):
+		return len(ACCOUNT_FIELDS)
+
+	def __repr__(self):
+		return f"Account({self.address}, {self.status})"
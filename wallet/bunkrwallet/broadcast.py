@@ -0,0 +1,252 @@
+import time, threading
+
+from .chain import default_backend
+from .refresh import account_status, CONFIRMED_AFTER
+from .scheduler import PRIORITY_BACKGROUND
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 2
+DEFAULT_POLL_INTERVAL = 30
+DEFAULT_MAX_POLL_INTERVAL = 600
+DEFAULT_DROP_TIMEOUT = 86400
+
+QUEUED = "queued"
+BROADCAST = "broadcast"
+CONFIRMED = "confirmed"
+FAILED = "failed"
+PROGRESS = (QUEUED, BROADCAST, CONFIRMED)
+
+
+class Broadcast(object):
+	"""
+	Broadcast tracks a signed transaction submitted to a BroadcastPipeline, from its publication
+	to its confirmation
+	"""
+	def __init__(self, transaction, txid, addresses, outpoints):
+		self.transaction = transaction
+		self.txid = txid
+		self.addresses = addresses
+		self.outpoints = outpoints
+		self.status = QUEUED
+		self.confirmations = None
+		self.attempts = 0
+		self.backend = None
+		self.error = None
+		self.submitted = time.time()
+		self.due = self.submitted
+		self.changed = self.submitted
+		self.interval = None
+		self.__changed = threading.Condition()
+
+	def wait(self, status=CONFIRMED, timeout=None):
+		"""
+		block until the transaction reaches a status, or fails
+		:param status: BROADCAST, CONFIRMED or FAILED
+		:param timeout: seconds to wait, forever if None
+		:return: True if the status was reached
+		"""
+		with self.__changed:
+			self.__changed.wait_for(lambda: self.status == FAILED or self.__reached(status), timeout)
+			return self.__reached(status)
+
+	def _update(self, **changes):
+		with self.__changed:
+			for name, value in changes.items():
+				setattr(self, name, value)
+			self.__changed.notify_all()
+
+	def __reached(self, status):
+		if status == FAILED or self.status == FAILED:
+			return self.status == status
+		return PROGRESS.index(self.status) >= PROGRESS.index(status)
+
+	def __repr__(self):
+		return f"Broadcast({self.txid}, {self.status}, {self.confirmations})"
+
+
+class BroadcastPipeline(object):
+	"""
+	BroadcastPipeline publishes the signed transactions of a Wallet and follows them until they are
+	confirmed. A transaction is pushed to the backends in order until one accepts it, for at most
+	`max_attempts` rounds separated by an exponential backoff. Its confirmations are then polled,
+	backing off up to `max_poll_interval` while they do not change, and the transaction fails once
+	no backend has reported it for `drop_timeout` seconds since its last change. The statuses of the wallet
+	accounts it touches are updated once it is published and once it is confirmed, and the
+	callbacks are called on every change of status or confirmations
+	"""
+	def __init__(self, wallet, backends=None, confirmations=CONFIRMED_AFTER, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_delay=DEFAULT_RETRY_DELAY,
+			poll_interval=DEFAULT_POLL_INTERVAL, max_poll_interval=DEFAULT_MAX_POLL_INTERVAL, drop_timeout=DEFAULT_DROP_TIMEOUT):
+		"""
+		:param wallet: Wallet the transactions are spending from
+		:param backends: ChainBackends to publish through and poll, in order, the wallet one if None
+		:param confirmations: confirmations after which a transaction is confirmed
+		:param max_attempts: rounds of pushes to all the backends before a transaction fails
+		:param retry_delay: seconds before the second round, doubled on every round
+		:param poll_interval: seconds between confirmation polls while they change
+		:param max_poll_interval: maximum seconds between confirmation polls
+		:param drop_timeout: seconds since its last change after which a published transaction no
+			backend reports, e.g. evicted from the mempools, fails and its inputs are released
+		"""
+		self.wallet = wallet
+		self.backends = list(backends) if backends is not None else [self.__wallet_backend()]
+		self.confirmations = confirmations
+		self.max_attempts = max_attempts
+		self.retry_delay = retry_delay
+		self.poll_interval = poll_interval
+		self.max_poll_interval = max_poll_interval
+		self.drop_timeout = drop_timeout
+		self.__callbacks = []
+		self.__broadcasts = []
+		self.__lock = threading.Lock()
+		self.__wake = threading.Event()
+		self.__stopped = threading.Event()
+		self.__worker = None
+
+	def on_change(self, callback):
+		"""
+		register a callback, called with the Broadcast on every change of status or confirmations
+		:param callback: callable `callback(broadcast)`
+		:return: None
+		"""
+		self.__callbacks.append(callback)
+
+	def submit(self, transaction):
+		"""
+		queue a signed transaction for broadcast
+		:param transaction: hex string transaction code
+		:return: Broadcast
+		"""
+		from .btc import transaction_id, transaction_addresses
+		outpoints, addresses = transaction_addresses(transaction, self.wallet.testnet)
+		# input addresses are looked up before the push invalidates the cached outputs
+		addresses.extend(self.wallet.cache.find_outpoint(txid, index) for txid, index in outpoints)
+		owned = set(self.wallet.addresses())
+		broadcast = Broadcast(transaction, transaction_id(transaction), sorted({a for a in addresses if a in owned}), outpoints)
+		with self.__lock:
+			self.__broadcasts.append(broadcast)
+		self.__wake.set()
+		return broadcast
+
+	def pending(self):
+		"""
+		:return: the broadcasts not confirmed nor failed yet
+		"""
+		with self.__lock:
+			return list(self.__broadcasts)
+
+	def step(self):
+		"""
+		process the due broadcasts: push the queued ones and poll the confirmations of the others
+		:return: seconds until the next broadcast is due, None if there is none
+		"""
+		now = time.time()
+		with self.__lock:
+			due = [b for b in self.__broadcasts if b.due <= now]
+		for broadcast in due:
+			if broadcast.status == QUEUED:
+				self.__push(broadcast)
+			else:
+				self.__poll(broadcast)
+		with self.__lock:
+			self.__broadcasts = [b for b in self.__broadcasts if b.status not in (CONFIRMED, FAILED)]
+			if not self.__broadcasts:
+				return None
+			return max(0.0, min(b.due for b in self.__broadcasts) - time.time())
+
+	def start(self):
+		"""
+		process the broadcasts in a background thread
+		:return: self
+		"""
+		if self.__worker is not None:
+			return self
+		self.__stopped.clear()
+		self.__worker = threading.Thread(target=self.__run, daemon=True)
+		self.__worker.start()
+		return self
+
+	def stop(self):
+		"""
+		stop the background thread, pending broadcasts are kept for the next `step` or `start`
+		:return: None
+		"""
+		self.__stopped.set()
+		self.__wake.set()
+		if self.__worker is not None:
+			self.__worker.join()
+			self.__worker = None
+
+	def __push(self, broadcast):
+		errors = []
+		for backend in self.backends:
+			try:
+				response = self.wallet.push_transaction(broadcast.transaction, backend, release_rejected=False)
+			except Exception as e:
+				errors.append(f"{type(backend).__name__}: {e}")
+				continue
+			if response.get("status") == "success":
+				self.__change(broadcast, status=BROADCAST, attempts=broadcast.attempts + 1, backend=backend, error=None,
+					confirmations=0, interval=self.poll_interval, due=time.time() + self.poll_interval)
+				self.__update_accounts(broadcast)
+				return
+			errors.append(f"{type(backend).__name__}: {response}")
+		attempts = broadcast.attempts + 1
+		if attempts >= self.max_attempts:
+			self.wallet.reservations.release_outpoints(broadcast.outpoints)
+			self.__change(broadcast, status=FAILED, attempts=attempts, error="; ".join(errors))
+		else:
+			broadcast._update(attempts=attempts, error="; ".join(errors), due=time.time() + self.retry_delay * 2**(attempts - 1))
+
+	def __poll(self, broadcast):
+		confirmations = None
+		for backend in [broadcast.backend] + [b for b in self.backends if b is not broadcast.backend]:
+			try:
+				confirmations = backend.get_confirmations(broadcast.txid, self.wallet.testnet, PRIORITY_BACKGROUND)
+			except Exception:
+				continue
+			if confirmations is not None:
+				break
+		if confirmations is None and time.time() - broadcast.changed >= self.drop_timeout:
+			self.wallet.reservations.release_outpoints(broadcast.outpoints)
+			self.__change(broadcast, status=FAILED, error=f"Not seen by any backend for {self.drop_timeout} seconds")
+			return
+		if confirmations is None or confirmations == broadcast.confirmations:
+			interval = min(broadcast.interval * 2, self.max_poll_interval)
+			broadcast._update(interval=interval, due=time.time() + interval)
+			return
+		if confirmations >= self.confirmations:
+			self.__change(broadcast, status=CONFIRMED, confirmations=confirmations)
+			self.__update_accounts(broadcast)
+			return
+		self.__change(broadcast, confirmations=confirmations, interval=self.poll_interval, due=time.time() + self.poll_interval)
+
+	def __update_accounts(self, broadcast):
+		if not broadcast.addresses:
+			return
+		try:
+			activity = self.__wallet_backend().get_activity_many(broadcast.addresses, self.wallet.testnet, PRIORITY_BACKGROUND)
+			self.wallet.update_statuses({address: account_status(seen) for address, seen in activity.items()})
+		except Exception as e:
+			# the next refresh of the wallet catches up
+			print(f"Account status update of {broadcast.txid} failed with: {e}")
+
+	def __change(self, broadcast, **changes):
+		broadcast._update(changed=time.time(), **changes)
+		for callback in self.__callbacks:
+			try:
+				callback(broadcast)
+			except Exception as e:
+				print(f"Broadcast callback failed with: {e}")
+
+	def __wallet_backend(self):
+		return self.wallet.cache.backend if self.wallet.cache.backend is not None else default_backend()
+
+	def __run(self):
+		while not self.__stopped.is_set():
+			self.__wake.clear()
+			try:
+				delay = self.step()
+			except Exception as e:
+				print(f"Broadcast step failed with: {e}")
+				delay = self.retry_delay
+			self.__wake.wait(delay)
@@ -1,11 +1,13 @@
-import hashlib, binascii, requests, base64, time, string
+import hashlib, binascii, base64, time, string
 from ecdsa import *
 from secrets import randbelow
 
 from bitcoin import SelectParams
-from bitcoin.core import b2x, lx, COutPoint, CMutableTxOut, CMutableTxIn, CMutableTransaction, Hash160, COIN
+from bitcoin.core import b2x, b2lx, x, lx, COutPoint, CMutableTxOut, CMutableTxIn, CTransaction, CMutableTransaction, Hash160, COIN
 from bitcoin.core.script import CScript, OP_DUP, OP_HASH160, OP_EQUALVERIFY, OP_CHECKSIG, SignatureHash, SIGHASH_ALL
-from bitcoin.wallet import CBitcoinAddress
+from bitcoin.wallet import CBitcoinAddress, CBitcoinAddressError
+
+from .chain import default_backend
 
 G = ecdsa.generator_secp256k1
 N = G.order()
@@ -117,20 +119,7 @@ def get_unspent(address, testnet):
 		}
 	]
 	"""
-	network = 'test3' if testnet else 'main'
-	req = f'https://api.blockcypher.com/v1/btc/{network}/addrs/{address}'
-	try:
-		resp = requests.get(req, params={"unspentOnly":"true"})
-		response = resp.json()
-	except:
-		time.sleep(2)
-		response = requests.get(req, params={"unspentOnly":"true"}).json()
-	try:
-		utxos = response['txrefs']
-	except:
-		utxos = []
-	clean_utxos = [{'value': i['value'], 'index': i['tx_output_n'], 'txid': i['tx_hash']} for i in utxos]
-	return clean_utxos
+	return default_backend().get_unspent(address, testnet)
 
 def get_spent(address, testnet):
 	"""
@@ -145,20 +134,25 @@ def get_spent(address, testnet):
 		}
 	]
 	"""
-	network = 'test3' if testnet else 'main'
-	req = f'https://api.blockcypher.com/v1/btc/{network}/addrs/{address}'
-	try:
-		resp = requests.get(req)
-		response = resp.json()
-	except:
-		time.sleep(2)
-		response = requests.get(req, params).json()
-	try:
-		stxos = [r for r in response['txrefs'] if r['spent']==True]
-	except:
-		stxos = []
-	clean_stxos = [{'value': i['value'], 'index': i['tx_output_n'], 'txid': i['tx_hash']} for i in stxos]
-	return clean_stxos
+	return default_backend().get_spent(address, testnet)
+
+def get_unspent_many(addresses, testnet):
+	"""
+	Get the unspent transaction outputs for many bitcoin addresses in batched requests
+	:param addresses: addresses to be checked
+	:param testnet: flag to set mainnet vs testnet
+	:return: {address: [utxos]} with utxos in the `get_unspent` format
+	"""
+	return default_backend().get_unspent_many(addresses, testnet)
+
+def get_spent_many(addresses, testnet):
+	"""
+	Get the spent transaction outputs for many bitcoin addresses in batched requests
+	:param addresses: addresses to be checked
+	:param testnet: flag to set mainnet vs testnet
+	:return: {address: [stxos]} with stxos in the `get_spent` format
+	"""
+	return default_backend().get_spent_many(addresses, testnet)
 
 def push_transaction(transaction, testnet):
 	"""
@@ -167,12 +161,48 @@ def push_transaction(transaction, testnet):
 	:param testnet: flag to set publish to mainnet vs testnet
 	:return: the `https://chain.so/api/v2/send_tx/` json response
 	"""
-	data = {'tx_hex': transaction}
-	network = 'BTCTEST' if testnet else 'BTC'
-	response = requests.post(f'https://chain.so/api/v2/send_tx/{network}', data=data)
-	return response.json()
+	return default_backend().push_transaction(transaction, testnet)
+
+def transaction_id(transaction):
+	"""
+	:param transaction: hex string transaction code
+	:return: txid of the transaction
+	"""
+	return b2lx(CTransaction.deserialize(x(transaction)).GetTxid())
+
+def check_address(address, testnet):
+	"""
+	Check that an address can be paid to on the wallet network
+	:param address: bitcoin address
+	:param testnet: flag to enable/disable mainnet vs testnet
+	:return: None
+	:raise: ValueError if the address is malformed or belongs to the other network
+	"""
+	SelectParams('testnet' if testnet else 'mainnet')
+	try:
+		CBitcoinAddress(address)
+	except (CBitcoinAddressError, TypeError):
+		raise ValueError(f"Invalid {'testnet' if testnet else 'mainnet'} bitcoin address {address}")
+
+def transaction_addresses(transaction, testnet):
+	"""
+	Decode a transaction into the outpoints it spends and the addresses it pays to
+	:param transaction: hex string transaction code
+	:param testnet: flag to enable/disable mainnet vs testnet
+	:return: [(txid, index)], [addresses]
+	"""
+	SelectParams('testnet' if testnet else 'mainnet')
+	tx = CTransaction.deserialize(x(transaction))
+	outpoints = [(b2lx(i.prevout.hash), i.prevout.n) for i in tx.vin]
+	addresses = []
+	for o in tx.vout:
+		try:
+			addresses.append(str(CBitcoinAddress.from_scriptPubKey(o.scriptPubKey)))
+		except CBitcoinAddressError:
+			pass
+	return outpoints, addresses
 
-def unsigned_transaction(addresses, outputs, satoshi_fee, change_address, testnet=False):
+def unsigned_transaction(addresses, outputs, satoshi_fee, change_address, testnet=False, unspent=None):
 	"""
 	Generate the **unsigned** transaction hex code
 	:param addresses: list of bitcoin addresses that are being spent
@@ -180,6 +210,7 @@ def unsigned_transaction(addresses, outputs, satoshi_fee, change_address, testne
 	:param satoshi_fee: transaction fee in satoshi
 	:param change_address: remaining change return address
 	:param testnet: flag to enable/disable mainnet vs testnet
+	:param unspent: optional callable `unspent(address)` returning the address utxos, `get_unspent` by default
 	:return: transaction_hex, [list_of_addresses]
 	"""
 	if testnet:
@@ -190,7 +221,7 @@ def unsigned_transaction(addresses, outputs, satoshi_fee, change_address, testne
 	inputs = []
 	address_list = []
 	for address in addresses:
-		utxos = get_unspent(address, testnet)
+		utxos = unspent(address) if unspent is not None else get_unspent(address, testnet)
 		inputs.extend(utxos)
 		address_list.extend(address for _ in range(len(utxos)))
 	gross_input = sum(i['value'] for i in inputs)
@@ -0,0 +1,173 @@
+import os, json, time, threading
+
+from .chain import default_backend
+from .locking import atomic_write_json
+from .scheduler import PRIORITY_DEFAULT
+
+DEFAULT_UNSPENT_TTL = 60
+DEFAULT_SPENT_TTL = 300
+
+
+class ChainCache(object):
+	"""
+	ChainCache keeps the unspent outputs and the spent history of the wallet addresses,
+	so every path of a Wallet shares the same chain API answers while they are fresh
+	"""
+	def __init__(self, filepath, testnet, unspent_ttl=DEFAULT_UNSPENT_TTL, spent_ttl=DEFAULT_SPENT_TTL, backend=None):
+		"""
+		:param filepath: path to the cache file, stored next to the wallet json file
+		:param testnet: boolean flag for mainnet vs testnet addresses
+		:param unspent_ttl: seconds an unspent outputs entry is considered fresh
+		:param spent_ttl: seconds a spent outputs entry is considered fresh
+		:param backend: ChainBackend used on misses, the shared `chain.default_backend()` if None
+		"""
+		self.filepath = filepath
+		self.testnet = testnet
+		self.backend = backend
+		self.ttl = {"unspent": unspent_ttl, "spent": spent_ttl}
+		self.__lock = threading.RLock()
+		self.__dirty = False
+		self.__entries = {"unspent": {}, "spent": {}}
+		if os.path.exists(filepath):
+			try:
+				with open(filepath, 'r') as f:
+					entries = json.load(f)
+				for kind in self.__entries:
+					self.__entries[kind].update(entries.get(kind, {}))
+			except (ValueError, OSError):
+				pass
+
+	def get_unspent(self, address, priority=PRIORITY_DEFAULT):
+		"""
+		get the unspent transaction outputs of an address, querying the chain API only on a miss
+		:param address: address to be checked
+		:param priority: scheduling priority of the chain API request
+		:return: same format as `btc.get_unspent`
+		"""
+		return self.get_unspent_many([address], priority)[address]
+
+	def get_spent(self, address, priority=PRIORITY_DEFAULT):
+		"""
+		get the spent transaction outputs of an address, querying the chain API only on a miss
+		:param address: address to be checked
+		:param priority: scheduling priority of the chain API request
+		:return: same format as `btc.get_spent`
+		"""
+		return self.get_spent_many([address], priority)[address]
+
+	def get_unspent_many(self, addresses, priority=PRIORITY_DEFAULT, profile=None):
+		"""
+		get the unspent transaction outputs of many addresses, fetching all the misses concurrently
+		:param addresses: addresses to be checked
+		:param priority: scheduling priority of the chain API requests
+		:param profile: optional SendProfile counting the lookups, and the chain API requests of the backend
+		:return: {address: [utxos]}
+		"""
+		return self.__get_many("unspent", addresses, self.__backend().get_unspent_many, priority, profile)
+
+	def get_spent_many(self, addresses, priority=PRIORITY_DEFAULT, profile=None):
+		"""
+		get the spent transaction outputs of many addresses, fetching all the misses concurrently
+		:param addresses: addresses to be checked
+		:param priority: scheduling priority of the chain API requests
+		:param profile: optional SendProfile counting the lookups, and the chain API requests of the backend
+		:return: {address: [stxos]}
+		"""
+		return self.__get_many("spent", addresses, self.__backend().get_spent_many, priority, profile)
+
+	def cached_unspent_many(self, addresses):
+		"""
+		get the fresh cached unspent transaction outputs of many addresses, without querying the chain API
+		:param addresses: addresses to be checked
+		:return: {address: [utxos]} of the addresses with a fresh entry
+		"""
+		now = time.time()
+		with self.__lock:
+			entries = self.__entries["unspent"]
+			return {address: entries[address][1] for address in addresses
+				if address in entries and now < entries[address][0] + self.ttl["unspent"]}
+
+	def put_unspent_many(self, unspent):
+		"""
+		cache unspent transaction outputs fetched elsewhere, e.g. by a lookup shared by several wallets
+		:param unspent: {address: [utxos]}
+		:return: None
+		"""
+		now = time.time()
+		with self.__lock:
+			for address, utxos in unspent.items():
+				self.__entries["unspent"][address] = [now, utxos]
+			self.__dirty = True
+
+	def invalidate(self, addresses=None):
+		"""
+		drop the cached entries of some addresses, e.g. after a transaction touching them is pushed
+		:param addresses: iterable of addresses, all addresses if None
+		:return: None
+		"""
+		with self.__lock:
+			for entries in self.__entries.values():
+				if addresses is None:
+					entries.clear()
+				else:
+					for address in addresses:
+						entries.pop(address, None)
+			self.__dirty = True
+
+	def find_outpoint(self, txid, index):
+		"""
+		find the address owning a cached unspent output
+		:param txid: transaction id of the output
+		:param index: output index in the transaction
+		:return: address or None if the output is not cached
+		"""
+		with self.__lock:
+			for address, (_, utxos) in self.__entries["unspent"].items():
+				if any(u["txid"] == txid and u["index"] == index for u in utxos):
+					return address
+		return None
+
+	def save(self):
+		"""
+		persist the cache entries if they changed since the last save
+		:return: None
+		"""
+		with self.__lock:
+			if not self.__dirty:
+				return
+			atomic_write_json(self.filepath, self.__entries)
+			self.__dirty = False
+
+	def __backend(self):
+		return self.backend if self.backend is not None else default_backend()
+
+	def __get_many(self, kind, addresses, fetch_many, priority, profile=None):
+		result, missing = {}, []
+		now = time.time()
+		with self.__lock:
+			entries = self.__entries[kind]
+			for address in addresses:
+				entry = entries.get(address)
+				if entry is not None and now < entry[0] + self.ttl[kind]:
+					result[address] = entry[1]
+				else:
+					missing.append(address)
+		if missing:
+			if profile is None:
+				fetched = fetch_many(missing, self.testnet, priority)
+			else:
+				# the backend counts the requests it actually sends, one lookup may take several or none
+				profile.count("chain_lookups")
+				with profile.active():
+					fetched = fetch_many(missing, self.testnet, priority)
+			absent = [address for address in missing if address not in fetched]
+			if absent:
+				# a partial answer is not cached, the absent addresses would read as unused
+				raise RuntimeError(f"Chain backend did not answer for {', '.join(absent)}")
+			now = time.time()
+			with self.__lock:
+				for address, value in fetched.items():
+					self.__entries[kind][address] = [now, value]
+				self.__dirty = True
+			result.update(fetched)
+		return result
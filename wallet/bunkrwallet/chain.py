@@ -0,0 +1,343 @@
+import threading
+
+from .profiling import active_profile
+from .scheduler import RequestScheduler, PRIORITY_SEND, PRIORITY_DEFAULT
+
+BLOCKCYPHER_URL = "https://api.blockcypher.com/v1/btc"
+CHAINSO_URL = "https://chain.so/api/v2"
+DEFAULT_CONCURRENCY = 8
+MAX_BATCH_SIZE = 100
+DEFAULT_TIMEOUT = 30
+
+
+class ChainBackend(object):
+	"""
+	ChainBackend is the interface the wallet uses to query and publish to the bitcoin blockchain.
+	Backends implement the batched queries, the single address ones are derived from them
+	"""
+	def get_unspent(self, address, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get the unspent transaction outputs for a bitcoin address
+		:param address: address to be checked
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: scheduling priority of the request
+		:return: same format as `btc.get_unspent`
+		"""
+		return self.get_unspent_many([address], testnet, priority)[address]
+
+	def get_spent(self, address, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get the spent transaction outputs for a bitcoin address
+		:param address: address to be checked
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: scheduling priority of the request
+		:return: same format as `btc.get_spent`
+		"""
+		return self.get_spent_many([address], testnet, priority)[address]
+
+	def get_unspent_many(self, addresses, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get the unspent transaction outputs for many addresses
+		:param addresses: addresses to be checked
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: scheduling priority, backends without a request queue ignore it
+		:return: {address: [utxos]}
+		"""
+		raise NotImplementedError
+
+	def get_spent_many(self, addresses, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get the spent transaction outputs for many addresses
+		:param addresses: addresses to be checked
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: scheduling priority, backends without a request queue ignore it
+		:return: {address: [stxos]}
+		"""
+		raise NotImplementedError
+
+	def get_activity_many(self, addresses, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get a summary of the history of many addresses. Backends without block heights derive
+		it from the unspent and spent outputs, with unknown heights and confirmations
+		:param addresses: addresses to be checked
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: scheduling priority, backends without a request queue ignore it
+		:return: {address: {
+			"n_tx"          : number of transaction outputs seen,
+			"balance"       : unspent satoshis,
+			"height"        : height of the last block with activity, None if unknown or unconfirmed,
+			"confirmations" : confirmations of the least confirmed activity, None if unknown or no activity,
+		}}
+		"""
+		unspent = self.get_unspent_many(addresses, testnet, priority)
+		spent = self.get_spent_many(addresses, testnet, priority)
+		return {
+			address: {
+				"n_tx": len(unspent[address]) + len(spent[address]),
+				"balance": sum(u['value'] for u in unspent[address]),
+				"height": None,
+				"confirmations": None,
+			} for address in unspent
+		}
+
+	def get_confirmations(self, txid, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get the number of confirmations of a transaction
+		:param txid: transaction id
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: scheduling priority, backends without a request queue ignore it
+		:return: confirmations, 0 while unconfirmed, None if the transaction is unknown
+		"""
+		raise NotImplementedError
+
+	def get_height(self, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get the height of the chain tip
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: scheduling priority, backends without a request queue ignore it
+		:return: height, None if the backend can not tell
+		"""
+		return None
+
+	def push_transaction(self, transaction, testnet):
+		"""
+		Publish a transaction to the bitcoin blockchain
+		:param transaction: hex string transaction code
+		:param testnet: flag to set publish to mainnet vs testnet
+		:return: json like object (dict) with the backend response
+		"""
+		raise NotImplementedError
+
+	def watch(self, addresses):
+		"""
+		follow new wallet addresses, backends answering for any address ignore it
+		:param addresses: bitcoin addresses
+		:return: None
+		"""
+		pass
+
+	def close(self):
+		"""
+		release the resources held by the backend
+		:return: None
+		"""
+		pass
+
+
+class ChainClient(ChainBackend):
+	"""
+	ChainClient queries the blockchain APIs through a pooled keep-alive session,
+	fetching many addresses concurrently under a concurrency cap. Every request goes through a
+	RequestScheduler that enforces the api rate limits. The http requests sent, retries included, are
+	counted in the active SendProfile if any, see `profiling.active_profile`
+	"""
+	def __init__(self, blockcypher_url=BLOCKCYPHER_URL, chainso_url=CHAINSO_URL, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, batch_size=MAX_BATCH_SIZE, scheduler=None):
+		"""
+		:param blockcypher_url: base url of the blockcypher compatible api used for address queries
+		:param chainso_url: base url of the chain.so compatible api used to publish transactions
+		:param concurrency: maximum number of requests in flight (and pooled connections)
+		:param timeout: seconds to wait for each api response
+		:param batch_size: maximum number of addresses queried in a single `addrs/a;b;c` request
+		:param scheduler: RequestScheduler shared by the requests, one with the default rate limits if None
+		"""
+		self.blockcypher_url = blockcypher_url.rstrip("/")
+		self.chainso_url = chainso_url.rstrip("/")
+		self.concurrency = concurrency
+		self.batch_size = batch_size
+		self.timeout = timeout
+		self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+		# requests is only imported once a client is built, listing wallets never builds one
+		import requests
+		from requests.adapters import HTTPAdapter
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=2, pool_maxsize=concurrency)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+		self.__executor = None
+		self.__lock = threading.Lock()
+
+	def get_unspent_many(self, addresses, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get the unspent transaction outputs for many addresses, batching them into
+		`addrs/a;b;c` requests of at most `batch_size` addresses that are fetched concurrently
+		:param addresses: addresses to be checked
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: scheduling priority of the requests
+		:return: {address: [utxos]}
+		"""
+		responses = self.__get_addresses(addresses, testnet, priority, {"unspentOnly": "true"})
+		return {address: [_clean_ref(r) for r in response.get('txrefs', [])] for address, response in responses.items()}
+
+	def get_spent_many(self, addresses, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get the spent transaction outputs for many addresses, batching them into
+		`addrs/a;b;c` requests of at most `batch_size` addresses that are fetched concurrently
+		:param addresses: addresses to be checked
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: scheduling priority of the requests
+		:return: {address: [stxos]}
+		"""
+		responses = self.__get_addresses(addresses, testnet, priority)
+		return {address: [_clean_ref(r) for r in response.get('txrefs', []) if r.get('spent') == True] for address, response in responses.items()}
+
+	def get_activity_many(self, addresses, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get a summary of the history of many addresses from the same `addrs/a;b;c` requests
+		as `get_spent_many`, see `ChainBackend.get_activity_many`
+		:param addresses: addresses to be checked
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: scheduling priority of the requests
+		:return: {address: activity}
+		"""
+		responses = self.__get_addresses(addresses, testnet, priority)
+		return {address: _activity(response) for address, response in responses.items()}
+
+	def get_confirmations(self, txid, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get the number of confirmations of a transaction from the blockcypher `txs/<txid>` endpoint
+		:param txid: transaction id
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: scheduling priority of the request
+		:return: confirmations, 0 while unconfirmed, None if the transaction is unknown
+		"""
+		network = 'test3' if testnet else 'main'
+		url = f'{self.blockcypher_url}/{network}/txs/{txid}'
+		response = self.scheduler.submit("blockcypher", _counted(lambda: self.session.get(url, timeout=self.timeout)), priority)
+		if response.status_code == 404:
+			return None
+		if response.status_code != 200:
+			raise RuntimeError(f"blockcypher transaction query failed with HTTP {response.status_code}: {response.text[:200]}")
+		return response.json().get('confirmations', 0)
+
+	def get_height(self, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get the height of the chain tip from the blockcypher chain endpoint
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: scheduling priority of the request
+		:return: height
+		"""
+		network = 'test3' if testnet else 'main'
+		url = f'{self.blockcypher_url}/{network}'
+		response = self.scheduler.submit("blockcypher", _counted(lambda: self.session.get(url, timeout=self.timeout)), priority)
+		if response.status_code != 200:
+			raise RuntimeError(f"blockcypher chain query failed with HTTP {response.status_code}: {response.text[:200]}")
+		return response.json()['height']
+
+	def push_transaction(self, transaction, testnet):
+		"""
+		Publish a transaction to the bitcoin blockchain
+		:param transaction: hex string transaction code
+		:param testnet: flag to set publish to mainnet vs testnet
+		:return: the `send_tx` json response
+		"""
+		network = 'BTCTEST' if testnet else 'BTC'
+		url = f'{self.chainso_url}/send_tx/{network}'
+		request = lambda: self.session.post(url, data={'tx_hex': transaction}, timeout=self.timeout)
+		return self.scheduler.submit("chainso", request, PRIORITY_SEND).json()
+
+	def close(self):
+		"""
+		release the pooled connections and worker threads
+		:return: None
+		"""
+		with self.__lock:
+			if self.__executor is not None:
+				self.__executor.shutdown()
+				self.__executor = None
+		self.session.close()
+
+	def __get_addresses(self, addresses, testnet, priority, params=None):
+		addresses = list(dict.fromkeys(addresses))
+		batches = [addresses[i:i+self.batch_size] for i in range(0, len(addresses), self.batch_size)]
+		with self.__lock:
+			if self.__executor is None:
+				from concurrent.futures import ThreadPoolExecutor
+				self.__executor = ThreadPoolExecutor(max_workers=self.concurrency)
+			executor = self.__executor
+		# the batches run in the executor threads, the profile of the caller is handed over
+		profile = active_profile()
+		results = {}
+		for responses in executor.map(lambda batch: self.__get_batch(batch, testnet, priority, params, profile), batches):
+			results.update(responses)
+		return results
+
+	def __get_batch(self, batch, testnet, priority, params, profile=None):
+		"""
+		:return: {address: response} of every address of the batch
+		:raise: RuntimeError if the api answers with an error or leaves an address out, a missing
+			address must not be mistaken for one without history
+		"""
+		network = 'test3' if testnet else 'main'
+		url = f'{self.blockcypher_url}/{network}/addrs/{";".join(batch)}'
+		request = _counted(lambda: self.session.get(url, params=params, timeout=self.timeout), profile)
+		if profile is not None:
+			profile.count("chain_addresses", len(batch))
+		response = self.scheduler.submit("blockcypher", request, priority)
+		if response.status_code != 200:
+			raise RuntimeError(f"blockcypher address query failed with HTTP {response.status_code}: {response.text[:200]}")
+		payload = response.json()
+		# a batch of one address is answered with a single object instead of a list
+		entries = payload if isinstance(payload, list) else [payload]
+		results = {}
+		for entry in entries:
+			if not isinstance(entry, dict) or "error" in entry:
+				raise RuntimeError(f"blockcypher address query failed with: {entry}")
+			if entry.get('address') in batch:
+				results[entry['address']] = entry
+		missing = [address for address in batch if address not in results]
+		if missing:
+			raise RuntimeError(f"blockcypher address query did not answer for {', '.join(missing)}")
+		return results
+
+
+def _counted(request, profile=None):
+	"""
+	:param request: callable performing an http request
+	:param profile: SendProfile counting the calls, the active one if None
+	:return: request counting every call in the profile as a "chain_requests", the scheduler calls it once per attempt
+	"""
+	profile = profile if profile is not None else active_profile()
+	if profile is None:
+		return request
+	def counted():
+		profile.count("chain_requests")
+		return request()
+	return counted
+
+def _clean_ref(ref):
+	return {'value': ref['value'], 'index': ref['tx_output_n'], 'txid': ref['tx_hash']}
+
+def _activity(response):
+	refs = response.get('txrefs', []) + response.get('unconfirmed_txrefs', [])
+	heights = [r['block_height'] for r in refs if r.get('block_height', -1) >= 0]
+	return {
+		"n_tx": response.get('final_n_tx', response.get('n_tx', len(refs))),
+		"balance": response.get('final_balance', response.get('balance', 0)),
+		"height": max(heights) if heights else None,
+		"confirmations": min((r.get('confirmations', 0) for r in refs), default=None),
+	}
+
+
+__default_backend = None
+__default_backend_lock = threading.Lock()
+
+def default_backend():
+	"""
+	shared ChainBackend used by the module level `btc` functions, a ChainClient unless replaced
+	:return: ChainBackend
+	"""
+	global __default_backend
+	with __default_backend_lock:
+		if __default_backend is None:
+			__default_backend = ChainClient()
+		return __default_backend
+
+def set_default_backend(backend):
+	"""
+	replace the shared ChainBackend, e.g. to point the wallet to a local api or a local block indexer
+	:param backend: ChainBackend instance
+	:return: None
+	"""
+	global __default_backend
+	with __default_backend_lock:
+		__default_backend = backend
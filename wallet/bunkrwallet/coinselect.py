@@ -0,0 +1,102 @@
+DUST_THRESHOLD = 546
+DEFAULT_COST_OF_CHANGE = DUST_THRESHOLD
+BNB_MAX_TRIES = 100000
+
+
+def select_coins(utxos, target, cost_of_change=DEFAULT_COST_OF_CHANGE):
+	"""
+	Select the unspent outputs funding a transaction, minimizing first the number of inputs
+	(every input is another SIGN-ECDSA round trip) and then the waste.
+	The fewest inputs leaving a change output are found largest first and refined as a knapsack,
+	then branch and bound looks for a changeless selection with no more inputs than that
+	:param utxos: [{"value": satoshis, ...}] candidate unspent outputs, extra keys are kept
+	:param target: satoshis needed by the outputs and the fee
+	:param cost_of_change: excess below which no change output is created, the excess going to the fee
+	:return: (selected_utxos, change) where change is 0 for changeless selections
+	:raise: ValueError if the utxos do not cover the target
+	"""
+	available = sum(u['value'] for u in utxos)
+	if available < target:
+		raise ValueError(f"Not enough funds in wallet for this transaction: need: {target}, have: {available}.")
+	ordered = sorted(utxos, key=lambda u: u['value'], reverse=True)
+	with_change = knapsack(ordered, target + cost_of_change)
+	max_inputs = len(with_change) if with_change is not None else None
+	selected = branch_and_bound(ordered, target, cost_of_change, max_inputs)
+	if selected is None:
+		selected = with_change
+	if selected is None:
+		# only a selection leaving dust is possible, spend everything without change
+		return ordered, 0
+	excess = sum(u['value'] for u in selected) - target
+	return selected, (excess if excess >= cost_of_change else 0)
+
+def branch_and_bound(ordered, target, cost_of_change, max_inputs=None, max_tries=BNB_MAX_TRIES):
+	"""
+	depth first search of a changeless selection, with a total in [target, target + cost_of_change]
+	:param ordered: utxos sorted by decreasing value
+	:param target: satoshis needed
+	:param cost_of_change: tolerated excess
+	:param max_inputs: maximum number of inputs of the selection, unbounded if None
+	:param max_tries: maximum number of search steps
+	:return: best selection found (fewest inputs, then least excess), or None
+	"""
+	values = [u['value'] for u in ordered]
+	remaining = [0]*(len(values)+1)
+	for i in range(len(values)-1, -1, -1):
+		remaining[i] = remaining[i+1] + values[i]
+	best, best_key = None, ((max_inputs, cost_of_change+1) if max_inputs is not None else None)
+	tries = 0
+	# explicit stack of (index, total, selected indexes) to avoid recursion limits on big sets
+	stack = [(0, 0, ())]
+	while stack and tries < max_tries:
+		tries += 1
+		i, total, chosen = stack.pop()
+		if total > target + cost_of_change:
+			continue
+		if total >= target:
+			key = (len(chosen), total - target)
+			if best_key is None or key < best_key:
+				best, best_key = chosen, key
+			continue
+		if i == len(values) or total + remaining[i] < target:
+			continue
+		if best_key is not None and len(chosen) + 1 > best_key[0]:
+			continue
+		# explore the exclusion branch after the inclusion one
+		stack.append((i+1, total, chosen))
+		stack.append((i+1, total + values[i], chosen + (i,)))
+	if best is None:
+		return None
+	return [ordered[i] for i in best]
+
+def knapsack(ordered, target):
+	"""
+	fewest inputs covering the target: the largest first prefix, then each input is swapped for
+	the smallest unselected one that still covers the target to reduce the excess
+	:param ordered: utxos sorted by decreasing value
+	:param target: satoshis needed
+	:return: selection or None if the utxos do not cover the target
+	"""
+	total, count = 0, 0
+	for u in ordered:
+		if total >= target:
+			break
+		total += u['value']
+		count += 1
+	if total < target:
+		return None
+	selected = list(range(count))
+	unselected = list(range(len(ordered)-1, count-1, -1))
+	for position in range(count-1, -1, -1):
+		current = ordered[selected[position]]['value']
+		for j, candidate in enumerate(unselected):
+			value = ordered[candidate]['value']
+			if value >= current:
+				break
+			if total - current + value >= target:
+				unselected[j] = selected[position]
+				selected[position] = candidate
+				total += value - current
+				unselected.sort(key=lambda k: ordered[k]['value'])
+				break
+	return [ordered[i] for i in sorted(selected)]
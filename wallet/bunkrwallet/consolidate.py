@@ -0,0 +1,163 @@
+import threading
+from math import ceil
+
+from .coinselect import DUST_THRESHOLD
+from .scheduler import PRIORITY_BACKGROUND
+
+# legacy P2PKH transaction sizes in bytes
+TX_OVERHEAD_SIZE = 10
+INPUT_SIZE = 148
+OUTPUT_SIZE = 34
+
+DEFAULT_SMALL_THRESHOLD = 100000
+DEFAULT_MIN_UTXOS = 50
+DEFAULT_MAX_INPUTS = 100
+DEFAULT_MAX_FEE_RATE = 5
+DEFAULT_INTERVAL = 3600
+
+
+def transaction_size(n_inputs, n_outputs):
+	"""
+	estimated size in bytes of a legacy P2PKH transaction
+	"""
+	return TX_OVERHEAD_SIZE + INPUT_SIZE*n_inputs + OUTPUT_SIZE*n_outputs
+
+
+class Consolidator(object):
+	"""
+	Consolidator sweeps the small utxos of a Wallet into a few fresh addresses, so later sends
+	need fewer inputs and so fewer SIGN-ECDSA operations. Sweeps are split in transactions of at
+	most `max_inputs` inputs and only run in the background when the wallet is fragmented enough
+	and fees are cheap
+	"""
+	def __init__(self, wallet, small_threshold=DEFAULT_SMALL_THRESHOLD, min_utxos=DEFAULT_MIN_UTXOS, max_inputs=DEFAULT_MAX_INPUTS, max_fee_rate=DEFAULT_MAX_FEE_RATE):
+		"""
+		:param wallet: Wallet to consolidate
+		:param small_threshold: utxos of at most this many satoshis are swept
+		:param min_utxos: number of wallet utxos from which a consolidation is worthwhile
+		:param max_inputs: maximum number of inputs of a consolidation transaction
+		:param max_fee_rate: fee rate in satoshis per byte above which a consolidation is not worthwhile
+		"""
+		if max_inputs < 2:
+			raise ValueError(f"Invalid max_inputs {max_inputs}, consolidating needs at least 2 inputs")
+		self.wallet = wallet
+		self.small_threshold = small_threshold
+		self.min_utxos = min_utxos
+		self.max_inputs = max_inputs
+		self.max_fee_rate = max_fee_rate
+		self.last_report = None
+		self.__lock = threading.Lock()
+		self.__stopped = threading.Event()
+		self.__worker = None
+
+	def plan(self, fee_rate):
+		"""
+		plan a consolidation without touching the wallet
+		:param fee_rate: fee rate in satoshis per byte
+		:return: {
+			"utxos"            : number of wallet utxos not reserved by sends in flight,
+			"small_utxos"      : number of small utxos worth more than their input fee,
+			"batches"          : [{"inputs": [utxos], "value": satoshis received, "fee": satoshis}],
+			"inputs_before"    : inputs needed to spend the swept utxos,
+			"inputs_after"     : inputs needed to spend them once consolidated,
+			"signatures_saved" : SIGN-ECDSA operations saved when spending them,
+			"bytes_saved"      : transaction bytes saved when spending them,
+			"fee"              : total fee of the consolidation,
+			"worthwhile"       : the wallet is fragmented enough and the fee rate low enough,
+		}
+		"""
+		unspent = self.wallet.cache.get_unspent_many(self.wallet.addresses(), PRIORITY_BACKGROUND)
+		self.wallet.cache.save()
+		# utxos picked by sends in flight are left to them
+		reserved_outpoints, _ = self.wallet.reservations.reserved()
+		utxos = [dict(u, address=address) for address, address_utxos in unspent.items() for u in address_utxos
+			if f"{u['txid']}:{u['index']}" not in reserved_outpoints]
+		# utxos worth less than the fee of their own input are not worth sweeping
+		small = sorted((u for u in utxos if INPUT_SIZE*fee_rate < u['value'] <= self.small_threshold), key=lambda u: u['value'])
+		batches = []
+		for i in range(0, len(small), self.max_inputs):
+			inputs = small[i:i+self.max_inputs]
+			fee = ceil(transaction_size(len(inputs), 1)*fee_rate)
+			value = sum(u['value'] for u in inputs) - fee
+			if len(inputs) < 2 or value < DUST_THRESHOLD:
+				continue
+			batches.append({"inputs": inputs, "value": value, "fee": fee})
+		inputs_before = sum(len(batch["inputs"]) for batch in batches)
+		saved = inputs_before - len(batches)
+		return {
+			"utxos": len(utxos),
+			"small_utxos": len(small),
+			"batches": batches,
+			"inputs_before": inputs_before,
+			"inputs_after": len(batches),
+			"signatures_saved": saved,
+			"bytes_saved": saved*INPUT_SIZE,
+			"fee": sum(batch["fee"] for batch in batches),
+			"worthwhile": len(batches) > 0 and len(utxos) >= self.min_utxos and fee_rate <= self.max_fee_rate,
+		}
+
+	def run(self, fee_rate, dry_run=False):
+		"""
+		plan and broadcast a consolidation, one transaction per batch, each paying to its own fresh address
+		:param fee_rate: fee rate in satoshis per byte
+		:param dry_run: only return the plan
+		:return: the `plan` report, with the "address", "transaction", "txid" and "error" of each batch unless dry_run
+		"""
+		with self.__lock:
+			report = self.plan(fee_rate)
+			if dry_run or not report["batches"]:
+				return report
+			# the destinations are reserved like change addresses, so concurrent sends do not pick them
+			with self.wallet.lock:
+				addresses = self.wallet.show_fresh_addresses(len(report["batches"]))
+				tokens = [self.wallet.reservations.reserve([], [address], self.wallet.reservation_lease) for address in addresses]
+			for batch, address, token in zip(report["batches"], addresses, tokens):
+				batch.update({"address": address, "transaction": None, "txid": None, "error": None})
+				try:
+					batch["transaction"] = self.wallet.send([{"address": address, "value": batch["value"]}], batch["fee"], inputs=batch["inputs"])
+					response = self.wallet.push_transaction(batch["transaction"])
+				except Exception as e:
+					batch["error"] = str(e)
+				else:
+					if response.get("status") == "success":
+						batch["txid"] = response.get("data", {}).get("txid")
+					else:
+						batch["error"] = f"Broadcast failed with: {response}"
+				if batch["txid"] is None:
+					self.wallet.reservations.release(token)
+			self.last_report = report
+			return report
+
+	def start(self, fee_rate, interval=DEFAULT_INTERVAL):
+		"""
+		start the background worker, consolidating every `interval` seconds when worthwhile
+		:param fee_rate: callable returning the current fee rate in satoshis per byte
+		:param interval: seconds between checks
+		:return: self
+		"""
+		if self.__worker is not None:
+			return self
+		self.__stopped.clear()
+		self.__worker = threading.Thread(target=self.__run, args=(fee_rate, interval), daemon=True)
+		self.__worker.start()
+		return self
+
+	def stop(self):
+		"""
+		stop the background worker
+		:return: None
+		"""
+		self.__stopped.set()
+		if self.__worker is not None:
+			self.__worker.join()
+			self.__worker = None
+
+	def __run(self, fee_rate, interval):
+		while not self.__stopped.is_set():
+			try:
+				rate = fee_rate()
+				if rate <= self.max_fee_rate and self.plan(rate)["worthwhile"]:
+					self.run(rate)
+			except Exception as e:
+				print(f"Consolidation failed with: {e}")
+			self.__stopped.wait(interval)
@@ -0,0 +1,455 @@
+import os, json, glob, struct, hashlib, threading
+
+from bitcoin.base58 import decode as b58decode
+from bitcoin.core import CBlock, CBlockHeader, CTransaction, b2x, b2lx, x
+
+from .chain import ChainBackend
+from .scheduler import PRIORITY_DEFAULT
+
+NETWORK_MAGIC = {
+	bytes.fromhex("f9beb4d9"): "mainnet",
+	bytes.fromhex("0b110907"): "testnet",
+	bytes.fromhex("fabfb5da"): "regtest",
+}
+ADDRESS_VERSIONS = {
+	0x00: "p2pkh", 0x6f: "p2pkh",
+	0x05: "p2sh", 0xc4: "p2sh",
+}
+# blocks deeper than this below the tip are dropped from the index, reorgs past it are not undone
+KEEP_DEPTH = 288
+NULL_HASH = "00" * 32
+
+
+class BlockIndexer(ChainBackend):
+	"""
+	BlockIndexer is a local ChainBackend built from raw blocks. It ingests `blk*.dat` block files
+	(or raw blocks fetched from a regtest node), keeps only the outputs paying to a filter of
+	watched wallet addresses, and answers the wallet queries with local lookups on an address to
+	utxos index persisted on disk.
+	Blocks are linked by their previous block hash, in whatever order they are ingested: a block
+	whose parent is not indexed yet is held as an orphan until the parent arrives. The tip is the
+	block with the most cumulative work, and when another branch overtakes it the blocks of the old
+	branch are disconnected, undoing their spends and outputs, before the new ones are connected
+	"""
+	def __init__(self, index_path, testnet, addresses=(), relay=None):
+		"""
+		:param index_path: path to the json file holding the index
+		:param testnet: boolean flag for mainnet vs testnet/regtest blocks
+		:param addresses: addresses to watch
+		:param relay: optional ChainBackend used to broadcast pushed transactions
+		"""
+		self.index_path = index_path
+		self.testnet = testnet
+		self.relay = relay
+		self.__lock = threading.RLock()
+		self.__index = {"addresses": []}
+		self.__clear()
+		if os.path.exists(index_path):
+			with open(index_path, 'r') as f:
+				index = json.load(f)
+			if "blocks" in index:
+				self.__index.update(index)
+			else:
+				# indexes of blocks ingested in file order are rescanned
+				self.__index["addresses"] = index.get("addresses", [])
+		self.__scripts = {}
+		self.__outpoints = {}
+		for address, utxos in self.__index["unspent"].items():
+			for u in utxos:
+				self.__outpoints[f"{u['txid']}:{u['index']}"] = address
+		self.__outputs = {}
+		for block in self.__index["blocks"].values():
+			self.__add_outputs(block)
+		watched, self.__index["addresses"] = self.__index["addresses"], []
+		self.watch(watched + list(addresses), save=False)
+
+	@property
+	def height(self):
+		"""
+		height of the tip of the best chain, -1 before any block is ingested
+		"""
+		tip = self.__index["tip"]
+		return self.__index["blocks"][tip]["height"] if tip is not None else -1
+
+	@property
+	def tip(self):
+		"""
+		hash of the tip of the best chain, None before any block is ingested
+		"""
+		return self.__index["tip"]
+
+	def watch(self, addresses, save=True):
+		"""
+		add addresses to the filter, outputs of blocks ingested before are not indexed for them
+		:param addresses: bitcoin addresses
+		:param save: flag to persist the index when new addresses are watched, so a restart keeps them
+		:return: None
+		"""
+		with self.__lock:
+			added = False
+			for address in addresses:
+				script = _address_script(address)
+				if script not in self.__scripts:
+					self.__scripts[script] = address
+					self.__index["addresses"].append(address)
+					added = True
+			if added and save:
+				self.save()
+
+	def ingest_directory(self, directory):
+		"""
+		ingest all the `blk*.dat` files of a directory
+		:param directory: path to a bitcoin `blocks` directory
+		:return: number of blocks read
+		"""
+		return sum(self.ingest_block_file(path) for path in sorted(glob.glob(os.path.join(directory, "blk*.dat"))))
+
+	def ingest_block_file(self, path):
+		"""
+		ingest the blocks of a `blk*.dat` file, resuming after the last block read from it
+		:param path: path to the block file
+		:return: number of blocks read
+		"""
+		with self.__lock:
+			offset = self.__index["files"].get(path, 0)
+			count = 0
+			with open(path, 'rb') as f:
+				f.seek(offset)
+				while True:
+					header = f.read(8)
+					# preallocated block files are padded with zeros after the last block
+					if len(header) < 8 or header[:4] not in NETWORK_MAGIC:
+						break
+					self.__check_network(NETWORK_MAGIC[header[:4]])
+					size = struct.unpack('<I', header[4:])[0]
+					raw = f.read(size)
+					if len(raw) < size:
+						break
+					# orphans are read again from the file once their parent is indexed
+					self.__ingest(raw, {"file": path, "offset": offset + 8, "size": size})
+					offset = f.tell()
+					count += 1
+			self.__index["files"][path] = offset
+			self.save()
+			return count
+
+	def ingest_block(self, block):
+		"""
+		ingest a single raw block, e.g. the output of a regtest node `getblock <hash> 0`
+		:param block: raw block as bytes or hex string
+		:return: None
+		"""
+		with self.__lock:
+			raw = x(block) if isinstance(block, str) else block
+			self.__ingest(raw, {"raw": b2x(raw)})
+			self.save()
+
+	def get_unspent_many(self, addresses, testnet, priority=PRIORITY_DEFAULT):
+		with self.__lock:
+			return {address: [_clean(u) for u in self.__index["unspent"].get(address, [])] for address in addresses}
+
+	def get_spent_many(self, addresses, testnet, priority=PRIORITY_DEFAULT):
+		with self.__lock:
+			return {address: [_clean(u) for u in self.__index["spent"].get(address, [])] for address in addresses}
+
+	def get_activity_many(self, addresses, testnet, priority=PRIORITY_DEFAULT):
+		with self.__lock:
+			activity = {}
+			for address in addresses:
+				unspent = self.__index["unspent"].get(address, [])
+				spent = self.__index["spent"].get(address, [])
+				heights = [u.get("height") for u in unspent] + [u.get("spent_height", u.get("height")) for u in spent]
+				activity[address] = {
+					"n_tx": len(unspent) + len(spent),
+					"balance": sum(u["value"] for u in unspent),
+					"height": max((h for h in heights if h is not None), default=None),
+					"confirmations": min((self.height - h + 1 if h is not None else 0 for h in heights), default=None),
+				}
+			return activity
+
+	def get_confirmations(self, txid, testnet, priority=PRIORITY_DEFAULT):
+		"""
+		Get the number of confirmations of a transaction paying to a watched address
+		:param txid: transaction id
+		:param testnet: flag to set mainnet vs testnet
+		:param priority: ignored, lookups are local
+		:return: confirmations, 0 while unconfirmed, None if no watched output of the transaction is indexed
+		"""
+		with self.__lock:
+			for utxos in (*self.__index["unspent"].values(), *self.__index["spent"].values()):
+				for u in utxos:
+					if u["txid"] == txid:
+						return self.height - u["height"] + 1 if u.get("height") is not None else 0
+		return None
+
+	def get_height(self, testnet, priority=PRIORITY_DEFAULT):
+		return self.height if self.height >= 0 else None
+
+	def push_transaction(self, transaction, testnet):
+		"""
+		Broadcast a transaction through the relay backend, if any, and apply it to the index as unconfirmed
+		:param transaction: hex string transaction code
+		:param testnet: flag to set publish to mainnet vs testnet
+		:return: the relay response, or a chain.so like response without relay
+		"""
+		if self.relay is not None:
+			response = self.relay.push_transaction(transaction, testnet)
+			if response.get("status") != "success":
+				return response
+		else:
+			txid = b2lx(hashlib.sha256(hashlib.sha256(x(transaction)).digest()).digest())
+			response = {"status": "success", "data": {"network": "BTCTEST" if testnet else "BTC", "txid": txid}}
+		with self.__lock:
+			self.__apply_unconfirmed(CTransaction.deserialize(x(transaction)))
+			self.save()
+		return response
+
+	def reset(self):
+		"""
+		drop everything but the watched addresses, so the next ingestion rescans the blocks
+		:return: None
+		"""
+		with self.__lock:
+			self.__clear()
+			self.__outpoints = {}
+			self.__outputs = {}
+			self.save()
+
+	def save(self):
+		"""
+		drop the blocks too deep below the tip to be reorganized and atomically persist the index
+		:return: None
+		"""
+		with self.__lock:
+			self.__prune()
+			tmp_path = self.index_path + ".tmp"
+			with open(tmp_path, 'w+') as f:
+				json.dump(self.__index, f)
+			os.replace(tmp_path, self.index_path)
+
+	def __clear(self):
+		self.__index.update({"tip": None, "blocks": {}, "orphans": {}, "files": {}, "unspent": {}, "spent": {}, "pending_spends": {}})
+
+	def __check_network(self, network):
+		if (network != "mainnet") != self.testnet:
+			raise ValueError(f"Found {network} blocks in a {'testnet' if self.testnet else 'mainnet'} index")
+
+	def __ingest(self, raw, location):
+		"""
+		link a block to its parent, or hold it as an orphan, then move the tip to the best chain
+		:param raw: raw block
+		:param location: {"file", "offset", "size"} or {"raw"} the block is read again from if it is an orphan
+		"""
+		header = CBlockHeader.deserialize(raw[:80])
+		block_hash, prev = b2lx(header.GetHash()), b2lx(header.hashPrevBlock)
+		blocks, orphans = self.__index["blocks"], self.__index["orphans"]
+		if block_hash in blocks or block_hash in orphans:
+			return
+		# the first block ingested starts the chain, e.g. a regtest node synced from a given height
+		if prev not in blocks and prev != NULL_HASH and blocks:
+			orphans[block_hash] = {"prev": prev, **location}
+			return
+		best = self.__add(block_hash, CBlock.deserialize(raw))
+		connected = [block_hash]
+		while connected:
+			parent = connected.pop()
+			for orphan_hash in [h for h, orphan in orphans.items() if orphan["prev"] == parent]:
+				candidate = self.__add(orphan_hash, CBlock.deserialize(self.__read_orphan(orphans.pop(orphan_hash))))
+				best = max(best, candidate, key=lambda h: blocks[h]["work"])
+				connected.append(orphan_hash)
+		tip = self.__index["tip"]
+		if tip is None or blocks[best]["work"] > blocks[tip]["work"]:
+			self.__reorganize(best)
+
+	def __read_orphan(self, orphan):
+		if "raw" in orphan:
+			return x(orphan["raw"])
+		with open(orphan["file"], 'rb') as f:
+			f.seek(orphan["offset"])
+			return f.read(orphan["size"])
+
+	def __add(self, block_hash, block):
+		"""
+		index a block whose parent is indexed (or a first block), recording the watched outputs it
+		creates and spends as events, applied when the block is connected to the best chain
+		:return: block_hash
+		"""
+		parent = self.__index["blocks"].get(b2lx(block.hashPrevBlock))
+		events = []
+		outputs = {}
+		for tx in block.vtx:
+			txid = b2lx(tx.GetTxid())
+			if not tx.is_coinbase():
+				for txin in tx.vin:
+					key = f"{b2lx(txin.prevout.hash)}:{txin.prevout.n}"
+					address = outputs.get(key) or self.__outputs.get(key) or self.__outpoints.get(key) or self.__index["pending_spends"].get(key)
+					if address is not None:
+						events.append(["spend", key, address])
+			for n, txout in enumerate(tx.vout):
+				address = self.__scripts.get(b2x(txout.scriptPubKey))
+				if address is not None:
+					events.append(["out", txid, n, txout.nValue, address])
+					outputs[f"{txid}:{n}"] = address
+		record = {
+			"prev": b2lx(block.hashPrevBlock),
+			"height": parent["height"] + 1 if parent is not None else 0,
+			"work": (parent["work"] if parent is not None else 0) + _block_work(block.nBits),
+			"events": events,
+		}
+		self.__index["blocks"][block_hash] = record
+		self.__add_outputs(record)
+		return block_hash
+
+	def __add_outputs(self, block):
+		for event in block["events"]:
+			if event[0] == "out":
+				self.__outputs[f"{event[1]}:{event[2]}"] = event[4]
+
+	def __reorganize(self, new_tip):
+		"""
+		disconnect the blocks of the current tip back to the fork point, then connect the ones up to new_tip
+		"""
+		blocks = self.__index["blocks"]
+		height = lambda h: blocks[h]["height"] if h in blocks else -1
+		disconnect, connect = [], []
+		old, new = self.__index["tip"], new_tip
+		while old != new:
+			if old in blocks and height(old) >= height(new):
+				disconnect.append(old)
+				old = blocks[old]["prev"]
+			elif new in blocks:
+				connect.append(new)
+				new = blocks[new]["prev"]
+			else:
+				break
+		for block_hash in disconnect:
+			self.__disconnect(blocks[block_hash])
+		for block_hash in reversed(connect):
+			self.__connect(blocks[block_hash])
+		self.__index["tip"] = new_tip
+
+	def __connect(self, block):
+		unspent, spent, pending = self.__index["unspent"], self.__index["spent"], self.__index["pending_spends"]
+		height = block["height"]
+		# outputs and spends pushed through this backend before the block confirmed them
+		block["confirmed"] = []
+		for event in block["events"]:
+			if event[0] == "spend":
+				_, key, address = event
+				if key in self.__outpoints:
+					del self.__outpoints[key]
+					utxo = _find(unspent.get(address, []), key)
+					unspent[address].remove(utxo)
+					utxo["spent_height"] = height
+					spent.setdefault(address, []).append(utxo)
+				elif key in pending:
+					del pending[key]
+					_find(spent[address], key)["spent_height"] = height
+					block["confirmed"].append(key)
+				continue
+			_, txid, n, value, address = event
+			key = f"{txid}:{n}"
+			utxo = _find(unspent.get(address, []), key) or _find(spent.get(address, []), key)
+			if utxo is not None:
+				utxo["height"] = height
+				block["confirmed"].append(key)
+				continue
+			unspent.setdefault(address, []).append({"value": value, "index": n, "txid": txid, "height": height})
+			self.__outpoints[key] = address
+
+	def __disconnect(self, block):
+		unspent, spent, pending = self.__index["unspent"], self.__index["spent"], self.__index["pending_spends"]
+		confirmed = block.pop("confirmed", [])
+		for event in reversed(block["events"]):
+			if event[0] == "spend":
+				_, key, address = event
+				utxo = _find(spent.get(address, []), key)
+				if utxo is None or utxo.get("spent_height") != block["height"]:
+					continue
+				if key in confirmed:
+					utxo["spent_height"] = None
+					pending[key] = address
+					continue
+				spent[address].remove(utxo)
+				del utxo["spent_height"]
+				unspent.setdefault(address, []).append(utxo)
+				self.__outpoints[key] = address
+				continue
+			_, txid, n, value, address = event
+			key = f"{txid}:{n}"
+			if key in confirmed:
+				utxo = _find(unspent.get(address, []), key) or _find(spent.get(address, []), key)
+				utxo["height"] = None
+				continue
+			utxo = _find(unspent.get(address, []), key)
+			if utxo is not None:
+				unspent[address].remove(utxo)
+				del self.__outpoints[key]
+			# a spend of the output pushed through this backend can not confirm anymore
+			utxo = _find(spent.get(address, []), key)
+			if utxo is not None:
+				spent[address].remove(utxo)
+				pending.pop(key, None)
+
+	def __prune(self):
+		blocks = self.__index["blocks"]
+		if self.__index["tip"] is None:
+			return
+		floor = self.height - KEEP_DEPTH
+		for block_hash in [h for h, block in blocks.items() if block["height"] < floor]:
+			for event in blocks.pop(block_hash)["events"]:
+				if event[0] == "out":
+					self.__outputs.pop(f"{event[1]}:{event[2]}", None)
+
+	def __apply_unconfirmed(self, tx):
+		txid = b2lx(tx.GetTxid())
+		unspent, spent = self.__index["unspent"], self.__index["spent"]
+		for txin in tx.vin:
+			key = f"{b2lx(txin.prevout.hash)}:{txin.prevout.n}"
+			address = self.__outpoints.pop(key, None)
+			if address is None:
+				continue
+			utxo = _find(unspent[address], key)
+			unspent[address].remove(utxo)
+			utxo["spent_height"] = None
+			spent.setdefault(address, []).append(utxo)
+			self.__index["pending_spends"][key] = address
+		for n, txout in enumerate(tx.vout):
+			address = self.__scripts.get(b2x(txout.scriptPubKey))
+			if address is None:
+				continue
+			key = f"{txid}:{n}"
+			if key in self.__outpoints or _find(spent.get(address, []), key) is not None:
+				continue
+			unspent.setdefault(address, []).append({"value": txout.nValue, "index": n, "txid": txid, "height": None})
+			self.__outpoints[key] = address
+
+
+def _clean(utxo):
+	return {'value': utxo['value'], 'index': utxo['index'], 'txid': utxo['txid']}
+
+def _find(utxos, key):
+	return next((u for u in utxos if f"{u['txid']}:{u['index']}" == key), None)
+
+def _block_work(bits):
+	"""
+	expected number of hashes to find a block of the compact target `bits`
+	"""
+	exponent, mantissa = bits >> 24, bits & 0x007fffff
+	target = mantissa >> 8 * (3 - exponent) if exponent <= 3 else mantissa << 8 * (exponent - 3)
+	return 2**256 // (target + 1)
+
+def _address_script(address):
+	"""
+	scriptPubKey hex paying to a base58 address
+	"""
+	data = b58decode(address)
+	checksum = hashlib.sha256(hashlib.sha256(data[:-4]).digest()).digest()[:4]
+	if len(data) != 25 or data[-4:] != checksum:
+		raise ValueError(f"Invalid bitcoin address {address}")
+	version, h160 = data[0], data[1:21]
+	if ADDRESS_VERSIONS.get(version) == "p2pkh":
+		return "76a914" + h160.hex() + "88ac"
+	if ADDRESS_VERSIONS.get(version) == "p2sh":
+		return "a914" + h160.hex() + "87"
+	raise ValueError(f"Unsupported address version {version} for {address}")
@@ -0,0 +1,142 @@
+import os, json, time, uuid, fcntl, threading
+
+DEFAULT_RESERVATION_LEASE = 600
+
+
+class FileLock(object):
+	"""
+	FileLock is a reentrant lock held both across the threads of a process and across processes,
+	with an exclusive `flock` on a lock file
+	"""
+	def __init__(self, path):
+		"""
+		:param path: path to the lock file, created if missing
+		"""
+		self.path = path
+		self.__lock = threading.RLock()
+		self.__depth = 0
+		self.__file = None
+
+	def acquire(self):
+		self.__lock.acquire()
+		if self.__depth == 0:
+			try:
+				f = open(self.path, 'a+')
+				fcntl.flock(f, fcntl.LOCK_EX)
+			except:
+				self.__lock.release()
+				raise
+			self.__file = f
+		self.__depth += 1
+
+	def release(self):
+		self.__depth -= 1
+		if self.__depth == 0:
+			fcntl.flock(self.__file, fcntl.LOCK_UN)
+			self.__file.close()
+			self.__file = None
+		self.__lock.release()
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+	def __exit__(self, *exc):
+		self.release()
+
+
+class ReservationBook(object):
+	"""
+	ReservationBook records the utxos and change addresses picked by sends still in flight, so
+	concurrent sends of a wallet, in threads or in other processes, do not pick them again.
+	Reservations are leases: they expire on their own once the spend is visible on chain
+	"""
+	def __init__(self, filepath, lock):
+		"""
+		:param filepath: path to the reservations file, stored next to the wallet json file
+		:param lock: FileLock guarding the wallet files
+		"""
+		self.filepath = filepath
+		self.lock = lock
+
+	def reserved(self):
+		"""
+		:return: (set of reserved "txid:index" outpoints, set of reserved addresses)
+		"""
+		with self.lock:
+			entries = self.__load()
+		outpoints = {o for e in entries.values() for o in e["outpoints"]}
+		addresses = {a for e in entries.values() for a in e["addresses"]}
+		return outpoints, addresses
+
+	def reserve(self, outpoints, addresses, lease=DEFAULT_RESERVATION_LEASE):
+		"""
+		reserve outpoints and addresses for `lease` seconds
+		:param outpoints: [(txid, index)]
+		:param addresses: bitcoin addresses
+		:param lease: seconds before the reservation expires
+		:return: reservation token
+		:raise: ValueError if any of them is already reserved
+		"""
+		keys = [f"{txid}:{index}" for txid, index in outpoints]
+		with self.lock:
+			entries = self.__load()
+			taken = {o for e in entries.values() for o in e["outpoints"]} & set(keys)
+			taken |= {a for e in entries.values() for a in e["addresses"]} & set(addresses)
+			if taken:
+				raise ValueError(f"Already reserved by another send: {', '.join(sorted(taken))}")
+			token = uuid.uuid4().hex
+			entries[token] = {"outpoints": keys, "addresses": list(addresses), "expires": time.time() + lease}
+			self.__store(entries)
+			return token
+
+	def release(self, token):
+		"""
+		drop a reservation, e.g. when its transaction could not be signed
+		:param token: reservation token
+		:return: None
+		"""
+		with self.lock:
+			entries = self.__load()
+			if entries.pop(token, None) is not None:
+				self.__store(entries)
+
+	def release_outpoints(self, outpoints):
+		"""
+		drop the reservations holding any of the outpoints, e.g. when their transaction was rejected
+		:param outpoints: [(txid, index)]
+		:return: None
+		"""
+		keys = {f"{txid}:{index}" for txid, index in outpoints}
+		with self.lock:
+			entries = self.__load()
+			kept = {token: e for token, e in entries.items() if not keys & set(e["outpoints"])}
+			if len(kept) != len(entries):
+				self.__store(kept)
+
+	def __load(self):
+		try:
+			with open(self.filepath, 'r') as f:
+				entries = json.load(f)
+		except (ValueError, OSError):
+			return {}
+		now = time.time()
+		return {token: e for token, e in entries.items() if e["expires"] > now}
+
+	def __store(self, entries):
+		atomic_write_json(self.filepath, entries)
+
+
+def atomic_write_json(path, data):
+	"""
+	write a json file through a temporary file, so readers never see a partial write
+	:param path: destination path
+	:param data: json serializable data
+	:return: None
+	"""
+	tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	with open(tmp_path, 'w+') as f:
+		json.dump(data, f)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp_path, path)
@@ -0,0 +1,186 @@
+import time, threading
+
+from .coinselect import DUST_THRESHOLD
+
+DEFAULT_MAX_BATCH = 100
+DEFAULT_MAX_WAIT = 60
+
+PENDING = "pending"
+SIGNED = "signed"
+SENT = "sent"
+FAILED = "failed"
+
+
+class Payment(object):
+	"""
+	Payment tracks a single payout submitted to a PayoutQueue
+	"""
+	def __init__(self, address, value):
+		self.address = address
+		self.value = value
+		self.status = PENDING
+		self.transaction = None
+		self.txid = None
+		self.error = None
+		self.submitted = time.time()
+		self.__done = threading.Event()
+
+	def wait(self, timeout=None):
+		"""
+		block until the batch holding the payment is processed
+		:param timeout: seconds to wait, forever if None
+		:return: True if the payment is not pending anymore
+		"""
+		return self.__done.wait(timeout)
+
+	def _resolve(self, status, transaction=None, txid=None, error=None):
+		self.status = status
+		self.transaction = transaction
+		self.txid = txid
+		self.error = error
+		self.__done.set()
+
+	def __repr__(self):
+		return f"Payment({self.address}, {self.value}, {self.status})"
+
+
+class PayoutQueue(object):
+	"""
+	PayoutQueue collects payouts over a size or time window and pays them all in a single
+	transaction of a Wallet: one utxo selection, one change output and one signing round per batch
+	"""
+	def __init__(self, wallet, fee, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT, broadcast=True):
+		"""
+		:param wallet: Wallet paying the batches
+		:param fee: transaction fee in satoshis, or callable `fee(n_outputs)` returning it
+		:param max_batch: number of queued payments that triggers a batch
+		:param max_wait: seconds the oldest queued payment waits before a batch is triggered
+		:param broadcast: publish the batches with `Wallet.push_transaction`, otherwise they are only signed
+		"""
+		self.wallet = wallet
+		self.fee = fee
+		self.max_batch = max_batch
+		self.max_wait = max_wait
+		self.broadcast = broadcast
+		self.__pending = []
+		self.__lock = threading.Condition()
+		self.__flush_lock = threading.Lock()
+		self.__worker = None
+		self.__running = False
+
+	def submit(self, address, value):
+		"""
+		queue a payout, a full batch is paid right away
+		:param address: recipient bitcoin address, on the network of the wallet
+		:param value: satoshis to pay, at least DUST_THRESHOLD
+		:return: Payment
+		:raise: ValueError if the address or the value can not be paid, a bad payment would fail its whole batch
+		"""
+		from .btc import check_address
+		check_address(address, self.wallet.testnet)
+		if value < DUST_THRESHOLD:
+			raise ValueError(f"Invalid payment value {value}")
+		payment = Payment(address, value)
+		with self.__lock:
+			self.__pending.append(payment)
+			full = len(self.__pending) >= self.max_batch
+			self.__lock.notify_all()
+		if full and not self.__running:
+			self.flush()
+		return payment
+
+	def pending(self):
+		"""
+		:return: number of queued payments
+		"""
+		with self.__lock:
+			return len(self.__pending)
+
+	def flush(self):
+		"""
+		pay the queued payments, at most `max_batch` per transaction
+		:return: list of processed payments
+		"""
+		processed = []
+		with self.__flush_lock:
+			while True:
+				with self.__lock:
+					batch, self.__pending = self.__pending[:self.max_batch], self.__pending[self.max_batch:]
+				if not batch:
+					return processed
+				self.__pay(batch)
+				processed.extend(batch)
+
+	def start(self):
+		"""
+		start the background worker triggering the batches
+		:return: self
+		"""
+		with self.__lock:
+			if self.__running:
+				return self
+			self.__running = True
+		self.__worker = threading.Thread(target=self.__run, daemon=True)
+		self.__worker.start()
+		return self
+
+	def stop(self, flush=True):
+		"""
+		stop the background worker
+		:param flush: pay the queued payments before returning
+		:return: None
+		"""
+		with self.__lock:
+			self.__running = False
+			self.__lock.notify_all()
+		if self.__worker is not None:
+			self.__worker.join()
+			self.__worker = None
+		if flush:
+			self.flush()
+
+	def __run(self):
+		while True:
+			with self.__lock:
+				while self.__running:
+					if len(self.__pending) >= self.max_batch:
+						break
+					if self.__pending:
+						wait = self.__pending[0].submitted + self.max_wait - time.time()
+						if wait <= 0:
+							break
+						self.__lock.wait(wait)
+					else:
+						self.__lock.wait()
+				if not self.__running:
+					return
+			self.flush()
+
+	def __pay(self, batch):
+		# payments to the same address are merged in a single output
+		amounts = {}
+		for payment in batch:
+			amounts[payment.address] = amounts.get(payment.address, 0) + payment.value
+		outputs = [{"address": address, "value": value} for address, value in amounts.items()]
+		fee = self.fee(len(outputs)) if callable(self.fee) else self.fee
+		try:
+			transaction = self.wallet.send(outputs, fee)
+		except Exception as e:
+			for payment in batch:
+				payment._resolve(FAILED, error=str(e))
+			return
+		if not self.broadcast:
+			for payment in batch:
+				payment._resolve(SIGNED, transaction)
+			return
+		try:
+			response = self.wallet.push_transaction(transaction)
+		except Exception as e:
+			response = {"status": "fail", "data": str(e)}
+		if response.get("status") == "success":
+			txid = response.get("data", {}).get("txid")
+			for payment in batch:
+				payment._resolve(SENT, transaction, txid)
+		else:
+			for payment in batch:
+				payment._resolve(FAILED, transaction, error=f"Broadcast failed with: {response}")
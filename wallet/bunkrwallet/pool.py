@@ -0,0 +1,241 @@
+import os, json, threading
+from collections import deque
+
+DEFAULT_LOW_WATERMARK = 20
+DEFAULT_HIGH_WATERMARK = 100
+DEFAULT_PROVISION_BATCH = 10
+DEFAULT_POOL_INTERVAL = 60
+# journal entries appended to the pool file before it is rewritten as a single snapshot
+COMPACT_AFTER = 256
+
+
+class AddressPool(object):
+	"""
+	AddressPool keeps a persisted queue of unused, already provisioned addresses of a Wallet, so
+	handing out a deposit address is a pop instead of a chain scan. When the queue falls below the
+	low watermark a background worker tops it up to the high watermark, adopting the unused
+	accounts of the wallet first and then generating new keys and writing them to Bunkr.
+	Handed out addresses are remembered until they are used, so they are never picked as change.
+	The pool file is a json lines journal: a snapshot of the queue and the handed out addresses,
+	followed by one line per change. A pop appends a line, every process keeps the state in memory
+	and only reads the lines appended since, and the file is compacted back to a snapshot, without
+	the handed out addresses used since, every `COMPACT_AFTER` lines and on refills
+	"""
+	def __init__(self, wallet, filepath, low=DEFAULT_LOW_WATERMARK, high=DEFAULT_HIGH_WATERMARK, batch=DEFAULT_PROVISION_BATCH):
+		"""
+		:param wallet: Wallet providing the addresses
+		:param filepath: path to the pool file, stored next to the wallet file
+		:param low: queue size under which the pool is topped up
+		:param high: queue size the pool is topped up to
+		:param batch: number of keys provisioned into Bunkr per round
+		"""
+		if not 0 <= low <= high:
+			raise ValueError(f"Invalid watermarks low={low} high={high}")
+		self.wallet = wallet
+		self.filepath = filepath
+		self.low = low
+		self.high = high
+		self.batch = batch
+		self.__state = None
+		self.__file_id = None
+		self.__offset = 0
+		self.__entries = 0
+		self.__refill_lock = threading.Lock()
+		self.__wake = threading.Event()
+		self.__stopped = threading.Event()
+		self.__worker = None
+
+	def size(self):
+		"""
+		:return: number of addresses ready to be handed out
+		"""
+		with self.wallet.lock:
+			return len(self.__load()["queue"])
+
+	def reserved(self):
+		"""
+		:return: set of the queued and the handed out, still unused, addresses
+		"""
+		with self.wallet.lock:
+			state = self.__load()
+			return set(state["queue"]) | set(state["issued"])
+
+	def pop(self):
+		"""
+		hand out the next address of the queue, waking up the worker under the low watermark
+		:return: address, or None if the queue is empty
+		"""
+		with self.wallet.lock:
+			state = self.__load()
+			address = state["queue"][0] if state["queue"] else None
+			if address is not None:
+				self.__append(["pop", address])
+			low = len(state["queue"]) < self.low
+		if low:
+			self.__wake.set()
+		return address
+
+	def issue(self, address):
+		"""
+		remember an address handed out without the queue
+		:param address: bitcoin address
+		:return: None
+		"""
+		with self.wallet.lock:
+			self.__load()
+			self.__append(["issue", address])
+
+	def refill(self):
+		"""
+		top the queue up to the high watermark, with the unused accounts of the wallet first and
+		then with new keys provisioned into Bunkr
+		:return: number of addresses added
+		"""
+		with self.__refill_lock:
+			with self.wallet.lock:
+				state = self.__load()
+				self.__compact()
+				missing = self.high - len(state["queue"])
+			if missing <= 0:
+				return 0
+			added = self.__push(self.wallet.show_fresh_addresses(missing, partial=True))
+			while True:
+				# another process may have topped the queue up meanwhile, the lock is not held across Bunkr writes
+				with self.wallet.lock:
+					missing = self.high - len(self.__load()["queue"])
+				if missing <= 0:
+					return added
+				added += self.__push(self.wallet.add_addresses(min(self.batch, missing)))
+
+	def start(self, interval=DEFAULT_POOL_INTERVAL):
+		"""
+		start the background worker, topping the queue up when it falls under the low watermark
+		:param interval: seconds between checks when no pop wakes the worker up
+		:return: self
+		"""
+		if self.__worker is not None:
+			return self
+		self.__stopped.clear()
+		self.__wake.set()
+		self.__worker = threading.Thread(target=self.__run, args=(interval,), daemon=True)
+		self.__worker.start()
+		return self
+
+	def stop(self):
+		"""
+		stop the background worker
+		:return: None
+		"""
+		self.__stopped.set()
+		self.__wake.set()
+		if self.__worker is not None:
+			self.__worker.join()
+			self.__worker = None
+
+	def __push(self, addresses):
+		"""
+		queue the addresses that are neither queued nor handed out yet, e.g. by another process
+		:return: number of addresses queued
+		"""
+		with self.wallet.lock:
+			state = self.__load()
+			known = set(state["queue"]) | set(state["issued"])
+			addresses = [address for address in dict.fromkeys(addresses) if address not in known]
+			if addresses:
+				self.__append(["push", addresses])
+		return len(addresses)
+
+	def __unused(self, address):
+		try:
+			return self.wallet.get_account(address)["status"] == "fresh"
+		except ValueError:
+			return False
+
+	def __load(self):
+		"""
+		bring the in memory state up to date with the pool file, the caller holds the wallet lock
+		:return: {"queue": deque of addresses, "issued": list of addresses}
+		"""
+		try:
+			stat = os.stat(self.filepath)
+		except FileNotFoundError:
+			self.__state, self.__file_id, self.__offset, self.__entries = {"queue": deque(), "issued": []}, None, 0, 0
+			return self.__state
+		file_id = (stat.st_dev, stat.st_ino)
+		if self.__state is not None and file_id == self.__file_id and stat.st_size == self.__offset:
+			return self.__state
+		if self.__state is None or file_id != self.__file_id or stat.st_size < self.__offset:
+			# the file was compacted by another process, read it again from the snapshot
+			self.__state, self.__offset, self.__entries = {"queue": deque(), "issued": []}, 0, 0
+		with open(self.filepath, 'rb') as f:
+			f.seek(self.__offset)
+			data = f.read()
+		for line in data.splitlines():
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				# a line cut short by a crash
+				continue
+			_replay(self.__state, entry)
+			self.__entries += 1
+		self.__file_id, self.__offset = file_id, self.__offset + len(data)
+		return self.__state
+
+	def __append(self, entry):
+		with open(self.filepath, 'ab') as f:
+			f.write(json.dumps(entry).encode() + b"\n")
+			f.flush()
+			os.fsync(f.fileno())
+			stat = os.fstat(f.fileno())
+		_replay(self.__state, entry)
+		self.__file_id, self.__offset = (stat.st_dev, stat.st_ino), stat.st_size
+		self.__entries += 1
+		if self.__entries > COMPACT_AFTER:
+			self.__compact()
+
+	def __compact(self):
+		state = self.__state
+		# handed out addresses that received funds are not fresh anymore
+		state["issued"] = [address for address in state["issued"] if self.__unused(address)]
+		data = json.dumps({"queue": list(state["queue"]), "issued": state["issued"]}).encode() + b"\n"
+		tmp_path = f"{self.filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+		with open(tmp_path, 'wb') as f:
+			f.write(data)
+			f.flush()
+			os.fsync(f.fileno())
+			stat = os.fstat(f.fileno())
+		os.replace(tmp_path, self.filepath)
+		self.__file_id, self.__offset, self.__entries = (stat.st_dev, stat.st_ino), len(data), 1
+
+	def __run(self, interval):
+		while not self.__stopped.is_set():
+			self.__wake.wait(interval)
+			self.__wake.clear()
+			if self.__stopped.is_set():
+				return
+			try:
+				if self.size() < self.low:
+					self.refill()
+			except Exception as e:
+				print(f"Address pool refill failed with: {e}")
+
+
+def _replay(state, entry):
+	"""
+	apply a line of the pool file to the state
+	"""
+	if isinstance(entry, dict):
+		state["queue"] = deque(entry.get("queue", []))
+		state["issued"] = list(entry.get("issued", []))
+	elif entry[0] == "pop":
+		if state["queue"] and state["queue"][0] == entry[1]:
+			state["queue"].popleft()
+		elif entry[1] in state["queue"]:
+			state["queue"].remove(entry[1])
+		state["issued"].append(entry[1])
+	elif entry[0] == "issue":
+		if entry[1] in state["queue"]:
+			state["queue"].remove(entry[1])
+		state["issued"].append(entry[1])
+	elif entry[0] == "push":
+		state["queue"].extend(entry[1])
\ No newline at end of file
@@ -0,0 +1,120 @@
+import time, threading, contextvars
+from contextlib import contextmanager
+
+_ACTIVE = contextvars.ContextVar("send_profile", default=None)
+
+
+class SendProfile(object):
+	"""
+	SendProfile records where the time of a `Wallet.send` goes: the duration of its named phases,
+	counters of the work done (chain requests, Bunkr RPCs, inputs, bytes) and, optionally, a
+	cProfile of the whole send
+	"""
+	def __init__(self, cprofile=False):
+		"""
+		:param cprofile: flag to also run the send under cProfile, see `dump`
+		"""
+		self.phases = {}
+		self.counters = {}
+		self.elapsed = None
+		self.__lock = threading.Lock()
+		self.__profiler = None
+		if cprofile:
+			import cProfile
+			self.__profiler = cProfile.Profile()
+
+	@property
+	def cprofile(self):
+		return self.__profiler is not None
+
+	@contextmanager
+	def run(self):
+		"""
+		time the whole send, under cProfile if enabled
+		"""
+		start = time.perf_counter()
+		if self.__profiler is not None:
+			self.__profiler.enable()
+		try:
+			yield self
+		finally:
+			if self.__profiler is not None:
+				self.__profiler.disable()
+			self.elapsed = time.perf_counter() - start
+
+	@contextmanager
+	def phase(self, name):
+		"""
+		add the duration of the block to a phase
+		:param name: phase name
+		"""
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			duration = time.perf_counter() - start
+			with self.__lock:
+				self.phases[name] = self.phases.get(name, 0.0) + duration
+
+	@contextmanager
+	def active(self):
+		"""
+		make the profile the one chain backends count their requests in, within the block and
+		the current thread, see `active_profile`
+		"""
+		token = _ACTIVE.set(self)
+		try:
+			yield self
+		finally:
+			_ACTIVE.reset(token)
+
+	def count(self, name, n=1):
+		"""
+		:param name: counter name
+		:param n: amount to add
+		:return: None
+		"""
+		with self.__lock:
+			self.counters[name] = self.counters.get(name, 0) + n
+
+	def to_dict(self):
+		"""
+		:return: {"elapsed": seconds, "phases": {name: seconds}, "counters": {name: count}}
+		"""
+		with self.__lock:
+			return {"elapsed": self.elapsed, "phases": dict(self.phases), "counters": dict(self.counters)}
+
+	def stats(self, sort="cumulative"):
+		"""
+		:param sort: pstats sort key
+		:return: pstats.Stats of the send
+		:raise: RuntimeError if the send did not run under cProfile
+		"""
+		import pstats
+		if self.__profiler is None:
+			raise RuntimeError("The send was not profiled with cProfile, use SendProfile(cprofile=True)")
+		return pstats.Stats(self.__profiler).sort_stats(sort)
+
+	def dump(self, path):
+		"""
+		write the cProfile of the send, readable with `pstats` or `snakeviz`
+		:param path: destination file
+		:return: None
+		:raise: RuntimeError if the send did not run under cProfile
+		"""
+		self.stats().dump_stats(path)
+
+	def __str__(self):
+		profile = self.to_dict()
+		lines = [f"{name:<22}{seconds*1000:>10.2f} ms" for name, seconds in profile["phases"].items()]
+		if profile["elapsed"] is not None:
+			lines.append(f"{'total':<22}{profile['elapsed']*1000:>10.2f} ms")
+		lines.extend(f"{name:<22}{count:>10}" for name, count in profile["counters"].items())
+		return "\n".join(lines)
+
+
+def active_profile():
+	"""
+	:return: SendProfile made active by `SendProfile.active` in the current thread, None if there is none
+	"""
+	return _ACTIVE.get()
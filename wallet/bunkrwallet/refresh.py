@@ -0,0 +1,178 @@
+import os, json, time, threading
+
+from .chain import default_backend
+from .locking import atomic_write_json
+from .scheduler import PRIORITY_BACKGROUND
+
+DEFAULT_REFRESH_BUDGET = 100
+DEFAULT_REFRESH_INTERVAL = 60
+USED_RECHECK_AFTER = 7*86400
+CONFIRMED_AFTER = 6
+# addresses with funds are refreshed first, fully spent ones last
+REFRESH_ORDER = ("in use", "fresh", "used")
+
+
+def account_status(activity):
+	"""
+	status of an account from its on chain activity, see `ChainBackend.get_activity_many`
+	:param activity: activity summary of the address
+	:return: "fresh", "in use" or "used"
+	"""
+	if activity["balance"] > 0:
+		return "in use"
+	if activity["n_tx"] == 0:
+		return "fresh"
+	# a spend or deposit not confirmed yet, or whose confirmations are unknown, may still change
+	if activity["confirmations"] is not None and activity["confirmations"] >= CONFIRMED_AFTER:
+		return "used"
+	return "in use"
+
+def aged_activity(activity, tip):
+	"""
+	activity of an address as of a later chain tip, assuming no new transaction: once all of its
+	transactions are confirmed the confirmations follow the tip from the height of the last one
+	:param activity: activity summary of the address
+	:param tip: current chain tip height, None if unknown
+	:return: activity summary
+	"""
+	if tip is None or activity["height"] is None or not activity["confirmations"]:
+		return activity
+	return dict(activity, confirmations=max(activity["confirmations"], tip - activity["height"] + 1))
+
+
+class AccountRefresher(object):
+	"""
+	AccountRefresher refreshes the account statuses of a Wallet incrementally. A refresh pass
+	queues the accounts that may have changed, "in use" ones first, and every step only queries
+	`budget` of them. The pass and the last seen activity of every address are persisted, so an
+	interrupted pass resumes where it stopped. Planning a pass asks the backend for the chain tip
+	only: an address whose last seen transactions are all confirmed deep enough at the current
+	tip is settled, it is marked "used" without a query and only rechecked every
+	`used_recheck_after` seconds
+	"""
+	def __init__(self, wallet, filepath, budget=DEFAULT_REFRESH_BUDGET, used_recheck_after=USED_RECHECK_AFTER):
+		"""
+		:param wallet: Wallet to refresh
+		:param filepath: path to the refresh state file, stored next to the wallet file
+		:param budget: maximum number of addresses queried per step
+		:param used_recheck_after: seconds before a confirmed "used" account is queried again
+		"""
+		self.wallet = wallet
+		self.filepath = filepath
+		self.budget = budget
+		self.used_recheck_after = used_recheck_after
+		self.__lock = threading.RLock()
+		self.__stopped = threading.Event()
+		self.__worker = None
+		self.__state = {"pass": None, "addresses": {}}
+		if os.path.exists(filepath):
+			try:
+				with open(filepath, 'r') as f:
+					self.__state.update(json.load(f))
+			except (ValueError, OSError):
+				pass
+
+	def pending(self):
+		"""
+		:return: number of addresses left in the current pass, 0 if there is none
+		"""
+		with self.__lock:
+			return len(self.__state["pass"]) if self.__state["pass"] is not None else 0
+
+	def last_seen(self, address):
+		"""
+		:param address: bitcoin address
+		:return: the last activity seen for the address with the time it was "checked", or None
+		"""
+		with self.__lock:
+			return self.__state["addresses"].get(address)
+
+	def step(self, budget=None):
+		"""
+		query the next addresses of the current pass, starting a new pass if there is none,
+		and record their statuses in the wallet
+		:param budget: maximum number of addresses queried, `self.budget` if None
+		:return: True if the pass is completed
+		"""
+		budget = budget if budget is not None else self.budget
+		with self.__lock:
+			backend = self.wallet.cache.backend if self.wallet.cache.backend is not None else default_backend()
+			statuses = {}
+			if self.__state["pass"] is None:
+				self.__state["pass"], statuses = self.__plan(backend)
+			batch, rest = self.__state["pass"][:budget], self.__state["pass"][budget:]
+			activity = backend.get_activity_many(batch, self.wallet.testnet, PRIORITY_BACKGROUND) if batch else {}
+			now = time.time()
+			for address, seen in activity.items():
+				self.__state["addresses"][address] = dict(seen, checked=now)
+				statuses[address] = account_status(seen)
+			completed = len(rest) == 0
+			self.wallet.update_statuses(statuses, completed)
+			self.__state["pass"] = rest if not completed else None
+			atomic_write_json(self.filepath, self.__state)
+			return completed
+
+	def run(self, budget=None):
+		"""
+		complete the current pass, or a new one
+		:param budget: maximum number of addresses queried per step
+		:return: None
+		"""
+		while not self.step(budget):
+			pass
+
+	def start(self, interval=DEFAULT_REFRESH_INTERVAL, max_age=None):
+		"""
+		start the background worker, taking a step every `interval` seconds while the wallet is stale
+		or a pass is pending
+		:param interval: seconds between steps
+		:param max_age: seconds after which the wallet is stale, see `Wallet.is_stale`
+		:return: self
+		"""
+		if self.__worker is not None:
+			return self
+		self.__stopped.clear()
+		self.__worker = threading.Thread(target=self.__run, args=(interval, max_age), daemon=True)
+		self.__worker.start()
+		return self
+
+	def stop(self):
+		"""
+		stop the background worker, the current pass resumes on the next start
+		:return: None
+		"""
+		self.__stopped.set()
+		if self.__worker is not None:
+			self.__worker.join()
+			self.__worker = None
+
+	def __plan(self, backend):
+		"""
+		:return: (addresses to query in the pass, {address: status} of the ones settled since last seen)
+		"""
+		now = time.time()
+		tip = backend.get_height(self.wallet.testnet, PRIORITY_BACKGROUND)
+		ordered = {status: [] for status in REFRESH_ORDER}
+		settled = {}
+		addresses = set(self.wallet.addresses())
+		self.__state["addresses"] = {address: seen for address, seen in self.__state["addresses"].items() if address in addresses}
+		for acct in self.wallet.wallet:
+			seen = self.__state["addresses"].get(acct["address"])
+			if seen is not None and now < seen["checked"] + self.used_recheck_after:
+				seen = self.__state["addresses"][acct["address"]] = aged_activity(seen, tip)
+				if account_status(seen) == "used":
+					if acct["status"] != "used":
+						settled[acct["address"]] = "used"
+					continue
+			ordered.setdefault(acct["status"], []).append(acct["address"])
+		return [address for addresses in ordered.values() for address in addresses], settled
+
+	def __run(self, interval, max_age):
+		while not self.__stopped.is_set():
+			try:
+				stale = self.wallet.is_stale(max_age) if max_age is not None else self.wallet.is_stale()
+				if self.pending() or stale:
+					self.step()
+			except Exception as e:
+				print(f"Account refresh failed with: {e}")
+			self.__stopped.wait(interval)
@@ -0,0 +1,184 @@
+import time, heapq, random, threading, itertools
+
+PRIORITY_SEND = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BACKGROUND = 2
+
+# (requests per second, burst) per backend, backends not listed are not rate limited
+DEFAULT_RATES = {
+	"blockcypher": (3, 3),
+	"chainso": (5, 5),
+}
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 60
+
+
+class ThrottledError(RuntimeError):
+	pass
+
+
+class TokenBucket(object):
+	"""
+	TokenBucket refills `rate` tokens per second up to `burst` tokens
+	"""
+	def __init__(self, rate, burst):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.paused_until = 0
+		self.__last = time.monotonic()
+
+	def delay(self):
+		"""
+		seconds until a token can be taken, 0 if one is available now
+		"""
+		now = time.monotonic()
+		self.tokens = min(self.burst, self.tokens + (now - self.__last) * self.rate)
+		self.__last = now
+		wait = max(0, self.paused_until - now)
+		if self.tokens < 1:
+			wait = max(wait, (1 - self.tokens) / self.rate)
+		return wait
+
+	def take(self):
+		self.tokens -= 1
+
+	def pause(self, seconds):
+		"""
+		stop handing out tokens for some seconds, e.g. after a 429 answer
+		"""
+		self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+		self.tokens = 0
+
+
+class RequestScheduler(object):
+	"""
+	RequestScheduler sits in front of every chain api request. It rate limits each backend with a
+	token bucket, serves waiting requests by priority, and retries throttled or failed requests
+	honoring Retry-After or a jittered exponential backoff
+	"""
+	def __init__(self, rates=DEFAULT_RATES, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+		"""
+		:param rates: {backend: (requests_per_second, burst)}, backends not listed are not rate limited
+		:param max_retries: retries of a request before giving up
+		:param base_delay: first backoff delay in seconds, doubled on every retry
+		:param max_delay: maximum backoff delay in seconds
+		"""
+		self.max_retries = max_retries
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+		self.__buckets = {backend: TokenBucket(*rate) for backend, rate in rates.items()}
+		self.__queues = {}
+		self.__stats = {}
+		self.__counter = itertools.count()
+		self.__condition = threading.Condition()
+
+	def submit(self, backend, request, priority=PRIORITY_DEFAULT):
+		"""
+		run a request once the backend allows it, retrying on throttling and transient failures
+		:param backend: name of the api backend, e.g. "blockcypher"
+		:param request: callable performing the http request and returning a `requests.Response`
+		:param priority: one of PRIORITY_SEND, PRIORITY_DEFAULT, PRIORITY_BACKGROUND, lower goes first
+		:return: `requests.Response`
+		:raise: ThrottledError when the retries are exhausted
+		"""
+		import requests
+		for attempt in range(self.max_retries + 1):
+			self.__acquire(backend, priority)
+			retry_after = None
+			try:
+				response = request()
+			except requests.RequestException as e:
+				error = e
+			else:
+				if response.status_code != 429 and response.status_code < 500:
+					return response
+				error = f"HTTP {response.status_code}"
+				if response.status_code == 429:
+					self.__count(backend, "throttled")
+					retry_after = _retry_after(response.headers.get("Retry-After"))
+			if attempt == self.max_retries:
+				break
+			self.__count(backend, "retries")
+			delay = retry_after if retry_after is not None else self.__backoff(attempt)
+			if retry_after is not None:
+				self.__pause(backend, delay)
+			else:
+				time.sleep(delay)
+		raise ThrottledError(f"{backend} request failed after {self.max_retries} retries: {error}")
+
+	def metrics(self):
+		"""
+		:return: {
+			"<backend>" : {
+				"queue_depth" : requests waiting for a token,
+				"requests"    : requests sent,
+				"throttled"   : 429 answers received,
+				"retries"     : retried requests,
+				"wait_time"   : total seconds spent waiting in the queue,
+			}
+		}
+		"""
+		with self.__condition:
+			backends = set(self.__stats) | set(self.__queues)
+			return {
+				backend: {
+					"queue_depth": len(self.__queues.get(backend, [])),
+					**{k: 0 for k in ("requests", "throttled", "retries", "wait_time")},
+					**self.__stats.get(backend, {}),
+				} for backend in backends
+			}
+
+	def __acquire(self, backend, priority):
+		start = time.monotonic()
+		with self.__condition:
+			queue = self.__queues.setdefault(backend, [])
+			ticket = (priority, next(self.__counter))
+			heapq.heappush(queue, ticket)
+			bucket = self.__buckets.get(backend)
+			while True:
+				wait = bucket.delay() if bucket is not None else 0
+				if queue[0] == ticket and wait == 0:
+					break
+				self.__condition.wait(wait if queue[0] == ticket else None)
+			heapq.heappop(queue)
+			if bucket is not None:
+				bucket.take()
+			self.__count(backend, "requests")
+			self.__count(backend, "wait_time", time.monotonic() - start)
+			self.__condition.notify_all()
+
+	def __pause(self, backend, seconds):
+		with self.__condition:
+			bucket = self.__buckets.get(backend)
+			if bucket is not None:
+				bucket.pause(seconds)
+				self.__condition.notify_all()
+				return
+		time.sleep(seconds)
+
+	def __backoff(self, attempt):
+		return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+	def __count(self, backend, name, amount=1):
+		with self.__condition:
+			stats = self.__stats.setdefault(backend, {})
+			stats[name] = stats.get(name, 0) + amount
+
+
+def _retry_after(value):
+	"""
+	parse a Retry-After header, either delta seconds or an http date
+	"""
+	if value is None:
+		return None
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+	from email.utils import parsedate_to_datetime
+	try:
+		return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+	except (TypeError, ValueError):
+		return None
@@ -0,0 +1,239 @@
+import os, json, stat, socket, socketserver, threading
+
+# the socket lives in a directory of the user, a shared path could be bound first by another user
+DEFAULT_SERVICE_ADDRESS = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or os.path.expanduser("~/.bunkr"), "bunkr_wallet.sock")
+SERVICE_TIMEOUT = 300
+# background workers of the served wallets: the account refresher and the address pool
+DEFAULT_WORKERS = ("refresher", "pool")
+
+
+class WalletOperations(object):
+	"""
+	WalletOperations are the bunkr-wallet command line operations, run against a BunkrWallet
+	either in the command line process or, warm, in the wallet service
+	"""
+	def __init__(self, bunkr_wallet, workers=()):
+		"""
+		:param bunkr_wallet: BunkrWallet to operate with
+		:param workers: names of the Wallet workers started by `_start_workers`, see DEFAULT_WORKERS
+		"""
+		self.bunkr_wallet = bunkr_wallet
+		self.workers = workers
+		self.__lock = threading.Lock()
+		self.__started = None
+
+	def list_wallets(self):
+		return self.bunkr_wallet.list_wallets()
+
+	def check_balance(self, name):
+		return self.__wallet(name).show_balance()
+
+	def get_address(self, name):
+		return self.__wallet(name).show_fresh_address()
+
+	def send(self, name, address, amount, fee):
+		return self.__wallet(name).send([{"address": address, "value": amount}], fee)
+
+	def portfolio(self, names=None):
+		# the wallets are resolved under the lock, their chain lookups run outside of it
+		with self.__lock:
+			wallets = [self.bunkr_wallet.get_wallet(name) for name in (self.bunkr_wallet.list_wallets() if names is None else names)]
+		return self.bunkr_wallet.portfolio_of(wallets)
+
+	def new_wallet(self, name, testnet):
+		with self.__lock:
+			self.__start(self.bunkr_wallet.create_wallet(name, testnet))
+
+	def refresh(self, name, force):
+		return self.__wallet(name).refresh(force)
+
+	def import_wallet(self, name, path):
+		with self.__lock:
+			self.__start(self.bunkr_wallet.import_wallet(name, path))
+
+	def export_wallet(self, name, path):
+		self.__wallet(name).export_json(path)
+
+	# the worker methods are underscored so service clients can not call them
+	def _start_workers(self):
+		"""
+		load every wallet and start its background workers, wallets created or imported later get
+		theirs when they are
+		:return: None
+		"""
+		with self.__lock:
+			self.__started = {}
+			for name in self.bunkr_wallet.list_wallets():
+				self.__start(self.bunkr_wallet.get_wallet(name))
+
+	def _stop_workers(self):
+		"""
+		stop the background workers, an interrupted refresh pass resumes on the next start
+		:return: None
+		"""
+		with self.__lock:
+			started, self.__started = self.__started or {}, None
+		for wallet in started.values():
+			for worker in self.workers:
+				getattr(wallet, worker).stop()
+
+	def __start(self, wallet):
+		if self.__started is not None and wallet.name not in self.__started:
+			for worker in self.workers:
+				getattr(wallet, worker).start()
+			self.__started[wallet.name] = wallet
+
+	def __wallet(self, name):
+		# wallets are loaded once, by the first request asking for them
+		with self.__lock:
+			return self.bunkr_wallet.get_wallet(name)
+
+
+class WalletService(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	"""
+	WalletService keeps a BunkrWallet, its loaded wallets, chain caches and Bunkr connection warm
+	behind a local unix socket. Requests and responses are json lines:
+	`{"operation": name, "args": {...}}` answered by `{"result": ...}` or `{"error": message, "type": name}`.
+	While serving, every wallet refreshes its account statuses and tops its address pool up in
+	the background
+	"""
+	daemon_threads = True
+
+	def __init__(self, bunkr_wallet, address=DEFAULT_SERVICE_ADDRESS, workers=DEFAULT_WORKERS):
+		"""
+		:param bunkr_wallet: BunkrWallet to serve
+		:param address: path of the unix socket
+		:param workers: names of the Wallet workers run while serving, see DEFAULT_WORKERS
+		:raise: RuntimeError if a service is already running on the address, or the address is not
+			a socket owned only by this user
+		"""
+		if os.path.lexists(address):
+			if ServiceClient.connect(address) is not None:
+				raise RuntimeError(f"A bunkr-wallet service is already running on {address}")
+			os.remove(address)
+		self.operations = WalletOperations(bunkr_wallet, workers)
+		self.address = address
+		os.makedirs(os.path.dirname(os.path.abspath(address)), mode=0o700, exist_ok=True)
+		# the socket is created owner only, a chmod after bind would leave it open to other users meanwhile
+		umask = os.umask(0o177)
+		try:
+			super().__init__(address, ServiceHandler)
+		finally:
+			os.umask(umask)
+
+	def start(self):
+		"""
+		serve requests in a background thread
+		:return: self
+		"""
+		threading.Thread(target=self.serve_forever, daemon=True).start()
+		return self
+
+	def serve_forever(self, poll_interval=0.5):
+		self.operations._start_workers()
+		try:
+			super().serve_forever(poll_interval)
+		finally:
+			self.operations._stop_workers()
+
+	def stop(self):
+		"""
+		stop serving, the background workers and remove the socket
+		:return: None
+		"""
+		self.shutdown()
+		self.operations._stop_workers()
+		self.server_close()
+
+	def server_close(self):
+		super().server_close()
+		if os.path.exists(self.address):
+			os.remove(self.address)
+
+	def handle_request_line(self, line):
+		"""
+		:param line: json request
+		:return: json response
+		"""
+		try:
+			request = json.loads(line)
+			operation = request["operation"]
+			if operation.startswith("_") or not hasattr(self.operations, operation):
+				raise ValueError(f"Unknown operation '{operation}'")
+			response = {"result": getattr(self.operations, operation)(**request.get("args", {}))}
+		except Exception as e:
+			response = {"error": str(e), "type": type(e).__name__}
+		return json.dumps(response, default=str)
+
+
+class ServiceHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		for line in self.rfile:
+			self.wfile.write(self.server.handle_request_line(line.decode()).encode() + b"\n")
+			self.wfile.flush()
+
+
+def check_socket_owner(address):
+	"""
+	:param address: path of a service unix socket
+	:return: None, also if nothing exists at the address
+	:raise: RuntimeError if the address is not a socket owned by this user and closed to the others
+	"""
+	try:
+		st = os.lstat(address)
+	except FileNotFoundError:
+		return
+	if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+		raise RuntimeError(f"Refusing {address}: it is not a socket owned only by this user")
+
+
+class ServiceClient(object):
+	"""
+	ServiceClient runs WalletOperations in a running wallet service
+	"""
+	def __init__(self, sock):
+		"""
+		:param sock: socket connected to the service, see `ServiceClient.connect`
+		"""
+		self.__socket = sock
+		self.__file = sock.makefile("rwb")
+
+	@classmethod
+	def connect(cls, address=DEFAULT_SERVICE_ADDRESS, timeout=SERVICE_TIMEOUT):
+		"""
+		:param address: path of the service unix socket
+		:param timeout: seconds to wait for a response
+		:return: ServiceClient, or None if no service is running
+		:raise: RuntimeError if the address is not a socket owned only by this user, another user
+			could be answering on it
+		"""
+		check_socket_owner(address)
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.settimeout(timeout)
+		try:
+			sock.connect(address)
+		except OSError:
+			sock.close()
+			return None
+		return cls(sock)
+
+	def call(self, operation, **args):
+		"""
+		:param operation: name of the WalletOperations method
+		:param args: arguments of the operation
+		:return: the result of the operation
+		:raise: RuntimeError with the error raised in the service
+		"""
+		self.__file.write(json.dumps({"operation": operation, "args": args}).encode() + b"\n")
+		self.__file.flush()
+		line = self.__file.readline()
+		if not line:
+			raise RuntimeError("The bunkr-wallet service closed the connection")
+		response = json.loads(line)
+		if "error" in response:
+			raise RuntimeError(f"{response['type']}: {response['error']}")
+		return response["result"]
+
+	def close(self):
+		self.__file.close()
+		self.__socket.close()
@@ -0,0 +1,284 @@
+import os, json, sqlite3, threading
+from contextlib import contextmanager
+
+from .accounts import Account, ACCOUNT_FIELDS
+from .locking import atomic_write_json
+
+SQLITE_EXTENSION = ".db"
+JSON_EXTENSION = ".json"
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS header (
+	key TEXT PRIMARY KEY,
+	value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS accounts (
+	position INTEGER PRIMARY KEY AUTOINCREMENT,
+	address TEXT NOT NULL UNIQUE,
+	pubkey_hex TEXT NOT NULL,
+	secret_name TEXT NOT NULL,
+	status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS accounts_status ON accounts (status);
+"""
+
+
+def open_store(filepath):
+	"""
+	open the storage engine matching the wallet file extension: the legacy json format for
+	".json" files, SQLite otherwise
+	:param filepath: path to the wallet file
+	:return: JsonWalletStore or SQLiteWalletStore
+	"""
+	if filepath.endswith(JSON_EXTENSION):
+		return JsonWalletStore(filepath)
+	return SQLiteWalletStore(filepath)
+
+def export_json(store, path):
+	"""
+	write the content of a wallet store in the json wallet format `[header, *accounts]`
+	:param store: wallet store
+	:param path: destination json file
+	:return: None
+	"""
+	header, accounts = store.load()
+	atomic_write_json(path, [header, *(acct.to_dict() for acct in accounts)])
+
+def import_json(store, path):
+	"""
+	replace the content of a wallet store with a json wallet file `[header, *accounts]`
+	:param store: wallet store
+	:param path: source json file
+	:return: None
+	"""
+	with open(path, 'r') as f:
+		wallet_file = json.load(f)
+	store.create(wallet_file[0], wallet_file[1:])
+
+
+class JsonWalletStore(object):
+	"""
+	JsonWalletStore keeps the legacy `[header, *accounts]` json wallet format. Every committed
+	transaction rewrites the whole file, atomically through a temporary file
+	"""
+	def __init__(self, filepath):
+		"""
+		:param filepath: path to the json wallet file
+		"""
+		self.filepath = filepath
+		self.__lock = threading.RLock()
+		self.__depth = 0
+		self.__dirty = False
+		self.__header = None
+		self.__accounts = None
+		self.__version = None
+
+	def paths(self):
+		"""
+		:return: files holding the wallet
+		"""
+		return [self.filepath]
+
+	def create(self, header, accounts):
+		with self.transaction():
+			self.__header = dict(header)
+			self.__accounts = [Account.from_dict(acct) for acct in accounts]
+			self.__dirty = True
+
+	def load(self):
+		"""
+		:return: (header, [Account]) as read from disk
+		"""
+		with self.__lock:
+			with open(self.filepath, 'r') as f:
+				wallet_file = json.load(f)
+			self.__version = self.__stat()
+			self.__header = wallet_file[0]
+			self.__accounts = [Account.from_dict(acct) for acct in wallet_file[1:]]
+			return dict(self.__header), list(self.__accounts)
+
+	def changed(self):
+		"""
+		:return: True if the file was written by someone else since the last `load`
+		"""
+		with self.__lock:
+			return self.__stat() != self.__version
+
+	def add_accounts(self, accounts):
+		with self.transaction():
+			self.__accounts.extend(Account.from_dict(acct) for acct in accounts)
+			self.__dirty = True
+
+	def remove_accounts(self, addresses):
+		addresses = set(addresses)
+		with self.transaction():
+			self.__accounts = [acct for acct in self.__accounts if acct["address"] not in addresses]
+			self.__dirty = True
+
+	def update_statuses(self, statuses):
+		"""
+		:param statuses: {address: status}
+		"""
+		with self.transaction():
+			# changed accounts are replaced, the records handed out by `load` are left untouched
+			for i, acct in enumerate(self.__accounts):
+				if acct.address in statuses:
+					self.__accounts[i] = Account(acct.address, acct.pubkey_hex, acct.secret_name, statuses[acct.address])
+			self.__dirty = True
+
+	def update_header(self, header):
+		"""
+		:param header: header keys to set
+		"""
+		with self.transaction():
+			self.__header.update(header)
+			self.__dirty = True
+
+	@contextmanager
+	def transaction(self):
+		"""
+		group changes in a single rewrite of the file, discarded if the block raises
+		"""
+		with self.__lock:
+			if self.__depth == 0 and self.__accounts is None and os.path.exists(self.filepath):
+				self.load()
+			self.__depth += 1
+			try:
+				yield self
+			except BaseException:
+				if self.__depth == 1:
+					self.__dirty = False
+					self.__accounts = None
+				raise
+			finally:
+				self.__depth -= 1
+			if self.__depth == 0 and self.__dirty:
+				atomic_write_json(self.filepath, [self.__header, *(acct.to_dict() for acct in self.__accounts)])
+				self.__version = self.__stat()
+				self.__dirty = False
+
+	def close(self):
+		pass
+
+	def __stat(self):
+		try:
+			stat = os.stat(self.filepath)
+		except FileNotFoundError:
+			return None
+		return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class SQLiteWalletStore(object):
+	"""
+	SQLiteWalletStore keeps the wallet in an SQLite database, indexed on address and status.
+	Changes only touch the affected rows and every transaction commits atomically
+	"""
+	def __init__(self, filepath):
+		"""
+		:param filepath: path to the SQLite wallet file, created if missing
+		"""
+		self.filepath = filepath
+		self.__lock = threading.RLock()
+		self.__depth = 0
+		self.__version = None
+		self.__connection = sqlite3.connect(filepath, isolation_level=None, check_same_thread=False)
+		self.__connection.execute("PRAGMA journal_mode=WAL")
+		self.__connection.execute("PRAGMA synchronous=NORMAL")
+		self.__connection.executescript(SQLITE_SCHEMA)
+
+	def paths(self):
+		"""
+		:return: files holding the wallet
+		"""
+		return [self.filepath, self.filepath + "-wal", self.filepath + "-shm"]
+
+	def create(self, header, accounts):
+		with self.transaction():
+			self.__connection.execute("DELETE FROM header")
+			self.__connection.execute("DELETE FROM accounts")
+			self.update_header(header)
+			self.add_accounts(accounts)
+
+	def load(self):
+		"""
+		:return: (header, [Account]) ordered as they were added
+		"""
+		with self.__lock:
+			self.__version = self.__data_version()
+			header = {key: json.loads(value) for key, value in self.__connection.execute("SELECT key, value FROM header")}
+			rows = self.__connection.execute(f"SELECT {', '.join(ACCOUNT_FIELDS)} FROM accounts ORDER BY position")
+			return header, [Account(*row) for row in rows]
+
+	def changed(self):
+		"""
+		:return: True if another connection committed since the last `load`
+		"""
+		with self.__lock:
+			return self.__data_version() != self.__version
+
+	def get_account(self, address):
+		"""
+		:return: the account of an address or None
+		"""
+		with self.__lock:
+			row = self.__connection.execute(f"SELECT {', '.join(ACCOUNT_FIELDS)} FROM accounts WHERE address = ?", (address,)).fetchone()
+			return Account(*row) if row is not None else None
+
+	def accounts_with_status(self, status):
+		"""
+		:return: accounts with the given status, ordered as they were added
+		"""
+		with self.__lock:
+			rows = self.__connection.execute(f"SELECT {', '.join(ACCOUNT_FIELDS)} FROM accounts WHERE status = ? ORDER BY position", (status,))
+			return [Account(*row) for row in rows]
+
+	def add_accounts(self, accounts):
+		with self.transaction():
+			self.__connection.executemany(
+				"INSERT INTO accounts (address, pubkey_hex, secret_name, status) VALUES (?, ?, ?, ?)",
+				[tuple(acct[field] for field in ACCOUNT_FIELDS) for acct in accounts])
+
+	def remove_accounts(self, addresses):
+		with self.transaction():
+			self.__connection.executemany("DELETE FROM accounts WHERE address = ?", [(address,) for address in addresses])
+
+	def update_statuses(self, statuses):
+		"""
+		:param statuses: {address: status}
+		"""
+		with self.transaction():
+			self.__connection.executemany("UPDATE accounts SET status = ? WHERE address = ?", [(status, address) for address, status in statuses.items()])
+
+	def update_header(self, header):
+		"""
+		:param header: header keys to set
+		"""
+		with self.transaction():
+			self.__connection.executemany("INSERT OR REPLACE INTO header (key, value) VALUES (?, ?)", [(key, json.dumps(value)) for key, value in header.items()])
+
+	@contextmanager
+	def transaction(self):
+		"""
+		group changes in a single atomic commit, rolled back if the block raises
+		"""
+		with self.__lock:
+			if self.__depth == 0:
+				self.__connection.execute("BEGIN IMMEDIATE")
+			self.__depth += 1
+			try:
+				yield self
+			except BaseException:
+				self.__depth -= 1
+				if self.__depth == 0:
+					self.__connection.execute("ROLLBACK")
+				raise
+			self.__depth -= 1
+			if self.__depth == 0:
+				self.__connection.execute("COMMIT")
+
+	def close(self):
+		with self.__lock:
+			self.__connection.close()
+
+	def __data_version(self):
+		return self.__connection.execute("PRAGMA data_version").fetchone()[0]
@@ -0,0 +1,578 @@
+import os, json, time, base64, socket, hashlib, threading, socketserver
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from .chain import ChainBackend
+
+
+class FakeChainServer(object):
+	"""
+	FakeChainServer is a local stand-in for the blockcypher and chain.so apis used by the wallet.
+	It serves synthetic address data from memory with a tunable latency, so ChainClient and
+	Wallet can be exercised without network access
+	"""
+	def __init__(self, latency=0.0, host="127.0.0.1", port=0):
+		"""
+		:param latency: seconds to wait before answering each request
+		:param host: interface to listen on
+		:param port: port to listen on, a free one if 0
+		"""
+		self.latency = latency
+		self.height = 1000
+		self.txrefs = {}
+		self.transactions = {}
+		self.pushed = []
+		self.push_failures = 0
+		# address queries including a failing address are answered with an HTTP 400 error, dropped
+		# addresses are left out of the answer
+		self.failing_addresses = set()
+		self.dropped_addresses = set()
+		self.requests = 0
+		self.connections = 0
+		self.__lock = threading.Lock()
+		self.__server = ThreadingHTTPServer((host, port), _handler(self))
+		self.__server.daemon_threads = True
+		self.__thread = None
+
+	@property
+	def url(self):
+		host, port = self.__server.server_address[:2]
+		return f"http://{host}:{port}"
+
+	@property
+	def blockcypher_url(self):
+		return f"{self.url}/v1/btc"
+
+	@property
+	def chainso_url(self):
+		return f"{self.url}/api/v2"
+
+	def add_utxo(self, address, value, txid=None, index=0, confirmations=6, spent=False):
+		"""
+		register a transaction output paying to an address
+		:param address: receiving address
+		:param value: output value in satoshis
+		:param txid: transaction id, a deterministic fake one if None
+		:param index: output index in the transaction
+		:param confirmations: number of confirmations reported for the output
+		:param spent: flag to report the output as already spent
+		:return: txid of the output
+		"""
+		with self.__lock:
+			refs = self.txrefs.setdefault(address, [])
+			if txid is None:
+				txid = hashlib.sha256(f"{address}:{len(refs)}".encode()).hexdigest()
+			refs.append({
+				"tx_hash": txid,
+				"tx_output_n": index,
+				"tx_input_n": -1,
+				"value": value,
+				"spent": spent,
+				"confirmations": confirmations,
+				"block_height": self.height - confirmations + 1 if confirmations > 0 else -1,
+			})
+		return txid
+
+	def mine(self, blocks=1):
+		"""
+		add blocks to the chain, the first one confirms the pushed transactions
+		:param blocks: number of blocks
+		:return: None
+		"""
+		with self.__lock:
+			for txid, height in self.transactions.items():
+				if height is None:
+					self.transactions[txid] = self.height + 1
+			for refs in self.txrefs.values():
+				for r in refs:
+					if r["block_height"] < 0 and self.transactions.get(r["tx_hash"]) is not None:
+						r["block_height"] = self.transactions[r["tx_hash"]]
+			self.height += blocks
+
+	def start(self):
+		self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+		self.__thread.start()
+		return self
+
+	def stop(self):
+		self.__server.shutdown()
+		self.__server.server_close()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.stop()
+
+	def _count(self, name):
+		with self.__lock:
+			setattr(self, name, getattr(self, name) + 1)
+
+	def _address(self, address, unspent_only):
+		with self.__lock:
+			refs = [dict(r, confirmations=self.height - r["block_height"] + 1 if r["block_height"] >= 0 else 0) for r in self.txrefs.get(address, [])]
+		unspent = [r for r in refs if not r["spent"] and r["tx_input_n"] < 0]
+		if unspent_only:
+			refs = unspent
+		balance = sum(r["value"] for r in unspent)
+		return {
+			"address": address,
+			"balance": balance,
+			"final_balance": balance,
+			"n_tx": len(refs),
+			"final_n_tx": len(refs),
+			"txrefs": refs,
+		}
+
+	def _transaction(self, txid):
+		with self.__lock:
+			if txid not in self.transactions:
+				return None
+			height = self.transactions[txid]
+			return {
+				"hash": txid,
+				"block_height": height if height is not None else -1,
+				"confirmations": self.height - height + 1 if height is not None else 0,
+			}
+
+	def _push(self, network, tx_hex):
+		try:
+			txid = hashlib.sha256(hashlib.sha256(bytes.fromhex(tx_hex)).digest()).digest()[::-1].hex()
+		except ValueError:
+			txid = hashlib.sha256(tx_hex.encode()).hexdigest()
+		with self.__lock:
+			# `push_failures` pushes are rejected, as chain.so does with an error status
+			if self.push_failures > 0:
+				self.push_failures -= 1
+				return {"status": "fail", "data": {"network": network, "tx_hex": "Transaction rejected"}}
+			self.pushed.append(tx_hex)
+			self.transactions.setdefault(txid, None)
+			self.__apply(network, txid, tx_hex)
+		return {"status": "success", "data": {"network": network, "txid": txid}}
+
+	def __apply(self, network, txid, tx_hex):
+		"""
+		record the unconfirmed refs of a pushed transaction: the outputs it spends and the ones it creates
+		"""
+		from bitcoin import SelectParams
+		from bitcoin.core import CTransaction, b2lx, x
+		from bitcoin.wallet import CBitcoinAddress, CBitcoinAddressError
+		try:
+			tx = CTransaction.deserialize(x(tx_hex))
+		except Exception:
+			return
+		SelectParams('testnet' if network == "BTCTEST" else 'mainnet')
+		for n, txin in enumerate(tx.vin):
+			for address, refs in self.txrefs.items():
+				spent = [r for r in refs if r["tx_hash"] == b2lx(txin.prevout.hash) and r["tx_output_n"] == txin.prevout.n]
+				for r in spent:
+					r["spent"] = True
+					refs.append({"tx_hash": txid, "tx_output_n": -1, "tx_input_n": n, "value": r["value"], "spent": False, "block_height": -1})
+		for n, txout in enumerate(tx.vout):
+			try:
+				address = str(CBitcoinAddress.from_scriptPubKey(txout.scriptPubKey))
+			except CBitcoinAddressError:
+				continue
+			self.txrefs.setdefault(address, []).append({"tx_hash": txid, "tx_output_n": n, "tx_input_n": -1, "value": txout.nValue, "spent": False, "block_height": -1})
+
+
+class FakeBunkrServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	"""
+	FakeBunkrServer is a local stand-in for the Bunkr daemon. It answers the JSON-RPC commands of
+	punkr used by the wallet and the ssh agent on a unix socket, keeping the secrets in memory and
+	signing with the private keys written to them (secp256k1) or generated for ssh keys (P-256),
+	with a tunable latency
+	"""
+	daemon_threads = True
+
+	def __init__(self, address, latency=0.0):
+		"""
+		:param address: path of the unix socket
+		:param latency: seconds to wait before answering each command
+		"""
+		if os.path.exists(address):
+			os.remove(address)
+		self.address = address
+		self.latency = latency
+		self.secrets = {}
+		self.groups = {}
+		self.calls = {}
+		self.connections = 0
+		# the next `hang_ups` commands are run, then their connection is closed before the answer
+		self.hang_ups = 0
+		self.__open = set()
+		self.__lock = threading.Lock()
+		self.__thread = None
+		super().__init__(address, _BunkrHandler)
+
+	def drop_connections(self):
+		"""
+		close the client connections, as the daemon does with idle ones
+		:return: None
+		"""
+		with self.__lock:
+			connections, self.__open = self.__open, set()
+		for connection in connections:
+			try:
+				connection.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+
+	def _hang_up(self):
+		with self.__lock:
+			if self.hang_ups <= 0:
+				return False
+			self.hang_ups -= 1
+			return True
+
+	def _track(self, connection, opened):
+		with self.__lock:
+			if opened:
+				self.connections += 1
+				self.__open.add(connection)
+			else:
+				self.__open.discard(connection)
+
+	def start(self):
+		self.__thread = threading.Thread(target=self.serve_forever, daemon=True)
+		self.__thread.start()
+		return self
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+	def server_close(self):
+		super().server_close()
+		if os.path.exists(self.address):
+			os.remove(self.address)
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.stop()
+
+	def handle_command(self, command, args):
+		"""
+		:param command: punkr Command value
+		:param args: command arguments
+		:return: command result
+		:raise: ValueError with the Bunkr operation error
+		"""
+		with self.__lock:
+			self.calls[command] = self.calls.get(command, 0) + 1
+		if self.latency:
+			time.sleep(self.latency)
+		if command == "new-group":
+			with self.__lock:
+				self.groups.setdefault(args[0], set())
+			return {"msg": f"Group {args[0]} created"}
+		if command == "create":
+			with self.__lock:
+				if args[0] in self.secrets:
+					raise ValueError(f"Secret {args[0]} already exists")
+				self.secrets[args[0]] = {"type": args[1], "content": None}
+			return {"msg": f"Secret {args[0]} created"}
+		if command == "new-ssh-key":
+			from ecdsa import SigningKey, NIST256p
+			with self.__lock:
+				if args[0] in self.secrets:
+					raise ValueError(f"Secret {args[0]} already exists")
+				self.secrets[args[0]] = {"type": "ECDSA-P256", "content": SigningKey.generate(curve=NIST256p).to_string()}
+			return {"msg": f"Secret {args[0]} created"}
+		if command == "ssh-public-data":
+			from ecdsa import SigningKey, NIST256p
+			with self.__lock:
+				secret = self.__secret(args[0])
+			if secret["type"] != "ECDSA-P256":
+				raise ValueError(f"Secret {args[0]} is not an ssh key")
+			point = SigningKey.from_string(secret["content"], curve=NIST256p).get_verifying_key().to_string()
+			blob = b"".join(_ssh_string(field) for field in (b"ecdsa-sha2-nistp256", b"nistp256", b"\x04" + point))
+			public_key = f"ecdsa-sha2-nistp256 {str(base64.b64encode(blob), 'utf-8')} {args[0]}"
+			return {"msg": "", "public_data": {"public_key": str(base64.b64encode(public_key.encode()), 'utf-8')}}
+		if command == "write":
+			name, content_type, content = args
+			with self.__lock:
+				self.__secret(name)["content"] = base64.b64decode(content) if content_type == "b64" else content.encode()
+			return {"msg": f"Secret {name} written"}
+		if command == "grant":
+			with self.__lock:
+				self.__secret(args[1])
+				self.groups.setdefault(args[0], set()).add(args[1])
+			return {"msg": f"Secret {args[1]} granted to {args[0]}"}
+		if command == "delete":
+			with self.__lock:
+				if args[0] in self.groups and args[0] not in self.secrets:
+					del self.groups[args[0]]
+					return {"msg": f"Group {args[0]} deleted"}
+				self.__secret(args[0])
+				del self.secrets[args[0]]
+				for secrets in self.groups.values():
+					secrets.discard(args[0])
+			return {"msg": f"Secret {args[0]} deleted"}
+		if command == "access":
+			with self.__lock:
+				content = self.__secret(args[0])["content"] or b""
+			mode = args[1] if len(args) > 1 else "text"
+			return {"msg": "", "mode": mode, "content": str(base64.b64encode(content), 'utf-8') if mode == "b64" else content.decode()}
+		if command == "list-secrets":
+			with self.__lock:
+				return {"msg": "", "content": {"secrets": sorted(self.secrets), "devices": {}, "groups": {g: sorted(s) for g, s in self.groups.items()}}}
+		if command == "sign-ecdsa":
+			with self.__lock:
+				secret = self.__secret(args[0])
+			key, digest = secret["content"], base64.b64decode(args[1])
+			if not key:
+				raise ValueError(f"Secret {args[0]} has no key content")
+			if secret["type"] == "ECDSA-P256":
+				from ecdsa import SigningKey, NIST256p
+				r, s = SigningKey.from_string(key, curve=NIST256p).sign_digest(digest, sigencode=lambda r, s, order: (r, s))
+			else:
+				from .btc import EC_sign
+				r, s = EC_sign(int.from_bytes(digest, 'big'), int.from_bytes(key, 'big'))
+			return {"msg": "", "r": str(base64.b64encode(str(r).encode()), 'utf-8'), "s": str(base64.b64encode(str(s).encode()), 'utf-8')}
+		if command == "noop-test":
+			return {"msg": "noop"}
+		raise ValueError(f"Unsupported command {command}")
+
+	def __secret(self, name):
+		if name not in self.secrets:
+			raise ValueError(f"Secret {name} does not exist")
+		return self.secrets[name]
+
+
+class FakeSigner(object):
+	"""
+	FakeSigner stands in for the Punkr client of a Wallet when only the flow of a send matters: every
+	signing command answers, after a delay, with the same well formed (and invalid) signature
+	"""
+	def __init__(self, delay=0.0):
+		"""
+		:param delay: seconds each batch of signing commands takes
+		"""
+		self.delay = delay
+
+	async def async_ordered_batch_commands(self, *commands, max_concurrency=None, return_exceptions=False):
+		import asyncio
+		await asyncio.sleep(self.delay)
+		value = str(base64.b64encode(str(2**254 + 12345).encode()), "utf-8")
+		return [{"r": value, "s": value} for _ in commands]
+
+
+class FakePunkr(object):
+	"""
+	FakePunkr stands in for the Punkr client of a Wallet that provisions or deletes keys, keeping the
+	secrets in memory
+	"""
+	def __init__(self):
+		self.secrets = {}
+
+	def create(self, name, secret_type):
+		self.secrets[name] = None
+
+	def write(self, name, content):
+		self.secrets[name] = content
+
+	def grant(self, group, name):
+		pass
+
+	def delete(self, name):
+		self.secrets.pop(name, None)
+
+
+class CountingBackend(ChainBackend):
+	"""
+	CountingBackend answers every address as unused, counting the lookups it gets
+	"""
+	def __init__(self):
+		self.calls = 0
+
+	def get_unspent_many(self, addresses, testnet, priority=None):
+		self.calls += 1
+		return {address: [] for address in addresses}
+
+	def get_spent_many(self, addresses, testnet, priority=None):
+		self.calls += 1
+		return {address: [] for address in addresses}
+
+
+def keypair(testnet=True):
+	"""
+	:param testnet: flag for a testnet address
+	:return: (public key hex, address, pay to public key hash output script) of a new key
+	"""
+	from .btc import gen_EC_keypair, convert_public_to_address
+	_, pub = gen_EC_keypair()
+	address = convert_public_to_address(pub, testnet)
+	return pub, address, address_script(address)
+
+def address_script(address):
+	"""
+	:param address: bitcoin address
+	:return: CScript of the outputs paying to the address
+	"""
+	from bitcoin.core.script import CScript
+	from .indexer import _address_script
+	return CScript(bytes.fromhex(_address_script(address)))
+
+def transaction(inputs, outputs, coinbase_tag=None):
+	"""
+	:param inputs: [(txid, index)] spent outputs, ignored for a coinbase
+	:param outputs: [(value, script)]
+	:param coinbase_tag: coinbase script tag, making the transaction a coinbase one, unique per tag
+	:return: CMutableTransaction
+	"""
+	from bitcoin.core import CMutableTransaction, CMutableTxIn, CMutableTxOut, COutPoint, lx
+	from bitcoin.core.script import CScript
+	if coinbase_tag is not None:
+		vin = [CMutableTxIn(COutPoint(), CScript([coinbase_tag]))]
+	else:
+		vin = [CMutableTxIn(COutPoint(lx(txid), n)) for txid, n in inputs]
+	return CMutableTransaction(vin, [CMutableTxOut(value, script) for value, script in outputs])
+
+def new_accounts(n, status="fresh"):
+	"""
+	:param n: number of accounts
+	:param status: status of the accounts
+	:return: wallet accounts of n new testnet keys, named after their address
+	"""
+	accounts = []
+	for _ in range(n):
+		pub, address, _ = keypair()
+		accounts.append({"address": address, "pubkey_hex": pub, "secret_name": address, "status": status})
+	return accounts
+
+def wallet_file(path, accounts, network="BTCTEST", updated=None):
+	"""
+	create a wallet file, in the storage engine matching its extension
+	:param path: path of the wallet file
+	:param accounts: wallet accounts
+	:param network: "BTC" or "BTCTEST"
+	:param updated: time of the last refresh of the accounts, now if None
+	:return: path of the wallet file
+	"""
+	from .storage import open_store
+	path = str(path)
+	updated = updated if updated is not None else time.time()
+	open_store(path).create({"NETWORK": network, "LAST_UPDATE_TIME": str(round(updated))}, accounts)
+	return path
+
+def indexed_wallet(directory, n_accounts, values=(), funded=None):
+	"""
+	testnet wallet of new accounts on a BlockIndexer, funded by the coinbase of a first block
+	:param directory: directory of the wallet and index files
+	:param n_accounts: number of fresh accounts
+	:param values: satoshis of the outputs of the coinbase, paid to the accounts in turn
+	:param funded: number of first accounts receiving the outputs, all of them if None
+	:return: (wallet file path, BlockIndexer, accounts)
+	"""
+	from bitcoin.core import CBlock
+	from .indexer import BlockIndexer
+	accounts = new_accounts(n_accounts)
+	path = wallet_file(os.path.join(str(directory), "w.db"), accounts)
+	indexer = BlockIndexer(os.path.join(str(directory), "index.json"), True, [acct["address"] for acct in accounts])
+	if values:
+		funded = funded if funded is not None else n_accounts
+		outputs = [(value, address_script(accounts[i % funded]["address"])) for i, value in enumerate(values)]
+		indexer.ingest_block(CBlock(vtx=[transaction([], outputs, coinbase_tag=b"\x01")]).serialize().hex())
+	return path, indexer, accounts
+
+
+class _BunkrHandler(socketserver.BaseRequestHandler):
+	"""
+	punkr writes a json request, without a delimiter, and reads the response from the same connection
+	"""
+	def setup(self):
+		self.server._track(self.request, True)
+
+	def finish(self):
+		self.server._track(self.request, False)
+
+	def handle(self):
+		decoder = json.JSONDecoder()
+		buffer = ""
+		while True:
+			data = self.request.recv(4096)
+			if not data:
+				return
+			buffer += data.decode()
+			while buffer.strip():
+				try:
+					request, end = decoder.raw_decode(buffer.lstrip())
+				except ValueError:
+					break
+				buffer = buffer.lstrip()[end:]
+				response = self.__response(request)
+				if self.server._hang_up():
+					return
+				self.request.sendall(json.dumps(response).encode())
+
+	def __response(self, request):
+		params = request.get("params") or [{}]
+		try:
+			result = {"Result": self.server.handle_command(params[0].get("Command"), list(params[0].get("Args") or [])), "Error": ""}
+		except Exception as e:
+			result = {"Result": None, "Error": str(e)}
+		return {"id": request.get("id"), "result": result, "error": None}
+
+
+def _ssh_string(data):
+	return len(data).to_bytes(4, "big") + data
+
+
+def _handler(chain):
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = "HTTP/1.1"
+
+		def setup(self):
+			super().setup()
+			chain._count("connections")
+
+		def log_message(self, format, *args):
+			pass
+
+		def do_GET(self):
+			chain._count("requests")
+			url = urlsplit(self.path)
+			parts = url.path.strip("/").split("/")
+			# /v1/btc/<network>/addrs/<address>[;<address>...]
+			if len(parts) == 5 and parts[:2] == ["v1", "btc"] and parts[3] == "addrs":
+				query = parse_qs(url.query)
+				unspent_only = query.get("unspentOnly", ["false"])[0] == "true"
+				addresses = unquote(parts[4]).split(";")
+				if chain.failing_addresses.intersection(addresses):
+					return self.__reply(400, {"error": "Invalid address."})
+				payload = [chain._address(address, unspent_only) for address in addresses if address not in chain.dropped_addresses]
+				return self.__reply(200, payload[0] if len(payload) == 1 else payload)
+			# /v1/btc/<network>
+			if len(parts) == 3 and parts[:2] == ["v1", "btc"]:
+				return self.__reply(200, {"name": f"BTC.{parts[2]}", "height": chain.height})
+			# /v1/btc/<network>/txs/<txid>
+			if len(parts) == 5 and parts[:2] == ["v1", "btc"] and parts[3] == "txs":
+				transaction = chain._transaction(parts[4])
+				if transaction is None:
+					return self.__reply(404, {"error": f"Transaction {parts[4]} not found."})
+				return self.__reply(200, transaction)
+			self.__reply(404, {"error": f"unknown path {url.path}"})
+
+		def do_POST(self):
+			chain._count("requests")
+			length = int(self.headers.get("Content-Length", 0))
+			body = parse_qs(self.rfile.read(length).decode())
+			parts = urlsplit(self.path).path.strip("/").split("/")
+			# /api/v2/send_tx/<network>
+			if len(parts) == 4 and parts[:3] == ["api", "v2", "send_tx"]:
+				return self.__reply(200, chain._push(parts[3], body.get("tx_hex", [""])[0]))
+			self.__reply(404, {"error": f"unknown path {self.path}"})
+
+		def __reply(self, status, payload):
+			if chain.latency:
+				time.sleep(chain.latency)
+			data = json.dumps(payload).encode()
+			self.send_response(status)
+			self.send_header("Content-Type", "application/json")
+			self.send_header("Content-Length", str(len(data)))
+			self.end_headers()
+			self.wfile.write(data)
+	return Handler
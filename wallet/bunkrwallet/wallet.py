@@ -1,33 +1,43 @@
-import os, json, time
-from .btc import *
+import os, json, time, base64
+from collections import deque
+from .cache import ChainCache
+from .chain import default_backend
+from .coinselect import select_coins, DEFAULT_COST_OF_CHANGE
+from .pool import AddressPool
+from .profiling import SendProfile
+from .refresh import AccountRefresher
+from .locking import FileLock, ReservationBook, DEFAULT_RESERVATION_LEASE
+from .accounts import Account
+from .storage import open_store, import_json, export_json, SQLITE_EXTENSION, JSON_EXTENSION
+from .scheduler import PRIORITY_SEND, PRIORITY_DEFAULT
 from math import ceil
 from random import shuffle
 
-from punkr import *
+# btc (ecdsa, python-bitcoinlib), punkr and asyncio are only imported by the methods signing,
+# generating keys or talking to Bunkr, so listing and loading wallets stays fast
+
+DEFAULT_SIGNING_PARALLELISM = 16
+FRESH_LOOKUP_BATCH = 20
+STALE_AFTER = 86400
 
 class BunkrWallet(object):
 	"""
 	BunkrWallet is the class which creates and manages all Wallets in the provided wallet directory.
-	A Wallet in BunkrWallet is a lite bitcoin wallet working on top of Bunkr secrets
+	A Wallet in BunkrWallet is a lite bitcoin wallet working on top of Bunkr secrets.
+	Wallets are only loaded on their first `get_wallet`, listing them just reads the directory
 	"""
-	def __init__(self, directory_name=".BunkrWallet", bunkr_address="/tmp/bunkr_daemon.sock", bunkr_path=os.path.expanduser("~/.bunkr/")):
+	def __init__(self, directory_name=".BunkrWallet", bunkr_address="/tmp/bunkr_daemon.sock", bunkr_path=os.path.expanduser("~/.bunkr/"), backend=None):
 		"""
-		:param directory: path to the directory where wallet json files are stored
+		:param directory: path to the directory where wallet files are stored
 		:param bunkr_address: (ip, port) tuple containing Bunkr RPC address information
+		:param backend: ChainBackend used by the wallets, the shared `chain.default_backend()` if None
 		"""
 		self.wallets = {}
 		self.directory = os.path.join(bunkr_path, directory_name)
 		if not os.path.exists(self.directory):
 			os.mkdir(self.directory)
 		self.bunkr_address = bunkr_address
-		for file in os.listdir(self.directory):
-			if file.endswith(".json"):
-				try:
-					name = file[:-5]
-					w = Wallet(name, os.path.join(self.directory, file), bunkr_address, True)
-					self.wallets[name] = w
-				except:
-					pass
+		self.backend = backend
 
 	def create_wallet(self, name, testnet=False):
 		"""
@@ -36,118 +46,310 @@ class BunkrWallet(object):
 		:param testnet: boolean flag for mainnet vs testnet wallet
 		:return: Wallet object
 		"""
-		if name in list(self.wallets.keys()):
+		if name in self.list_wallets():
 			raise ValueError(f"A wallet with the name '{name}' already exists")
-		w = Wallet(name, os.path.join(self.directory, name+".json"), self.bunkr_address, testnet)
+		w = Wallet(name, os.path.join(self.directory, name+SQLITE_EXTENSION), self.bunkr_address, testnet, self.backend)
+		self.wallets[name] = w
+		return w
+
+	def import_wallet(self, name, json_filepath):
+		"""
+		Import a wallet from a json wallet file `[header, *accounts]` into BunkrWallet storage
+		:param name: wallet name
+		:param json_filepath: path to the json wallet file
+		:return: Wallet object
+		"""
+		if name in self.list_wallets():
+			raise ValueError(f"A wallet with the name '{name}' already exists")
+		filepath = os.path.join(self.directory, name+SQLITE_EXTENSION)
+		store = open_store(filepath)
+		try:
+			import_json(store, json_filepath)
+		finally:
+			store.close()
+		w = Wallet(name, filepath, self.bunkr_address, True, self.backend)
 		self.wallets[name] = w
 		return w
 
 	def list_wallets(self):
 		"""
-		list wallet names in BunkrWallet
+		list wallet names in BunkrWallet, from the wallet files in the directory without loading them
 		:return: list of wallet names
 		"""
-		return list(self.wallets.keys())
+		return list(self.__wallet_files())
 
 	def get_wallet(self, name):
 		"""
-		get a wallet indexed by its name
+		get a wallet indexed by its name, loading it on first use.
+		Account statuses are not refreshed on load, see `Wallet.refresh`
 		:param name: name to be queried
 		:return: Wallet object
+		:raise: KeyError if there is no such wallet
 		"""
+		if name not in self.wallets:
+			filepath = self.__wallet_files()[name]
+			self.wallets[name] = Wallet(name, filepath, self.bunkr_address, True, self.backend)
 		return self.wallets[name]
 
+	def portfolio(self, names=None, priority=PRIORITY_DEFAULT):
+		"""
+		balances of many wallets at once. The addresses of all the wallets are deduplicated and
+		looked up together, one batched and concurrent query per network for the ones missing
+		from the wallet caches
+		:param names: wallet names, all the wallets if None
+		:param priority: scheduling priority of the chain API requests
+		:return: {
+			"wallets": [{"name", "network", "balance", "addresses": [{"address", "balance", "utxos"}]}],
+			"totals" : {network: satoshis held by the distinct addresses},
+		}
+		:raise: KeyError if there is no such wallet
+		"""
+		return self.portfolio_of([self.get_wallet(name) for name in (self.list_wallets() if names is None else names)], priority)
+
+	def portfolio_of(self, wallets, priority=PRIORITY_DEFAULT):
+		"""
+		balances of loaded wallets at once, see `portfolio`
+		:param wallets: Wallet objects, e.g. resolved with `get_wallet`
+		:param priority: scheduling priority of the chain API requests
+		:return: same format as `portfolio`
+		"""
+		unspent, held = {}, {}
+		for w in wallets:
+			addresses = w.addresses()
+			network = w.header["NETWORK"]
+			unspent.setdefault(network, {}).update(w.cache.cached_unspent_many(addresses))
+			held.setdefault(network, set()).update(addresses)
+		backend = self.backend if self.backend is not None else default_backend()
+		fetched = {}
+		for w in wallets:
+			network = w.header["NETWORK"]
+			if network not in fetched:
+				lookup = sorted(held[network] - unspent[network].keys())
+				fetched[network] = backend.get_unspent_many(lookup, w.testnet, priority) if lookup else {}
+				unspent[network].update(fetched[network])
+			w.cache.put_unspent_many({address: fetched[network][address] for address in w.addresses() if address in fetched[network]})
+			w.cache.save()
+		report = {"wallets": [], "totals": {}}
+		for w in wallets:
+			network = w.header["NETWORK"]
+			addresses = [{"address": address, "balance": sum(u["value"] for u in unspent[network][address]), "utxos": len(unspent[network][address])}
+				for address in w.addresses()]
+			report["wallets"].append({"name": w.name, "network": network, "balance": sum(a["balance"] for a in addresses), "addresses": addresses})
+		# addresses held by several wallets are only counted once in the totals
+		for network, addresses in held.items():
+			report["totals"][network] = sum(u["value"] for address in addresses for u in unspent[network][address])
+		return report
+
 	def delete_wallet(self, wallet):
 		"""
 		completely delete wallet and all associated accounts, indexed by its name
-		:param name: name to be queried
+		:param wallet: Wallet object to be deleted
+		:raise: PunkrException if Bunkr fails to delete an account secret, the wallet files are kept
 		"""
 		for acct in wallet.wallet:
 			wallet.delete(acct)
-		wallet.delete(wallet.name)
-		os.remove(wallet.filepath)
-		self.wallets.pop(wallet.name)
+		delete_wallet_group(wallet.punkr, wallet.name)
+		wallet.store.close()
+		wallet.refresher.stop()
+		wallet.pool.stop()
+		for path in (*wallet.store.paths(), wallet.cache.filepath, wallet.reservations.filepath, wallet.refresher.filepath, wallet.pool.filepath, wallet.lock.path):
+			if os.path.exists(path):
+				os.remove(path)
+		self.wallets.pop(wallet.name, None)
+
+	def __wallet_files(self):
+		"""
+		:return: {wallet name: wallet filepath}, SQLite wallets first if a name has both formats
+		"""
+		files = {}
+		for file in sorted(os.listdir(self.directory)):
+			name, extension = os.path.splitext(file)
+			if extension == SQLITE_EXTENSION or (extension == JSON_EXTENSION and name not in files):
+				files[name] = os.path.join(self.directory, file)
+		return files
 
 
 class Wallet(object):
 	"""
 	Wallet is a lite bitcoin wallet working on top of Bunkr secrets
 	"""
-	def __init__(self, wallet_name, wallet_filepath, bunkr_address, testnet):
+	def __init__(self, wallet_name, wallet_filepath, bunkr_address, testnet, backend=None):
 		"""
 		:param wallet_name: wallet name
-		:param wallet_filepath: path to wallet json file
+		:param wallet_filepath: path to the wallet file, SQLite or legacy json if it ends with ".json"
 		:param bunkr_address: (ip, port) tuple containing Bunkr RPC address information
 		:param testnet: boolean flag for mainnet vs testnet wallet
+		:param backend: ChainBackend to query and publish through, the shared `chain.default_backend()` if None
 		"""
-		self.punkr = Punkr(bunkr_address)
+		self.bunkr_address = bunkr_address
+		self.__punkr = None
 		if not os.path.exists(wallet_filepath):
 			print("Creating new wallet...")
 			new_wallet(self.punkr, wallet_name, wallet_filepath, testnet)
-		with open(wallet_filepath, 'r') as f:
-			wallet_file = json.load(f)
 		self.name = wallet_name
 		self.filepath = wallet_filepath
-		self.header = wallet_file[0]
-		self.wallet = wallet_file[1:]
+		self.lock = FileLock(os.path.splitext(wallet_filepath)[0]+".lock")
+		self.reservations = ReservationBook(os.path.splitext(wallet_filepath)[0]+".reservations", self.lock)
+		self.reservation_lease = DEFAULT_RESERVATION_LEASE
+		self.store = open_store(wallet_filepath)
+		with self.lock:
+			self.__load()
 		self.testnet = self.header["NETWORK"] != "BTC"
-		if time.time()>int(self.header["LAST_UPDATE_TIME"])+86400:
-			self.__update_accounts()
+		self.cache = ChainCache(os.path.splitext(wallet_filepath)[0]+".cache", self.testnet, backend=backend)
+		# local backends like the BlockIndexer only index the outputs of the addresses they watch
+		(self.cache.backend if self.cache.backend is not None else default_backend()).watch(self.addresses())
+		self.refresher = AccountRefresher(self, os.path.splitext(wallet_filepath)[0]+".refresh")
+		self.pool = AddressPool(self, os.path.splitext(wallet_filepath)[0]+".pool")
+
+	@property
+	def punkr(self):
+		"""
+		Punkr client of the wallet, connected on first use
+		"""
+		if self.__punkr is None:
+			from punkr import Punkr
+			self.__punkr = Punkr(self.bunkr_address)
+		return self.__punkr
+
+	@punkr.setter
+	def punkr(self, punkr):
+		self.__punkr = punkr
 
-	def send(self, outputs, fee):
+	@property
+	def wallet(self):
+		"""
+		accounts of the wallet, in the order they were added
+		"""
+		return list(self.__accounts.values())
+
+	def addresses(self):
+		"""
+		:return: addresses of the wallet, in the order they were added
+		"""
+		return list(self.__accounts)
+
+	def send(self, outputs, fee, parallelism=DEFAULT_SIGNING_PARALLELISM, inputs=None, profile=None):
 		"""
 		Send bitcoin to bitcoin addresses
 		:param outputs: bitcoin addresses [{"address":address, "value":number_of_satoshis}]
 		:param fee: transactions fee in satoshis
+		:param parallelism: maximum number of concurrent SIGN-ECDSA operations
+		:param inputs: utxos to spend [{"address":address, "txid":txid, "index":n, "value":number_of_satoshis}], selected from the wallet if None
+		:param profile: optional SendProfile recording the phases of the send, see `profile_send`
 		:return: signed transaction hex code
+		:raise: RuntimeError, also when called from a running event loop, where `async_send` must be awaited instead
+		"""
+		import asyncio
+		try:
+			asyncio.get_running_loop()
+		except RuntimeError:
+			return asyncio.run(self.async_send(outputs, fee, parallelism, inputs, profile))
+		raise RuntimeError("Wallet.send can not be called from a running event loop, await Wallet.async_send instead")
+
+	def profile_send(self, outputs, fee, parallelism=DEFAULT_SIGNING_PARALLELISM, inputs=None, cprofile=False):
+		"""
+		Send bitcoin to bitcoin addresses, recording the duration of every phase of the send and
+		counters of the chain requests, Bunkr RPCs, inputs and bytes
+		:param outputs: bitcoin addresses [{"address":address, "value":number_of_satoshis}]
+		:param fee: transactions fee in satoshis
+		:param parallelism: maximum number of concurrent SIGN-ECDSA operations
+		:param inputs: utxos to spend, selected from the wallet if None
+		:param cprofile: flag to also run the send under cProfile, see `SendProfile.dump`
+		:return: (signed transaction hex code, SendProfile)
 		:raise: RuntimeError
 		"""
-		total = sum(i['value'] for i in outputs) + fee
-		input_accts = self.__choose_inputs(total)
-		change_acct = self.__fresh_account()
-		tx, address_list = unsigned_transaction([i["address"] for i in input_accts], outputs, fee, change_acct["address"], self.testnet)
-		acct_list = [self.__get_account(address) for address in address_list]
-		pubkey_list = [acct["pubkey_hex"] for acct in acct_list]
-		sec_name_list = [acct["secret_name"] for acct in acct_list]
-		hash_list = [str(base64.b64encode(i), 'utf-8') for i in prepare_signatures(tx, pubkey_list)]
-		commands = [(Command.SIGN_ECDSA, (secret_name, _hash)) for secret_name, _hash in zip(sec_name_list, hash_list)]
-		stdout = self.punkr.batch_commands(*commands)
-		sigs = []
+		profile = SendProfile(cprofile)
+		return self.send(outputs, fee, parallelism, inputs, profile), profile
+
+	async def async_send(self, outputs, fee, parallelism=DEFAULT_SIGNING_PARALLELISM, inputs=None, profile=None):
+		"""
+		Send bitcoin to bitcoin addresses, signing all the transaction inputs concurrently
+		:param outputs: bitcoin addresses [{"address":address, "value":number_of_satoshis}]
+		:param fee: transactions fee in satoshis
+		:param parallelism: maximum number of concurrent SIGN-ECDSA operations
+		:param inputs: utxos to spend [{"address":address, "txid":txid, "index":n, "value":number_of_satoshis}], selected from the wallet if None
+		:param profile: optional SendProfile recording the phases of the send
+		:return: signed transaction hex code
+		:raise: RuntimeError
+		"""
+		import asyncio
+		from .btc import apply_signatures
+		profile = profile if profile is not None else SendProfile()
+		with profile.run():
+			if profile.cprofile:
+				# cProfile only follows the thread it runs in
+				prepared = self.__prepare_transaction(outputs, fee, inputs, profile)
+			else:
+				prepared = await asyncio.get_running_loop().run_in_executor(None, self.__prepare_transaction, outputs, fee, inputs, profile)
+			tx, pubkey_list, sec_name_list, hash_list, token = prepared
+			try:
+				with profile.phase("sign"):
+					sigs = await self.__async_sign(sec_name_list, hash_list, parallelism, profile)
+				with profile.phase("apply_signatures"):
+					transaction = apply_signatures(tx, pubkey_list, sigs)
+			except BaseException:
+				self.reservations.release(token)
+				raise
+			profile.count("bytes", len(transaction) // 2)
+			return transaction
+
+	def push_transaction(self, transaction, backend=None, release_rejected=True):
+		"""
+		Publish a transaction and invalidate the cached state of the wallet addresses it touches.
+		The reservations of a rejected transaction are released
+		:param transaction: hex string transaction code
+		:param backend: ChainBackend to publish through, the one of the wallet cache if None
+		:param release_rejected: release the reservations if the transaction is rejected, a caller
+			retrying it elsewhere releases them once it gives up
+		:return: the backend `push_transaction` json response
+		"""
+		if backend is None:
+			backend = self.cache.backend if self.cache.backend is not None else default_backend()
+		from .btc import transaction_addresses
+		outpoints, addresses = transaction_addresses(transaction, self.testnet)
 		try:
-			for out in stdout:
-				r = int(base64.b64decode(out['r']))
-				s = int(base64.b64decode(out['s']))
-				if s > N//2:
-					s = N - s
-				sigs.append((r, s))
-		except:
-			raise RuntimeError(f"Bunkr Operation SIGN-ECDSA failed with: {stdout}")
-		return apply_signatures(tx, pubkey_list, sigs)
+			response = backend.push_transaction(transaction, self.testnet)
+		except BaseException:
+			if release_rejected:
+				self.reservations.release_outpoints(outpoints)
+			raise
+		if response.get("status") != "success" and release_rejected:
+			self.reservations.release_outpoints(outpoints)
+		addresses.extend(self.cache.find_outpoint(txid, index) for txid, index in outpoints)
+		self.cache.invalidate([address for address in addresses if address is not None])
+		self.cache.save()
+		return response
 
 	def add_addresses(self, n=5):
 		"""
 		adds more addresses to the wallet
 		:param n: number of addresses to be added
-		:return: None
+		:return: list of the new addresses
 		"""
+		from .btc import gen_EC_keypair, convert_public_to_address
+		accounts = []
 		for i in range(n):
 			priv, pub = gen_EC_keypair()
 			address = convert_public_to_address(pub, self.testnet)
 			write_private_key_to_bunkr(self.punkr, priv, address, self.name)
-			self.wallet.append({"address": address, "pubkey_hex":pub, "secret_name":address, "status":"fresh"})
-		output = [self.header, *self.wallet]
-		with open(self.filepath, 'w+') as f:
-			json.dump(output, f)
+			accounts.append({"address": address, "pubkey_hex":pub, "secret_name":address, "status":"fresh"})
+		with self.lock:
+			self.__reload()
+			self.store.add_accounts(accounts)
+			self.__index(accounts)
+		addresses = [acct["address"] for acct in accounts]
+		# local backends like the BlockIndexer only index the outputs of the addresses they watch
+		(self.cache.backend if self.cache.backend is not None else default_backend()).watch(addresses)
+		return addresses
 
 	def show_balance(self):
 		"""
 		prints the wallet balance
 		:return: None
 		"""
-		balance = 0
-		for acct in self.wallet:
-			utxos = get_unspent(acct["address"], self.testnet)
-			balance += sum(i['value'] for i in utxos)
+		unspent = self.cache.get_unspent_many(self.addresses())
+		balance = sum(i['value'] for utxos in unspent.values() for i in utxos)
+		self.cache.save()
 		return f"{self.name} current balance: {str(balance/100000000.0)} BTC"
 
 	def show_address_balances(self):
@@ -156,35 +358,182 @@ class Wallet(object):
 		:return: None
 		"""
 		ret = []
+		unspent = self.cache.get_unspent_many(self.addresses())
 		for acct in self.wallet:
-			utxos = get_unspent(acct["address"], self.testnet)
+			utxos = unspent[acct["address"]]
 			if len(utxos) != 0:
 				balance = sum(i['value'] for i in utxos)
 				ret.append(f"Address {acct['address']} BTC: {str(balance/100000000.0)}")
+		self.cache.save()
 		return ret
 
 	def show_fresh_address(self):
 		"""
-		prints the next unused bitcoin address
-		:return: None
+		returns an unused bitcoin address to receive a deposit, popped from the address pool.
+		If the pool is empty an unused account is looked up on chain, or a new one is created
+		:return: address
+		"""
+		address = self.pool.pop()
+		if address is not None:
+			return address
+		try:
+			with self.lock:
+				self.__reload()
+				address = self.__fresh_account()["address"]
+			self.cache.save()
+		except ValueError:
+			address = self.add_addresses(1)[0]
+		self.pool.issue(address)
+		return address
+
+	def show_fresh_addresses(self, n, partial=False):
+		"""
+		returns distinct unused bitcoin addresses, not queued nor handed out by the address pool and
+		not reserved as the change address of a send in flight
+		:param n: number of addresses
+		:param partial: return less than n addresses instead of raising if the wallet runs out of them
+		:return: list of addresses
+		:raise: ValueError if the wallet has less than n unused addresses
+		"""
+		with self.lock:
+			self.__reload()
+			_, reserved_addresses = self.reservations.reserved()
+			addresses = [acct["address"] for acct in self.__fresh_accounts(n, reserved_addresses, partial)]
+		self.cache.save()
+		return addresses
+
+	def get_account(self, address):
+		"""
+		get the account information from a bitcoin address
+		:param address: address to be queried
+		:return: account
+		:raise: ValueError
 		"""
-		return self.__fresh_account()["address"]
+		with self.lock:
+			self.__reload()
+			return self.__get_account(address)
 
 	def delete(self, account):
 		"""
 		deletes an address from Bunkr
 		:param account: account to be deleted
 		:return: None
+		:raise: PunkrException if Bunkr fails to delete the secret, the account is kept
 		"""
-		try:
-			resp = self.punkr.delete(account["secret_name"])
-		except PunkrException as e:
-			print(f"Bunkr Operation NEW-GROUP failed with: {e}")
-		self.wallet = [i for i in self.wallet if i!=account]
-		output = [self.header, *self.wallet]
-		with open(self.filepath, 'w+') as f:
-			json.dump(output, f)
+		self.punkr.delete(account["secret_name"])
+		with self.lock:
+			self.__reload()
+			self.store.remove_accounts([account["address"]])
+			self.__unindex(account["address"])
+
+	def is_stale(self, max_age=STALE_AFTER):
+		"""
+		:param max_age: seconds after which the account statuses are stale
+		:return: True if the account statuses were last refreshed more than max_age seconds ago
+		"""
+		return time.time() > int(self.header["LAST_UPDATE_TIME"]) + max_age
+
+	def refresh(self, force=False, max_age=STALE_AFTER, budget=None):
+		"""
+		refresh the account statuses from the chain if they are stale, resuming an interrupted refresh.
+		`self.refresher.start()` refreshes them in the background instead, see `refresh.AccountRefresher`
+		:param force: refresh even if they are not stale
+		:param max_age: seconds after which the account statuses are stale
+		:param budget: maximum number of addresses queried per request round
+		:return: True if the statuses were refreshed
+		"""
+		if not force and not self.is_stale(max_age) and not self.refresher.pending():
+			return False
+		self.refresher.run(budget)
+		return True
+
+	def update_statuses(self, statuses, completed=False):
+		"""
+		record account statuses found on chain
+		:param statuses: {address: status}
+		:param completed: a refresh of all the accounts completed, LAST_UPDATE_TIME is set to now
+		:return: None
+		"""
+		with self.lock:
+			self.__reload()
+			statuses = {address: status for address, status in statuses.items()
+				if address in self.__accounts and self.__accounts[address]["status"] != status}
+			update_time = str(round(time.time()))
+			with self.store.transaction():
+				self.store.update_statuses(statuses)
+				if completed:
+					self.store.update_header({"LAST_UPDATE_TIME": update_time})
+			for address, status in statuses.items():
+				self.__set_status(address, status)
+			if completed:
+				self.header["LAST_UPDATE_TIME"] = update_time
+
+	def export_json(self, json_filepath):
+		"""
+		export the wallet in the json wallet format `[header, *accounts]`
+		:param json_filepath: destination path
+		:return: None
+		"""
+		with self.lock:
+			export_json(self.store, json_filepath)
+
+
+	def __reload(self):
+		"""
+		reload the wallet if another Wallet or process changed its storage, must be called holding `self.lock`
+		:return: None
+		"""
+		if self.store.changed():
+			self.__load()
+
+	def __load(self):
+		"""
+		load the wallet from its storage and rebuild the account indexes
+		:return: None
+		"""
+		self.header, accounts = self.store.load()
+		# address -> account, status -> addresses, and fresh addresses in random order
+		self.__accounts = {}
+		self.__by_status = {}
+		self.__fresh = deque()
+		self.__index(accounts)
+		shuffle(self.__fresh)
+
+	def __index(self, accounts):
+		"""
+		add accounts to the indexes
+		:param accounts: accounts to be added
+		:return: None
+		"""
+		for acct in map(Account.from_dict, accounts):
+			self.__accounts[acct["address"]] = acct
+			self.__by_status.setdefault(acct["status"], set()).add(acct["address"])
+			if acct["status"] == "fresh":
+				self.__fresh.append(acct["address"])
+
+	def __unindex(self, address):
+		"""
+		drop an account from the indexes, the fresh queue skips it lazily
+		:param address: address of the account
+		:return: None
+		"""
+		acct = self.__accounts.pop(address, None)
+		if acct is not None:
+			self.__by_status[acct["status"]].discard(address)
 
+	def __set_status(self, address, status):
+		"""
+		change the status of an account and its indexes
+		:param address: address of the account
+		:param status: new status
+		:return: None
+		"""
+		acct = self.__accounts[address]
+		self.__by_status[acct["status"]].discard(address)
+		acct["status"] = status
+		self.__by_status.setdefault(status, set()).add(address)
+		if status == "fresh":
+			self.__fresh.append(address)
 
 	def __get_account(self, address):
 		"""
@@ -193,10 +542,10 @@ class Wallet(object):
 		:return: account
 		:raise: ValueError
 		"""
-		for acct in self.wallet:
-			if acct["address"] == address:
-				return acct
-		raise ValueError("The given address does not exist in the bunkr-wallet")
+		acct = self.__accounts.get(address)
+		if acct is None:
+			raise ValueError("The given address does not exist in the bunkr-wallet")
+		return acct
 
 	def __fresh_account(self):
 		"""
@@ -204,60 +553,157 @@ class Wallet(object):
 		:return: account
 		:raise: ValueError
 		"""
-		shuffle(self.wallet)
-		for acct in self.wallet:
-			if len(get_spent(acct["address"], self.testnet))==0 and len(get_unspent(acct["address"], self.testnet))==0:
-				return acct
-		raise ValueError("No unused addresses available. Run add_accounts()")
+		return self.__fresh_accounts(1)[0]
 
-	def __choose_inputs(self, total):
+	def __fresh_accounts(self, n, excluded=(), partial=False, profile=None):
+		"""
+		Selects n distinct unused bunkr-wallet accounts from the front of the fresh queue, shuffled
+		on load. Selected accounts rotate to the back, accounts found with a history leave the queue.
+		Addresses of the address pool are never selected
+		:param n: number of accounts
+		:param excluded: addresses not to select, e.g. reserved by other sends
+		:param partial: return the accounts found instead of raising when there are less than n
+		:param profile: optional SendProfile counting the chain requests
+		:return: list of accounts
+		:raise: ValueError
 		"""
-		choose which unspent transaction outputs are 
+		excluded = set(excluded) | self.pool.reserved()
+		found, kept = [], []
+		remaining = len(self.__fresh)
+		while len(found) < n and remaining > 0:
+			batch = []
+			while len(batch) < FRESH_LOOKUP_BATCH and remaining > 0:
+				address = self.__fresh.popleft()
+				remaining -= 1
+				if address not in self.__by_status.get("fresh", ()):
+					continue
+				if address in excluded:
+					kept.append(address)
+				else:
+					batch.append(address)
+			spent = self.cache.get_spent_many(batch, PRIORITY_SEND, profile)
+			unspent = self.cache.get_unspent_many(batch, PRIORITY_SEND, profile)
+			for i, address in enumerate(batch):
+				if len(found) == n:
+					# looked up but not needed, they keep their place
+					self.__fresh.extendleft(reversed(batch[i:]))
+					break
+				if len(spent[address])==0 and len(unspent[address])==0:
+					found.append(address)
+		self.__fresh.extendleft(reversed(kept))
+		self.__fresh.extend(found)
+		if len(found) < n and not partial:
+			raise ValueError("No unused addresses available. Run add_accounts()")
+		return [self.__accounts[address] for address in found]
+
+	def __choose_inputs(self, total, excluded=(), profile=None):
+		"""
+		choose which unspent transaction outputs fund the transaction, see `coinselect.select_coins`
 		:param total: number of total satoshis needed for transaction and fees
-		:return: list of accounts all 
-		:raise:
+		:param excluded: "txid:index" outpoints not to select, e.g. reserved by other sends
+		:param profile: optional SendProfile counting the chain requests
+		:return: ([utxos tagged with their "address"], change in satoshis)
+		:raise: ValueError
 		"""
-		out = []
-		gross_input = 0
-		shuffle(self.wallet)
-		for acct in self.wallet:
-			utxos = get_unspent(acct["address"], self.testnet)
-			if len(utxos) != 0:
-				out.append(acct)
-				gross_input += sum(i['value'] for i in utxos)
-			if gross_input >= total:
-				return out
-		raise ValueError(f"Not enough funds in wallet for this transaction: need: {total}, have: {gross_input}.")
+		unspent = self.cache.get_unspent_many(self.addresses(), PRIORITY_SEND, profile)
+		utxos = [dict(u, address=address) for address, address_utxos in unspent.items() for u in address_utxos
+			if f"{u['txid']}:{u['index']}" not in excluded]
+		return select_coins(utxos, total)
 
-	def __update_accounts(self):
+	def __prepare_transaction(self, outputs, fee, inputs=None, profile=None):
 		"""
-		update the status of all addresses in the wallet
-		:return: None
+		build the unsigned transaction and the hashes that each input has to sign. The inputs and the
+		change address are reserved for `reservation_lease` seconds, so concurrent sends of the wallet,
+		in this or other processes, pick other ones
+		:param outputs: bitcoin addresses [{"address":address, "value":number_of_satoshis}]
+		:param fee: transactions fee in satoshis
+		:param inputs: utxos tagged with their "address" to spend, selected with `__choose_inputs` if None
+		:param profile: SendProfile recording the phases, a throwaway one if None
+		:return: (transaction, [public_keys], [secret_names], [b64_hashes], reservation token) ordered by input index
+		:raise: ValueError
 		"""
-		for acct in self.wallet:
-			if len(get_unspent(acct["address"], self.testnet))!=0:
-				acct["status"] = "in use"
-			else:
-				spent = get_spent(acct["address"], self.testnet)
-				confirm = (s["confirmations"] >= 6 for s in spent)
-				if len(spent) > 0 and all(confirm):
-					acct["status"] = "used"
-				elif len(spent) > 0:
-					acct["status"] = "in use"
-		self.header["LAST_UPDATE_TIME"] = str(round(time.time()))
-		output = [self.header, *self.wallet]
-		with open(self.filepath, 'w+') as f:
-			json.dump(output, f)
+		from .btc import unsigned_transaction, prepare_signatures
+		profile = profile if profile is not None else SendProfile()
+		total = sum(i['value'] for i in outputs) + fee
+		# warm the cache outside of the lock, so concurrent sends only wait for the selection itself
+		with profile.phase("fetch_utxos"):
+			self.cache.get_unspent_many(self.addresses(), PRIORITY_SEND, profile)
+		with self.lock:
+			self.__reload()
+			reserved_outpoints, reserved_addresses = self.reservations.reserved()
+			with profile.phase("choose_inputs"):
+				if inputs is None:
+					inputs, change = self.__choose_inputs(total, reserved_outpoints, profile)
+				else:
+					available = sum(u['value'] for u in inputs)
+					if available < total:
+						raise ValueError(f"Not enough funds in the given inputs for this transaction: need: {total}, have: {available}.")
+					change = available - total if available - total >= DEFAULT_COST_OF_CHANGE else 0
+			with profile.phase("fresh_account"):
+				change_address = self.__fresh_accounts(1, reserved_addresses, profile=profile)[0]["address"] if change else None
+			token = self.reservations.reserve([(u['txid'], u['index']) for u in inputs], [change_address] if change_address else [], self.reservation_lease)
+		try:
+			# changeless selections leave their excess (below the cost of a change output) to the miners
+			satoshi_fee = fee if change else fee + sum(u['value'] for u in inputs) - total
+			selected = {}
+			for u in inputs:
+				selected.setdefault(u["address"], []).append(u)
+			with profile.phase("unsigned_transaction"):
+				tx, address_list = unsigned_transaction(list(selected), outputs, satoshi_fee, change_address, self.testnet, selected.get)
+			acct_list = [self.__get_account(address) for address in address_list]
+			pubkey_list = [acct["pubkey_hex"] for acct in acct_list]
+			sec_name_list = [acct["secret_name"] for acct in acct_list]
+			with profile.phase("prepare_signatures"):
+				hash_list = [str(base64.b64encode(i), 'utf-8') for i in prepare_signatures(tx, pubkey_list)]
+			profile.count("inputs", len(tx.vin))
+			profile.count("outputs", len(tx.vout))
+		except BaseException:
+			self.reservations.release(token)
+			raise
+		self.cache.save()
+		return tx, pubkey_list, sec_name_list, hash_list, token
+
+	async def __async_sign(self, sec_name_list, hash_list, parallelism, profile=None):
+		"""
+		request the SIGN-ECDSA operations for all the transaction inputs concurrently
+		:param sec_name_list: bunkr secret names, one per input
+		:param hash_list: b64 encoded hashes, one per input
+		:param parallelism: maximum number of concurrent SIGN-ECDSA operations
+		:param profile: optional SendProfile counting the Bunkr RPCs
+		:return: list of (r, s) signatures ordered by input index
+		:raise: RuntimeError naming the first input that failed
+		"""
+		from punkr import Command, PunkrException
+		from .btc import N
+		commands = [(Command.SIGN_ECDSA, (secret_name, _hash)) for secret_name, _hash in zip(sec_name_list, hash_list)]
+		if profile is not None:
+			profile.count("rpcs", len(commands))
+		results = await self.punkr.async_ordered_batch_commands(*commands, max_concurrency=parallelism, return_exceptions=True)
+		sigs = []
+		for index, (secret_name, out) in enumerate(zip(sec_name_list, results)):
+			try:
+				if isinstance(out, BaseException):
+					raise out
+				r = int(base64.b64decode(out['r']))
+				s = int(base64.b64decode(out['s']))
+			# PunkrException derives from BaseException, the others are failed connections and malformed results
+			except (PunkrException, OSError, KeyError, TypeError, ValueError) as e:
+				raise RuntimeError(f"Bunkr Operation SIGN-ECDSA failed for input {index} ({secret_name}) with: {e}")
+			if s > N//2:
+				s = N - s
+			sigs.append((r, s))
+		return sigs
 
 def new_wallet(punkr, wallet_name, wallet_filepath, testnet):
 	"""
 	generates a new wallet file
 	:param punkr: punkr instance
 	:param wallet_name: name of wallet
-	:param wallet_filepath: filepath for wallet json file storage
+	:param wallet_filepath: filepath for the wallet storage, SQLite or legacy json if it ends with ".json"
 	:param testnet: boolean flag for mainnet vs testnet wallet
 	:return: None
 	"""
+	from .btc import gen_EC_keypair, convert_public_to_address
 	network = "BTCTEST" if testnet else "BTC"
 	n_accounts = 5
 	wallet_file = [{"NETWORK": network, "LAST_UPDATE_TIME": str(round(time.time()))}]
@@ -267,8 +713,11 @@ def new_wallet(punkr, wallet_name, wallet_filepath, testnet):
 		address = convert_public_to_address(pub, testnet)
 		write_private_key_to_bunkr(punkr, priv, address, wallet_name)
 		wallet_file.append({"address": address, "pubkey_hex":pub, "secret_name":address, "status":"fresh"})
-	with open(wallet_filepath, 'w+') as f:
-		json.dump(wallet_file, f)
+	store = open_store(wallet_filepath)
+	try:
+		store.create(wallet_file[0], wallet_file[1:])
+	finally:
+		store.close()
 
 def write_private_key_to_bunkr(punkr, private_key, address, wallet_name):
 	"""
@@ -278,6 +727,7 @@ def write_private_key_to_bunkr(punkr, private_key, address, wallet_name):
 	:param name: bunkr secret name
 	:return: None
 	"""
+	from punkr import SecretType, PunkrException
 	content = str(base64.b64encode(private_key.to_bytes(ceil(private_key.bit_length() / 8), 'big')), 'utf-8')
 	try:
 		resp = punkr.create(address, SecretType.ECDSASECP256k1Key)
@@ -296,8 +746,16 @@ def write_private_key_to_bunkr(punkr, private_key, address, wallet_name):
 
 
 def write_wallet_group(punkr, wallet_name):
+	from punkr import PunkrException
 	try:
 		resp = punkr.new_group(wallet_name)
 	except PunkrException as e:
 		print(f"Bunkr Operation NEW-GROUP failed with: {e}")
 
+def delete_wallet_group(punkr, wallet_name):
+	from punkr import PunkrException
+	try:
+		resp = punkr.delete(wallet_name)
+	except PunkrException as e:
+		print(f"Bunkr Operation DELETE failed with: {e}")
+
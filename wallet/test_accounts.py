@@ -0,0 +1,33 @@
+from bunkrwallet.accounts import Account
+from bunkrwallet.storage import open_store
+from bunkrwallet.testing import FakePunkr, indexed_wallet, keypair
+from bunkrwallet.wallet import Wallet
+
+def test_fresh_queue_rotates_and_skips_removed_accounts(tmp_path):
+	wallet_path, indexer, accounts = indexed_wallet(tmp_path, 50)
+	wallet = Wallet("w", wallet_path, "/nonexistent.sock", True, indexer)
+	wallet.punkr = FakePunkr()
+	first = wallet.show_fresh_addresses(30)
+	second = wallet.show_fresh_addresses(20)
+	assert len(set(first + second)) == 50
+	# selected addresses rotate to the back of the queue
+	assert wallet.show_fresh_addresses(30) == first
+	for address in first[:10]:
+		wallet.delete({"address": address, "secret_name": address})
+	assert len(wallet.wallet) == 40 and wallet.addresses() == [acct["address"] for acct in accounts if acct["address"] not in first[:10]]
+	assert not set(wallet.show_fresh_addresses(40)) & set(first[:10])
+
+def test_changes_of_other_wallets_rebuild_the_indexes(tmp_path):
+	wallet_path, indexer, accounts = indexed_wallet(tmp_path, 3)
+	wallet = Wallet("w", wallet_path, "/nonexistent.sock", True, indexer)
+	open_store(wallet.filepath).update_statuses({accounts[0]["address"]: "used", accounts[1]["address"]: "in use"})
+	assert wallet.show_fresh_address() == accounts[2]["address"]
+
+def test_compact_account_reads_like_a_dict():
+	pub, address, _ = keypair()
+	acct = Account.from_dict({"address": address, "pubkey_hex": pub, "secret_name": address, "status": "fresh"})
+	assert acct == {"address": address, "pubkey_hex": pub, "secret_name": address, "status": "fresh"}
+	assert len(acct.pubkey) == 33 and acct._secret_name is None and not hasattr(acct, "__dict__")
+	acct["status"] = "in use"
+	assert acct.get("status") == "in use" and dict(acct) == acct.to_dict()
+	assert Account(address, pub, "other", "used")["secret_name"] == "other"
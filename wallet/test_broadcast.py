@@ -0,0 +1,77 @@
+from bitcoin.core import b2x
+
+from bunkrwallet.btc import unsigned_transaction
+from bunkrwallet.broadcast import BroadcastPipeline, BROADCAST, CONFIRMED, FAILED
+from bunkrwallet.chain import ChainClient
+from bunkrwallet.scheduler import RequestScheduler
+from bunkrwallet.testing import FakeChainServer, new_accounts, wallet_file
+from bunkrwallet.wallet import Wallet
+
+def funded_wallet(tmp_path, server):
+	accounts = new_accounts(3)
+	accounts[0]["status"] = "in use"
+	funded, receiver, change = [acct["address"] for acct in accounts]
+	server.add_utxo(funded, 10000)
+	wallet = Wallet("w", wallet_file(tmp_path / "w.db", accounts), "/nonexistent.sock", True, client(server))
+	utxos = wallet.cache.get_unspent_many([funded])
+	tx, _ = unsigned_transaction([funded], [{"address": receiver, "value": 6000}], 1000, change, True, utxos.get)
+	return wallet, b2x(tx.serialize()), (funded, receiver, change)
+
+def client(server):
+	return ChainClient(server.blockcypher_url, server.chainso_url, scheduler=RequestScheduler({}))
+
+def test_broadcast_retries_backends_and_tracks_confirmations(tmp_path):
+	with FakeChainServer() as rejecting, FakeChainServer() as server:
+		rejecting.push_failures = 100
+		wallet, transaction, (funded, receiver, change) = funded_wallet(tmp_path, server)
+		pipeline = BroadcastPipeline(wallet, [client(rejecting), wallet.cache.backend], retry_delay=0, poll_interval=0)
+		events = []
+		pipeline.on_change(lambda b: events.append((b.status, b.confirmations)))
+		broadcast = pipeline.submit(transaction)
+		assert broadcast.addresses == sorted([funded, receiver, change])
+		pipeline.step()
+		assert broadcast.status == BROADCAST and broadcast.backend is wallet.cache.backend
+		assert server.pushed == [transaction] and rejecting.pushed == []
+		assert {acct["address"]: acct["status"] for acct in wallet.wallet} == {funded: "in use", receiver: "in use", change: "in use"}
+		pipeline.step()
+		assert events == [(BROADCAST, 0)]
+		for _ in range(5):
+			server.mine()
+			pipeline.step()
+		assert broadcast.status == BROADCAST and broadcast.confirmations == 5
+		server.mine()
+		assert pipeline.step() is None and broadcast.wait(CONFIRMED, timeout=0)
+		assert events == [(BROADCAST, n) for n in range(6)] + [(CONFIRMED, 6)]
+		assert {acct["address"]: acct["status"] for acct in wallet.wallet} == {funded: "used", receiver: "in use", change: "in use"}
+
+def test_failed_broadcast_releases_its_inputs(tmp_path):
+	with FakeChainServer() as server:
+		server.push_failures = 100
+		wallet, transaction, (funded, receiver, change) = funded_wallet(tmp_path, server)
+		outpoints = [(u['txid'], u['index']) for u in wallet.cache.get_unspent(funded)]
+		wallet.reservations.reserve(outpoints, [change], 600)
+		pipeline = BroadcastPipeline(wallet, max_attempts=3, retry_delay=0.01).start()
+		try:
+			broadcast = pipeline.submit(transaction)
+			assert not broadcast.wait(CONFIRMED, timeout=5)
+		finally:
+			pipeline.stop()
+		assert broadcast.status == FAILED and broadcast.attempts == 3 and "Transaction rejected" in broadcast.error
+		assert wallet.reservations.reserved()[0] == set()
+
+def test_broadcast_dropped_by_the_backends_fails(tmp_path):
+	with FakeChainServer() as server:
+		wallet, transaction, (funded, receiver, change) = funded_wallet(tmp_path, server)
+		outpoints = [(u['txid'], u['index']) for u in wallet.cache.get_unspent(funded)]
+		wallet.reservations.reserve(outpoints, [change], 600)
+		pipeline = BroadcastPipeline(wallet, retry_delay=0, poll_interval=0, drop_timeout=600)
+		broadcast = pipeline.submit(transaction)
+		pipeline.step()
+		assert broadcast.status == BROADCAST
+		# the transaction is evicted, it is polled until the timeout since its last change
+		server.transactions.clear()
+		assert pipeline.step() is not None and broadcast.status == BROADCAST
+		pipeline.drop_timeout = 0
+		assert pipeline.step() is None and broadcast.wait(FAILED, timeout=0)
+		assert "Not seen by any backend" in broadcast.error
+		assert wallet.reservations.reserved() == (set(), set())
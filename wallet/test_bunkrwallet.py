@@ -0,0 +1,84 @@
+import asyncio, os, time
+
+import pytest
+
+from bunkrwallet.chain import ChainBackend
+from bunkrwallet.storage import open_store
+from bunkrwallet.testing import CountingBackend, FakeBunkrServer, FakeSigner, indexed_wallet, new_accounts, wallet_file
+from bunkrwallet.wallet import BunkrWallet, Wallet
+
+def test_wallets_load_lazily_and_refresh_explicitly(tmp_path):
+	directory = tmp_path / ".BunkrWallet"
+	directory.mkdir()
+	accounts = new_accounts(1)
+	for name in ("a", "b", "c"):
+		wallet_file(directory / f"{name}.db", accounts, updated=time.time() - 2*86400)
+	(directory / "a.cache").write_text("{}")
+	backend = CountingBackend()
+	bw = BunkrWallet(bunkr_address="/nonexistent.sock", bunkr_path=str(tmp_path), backend=backend)
+	assert bw.list_wallets() == ["a", "b", "c"] and bw.wallets == {}
+	w = bw.get_wallet("b")
+	assert bw.get_wallet("b") is w and list(bw.wallets) == ["b"]
+	assert backend.calls == 0 and w.is_stale()
+	assert w.refresh() and backend.calls == 2
+	assert not w.is_stale() and not w.refresh()
+
+class RecordingBackend(ChainBackend):
+	def __init__(self, balances):
+		self.balances = balances
+		self.lookups = []
+
+	def get_unspent_many(self, addresses, testnet, priority=None):
+		self.lookups.append(sorted(addresses))
+		return {address: [{"txid": "00"*32, "index": 0, "value": self.balances[address]}] if address in self.balances else [] for address in addresses}
+
+def test_portfolio_looks_addresses_up_once_across_wallets(tmp_path):
+	directory = tmp_path / ".BunkrWallet"
+	directory.mkdir()
+	accounts = new_accounts(3)
+	wallet_file(directory / "a.db", accounts[:2])
+	wallet_file(directory / "b.db", accounts[1:])
+	backend = RecordingBackend({accounts[0]["address"]: 1000, accounts[1]["address"]: 500})
+	bw = BunkrWallet(bunkr_address="/nonexistent.sock", bunkr_path=str(tmp_path), backend=backend)
+	report = bw.portfolio()
+	assert backend.lookups == [sorted(acct["address"] for acct in accounts)]
+	assert [(w["name"], w["balance"]) for w in report["wallets"]] == [("a", 1500), ("b", 500)]
+	assert report["wallets"][1]["addresses"] == [
+		{"address": accounts[1]["address"], "balance": 500, "utxos": 1},
+		{"address": accounts[2]["address"], "balance": 0, "utxos": 0},
+	]
+	assert report["totals"] == {"BTCTEST": 1500}
+	# answers are cached per wallet, a new report does not query the chain again
+	assert bw.portfolio(["b"]) == {"wallets": report["wallets"][1:], "totals": {"BTCTEST": 500}}
+	assert len(backend.lookups) == 1
+
+def test_delete_wallet_removes_secrets_group_files_and_rows(tmp_path):
+	from punkr import PunkrException
+	with FakeBunkrServer(str(tmp_path / "bunkr.sock")) as bunkr:
+		bw = BunkrWallet(bunkr_address=bunkr.address, bunkr_path=str(tmp_path), backend=CountingBackend())
+		kept = bw.create_wallet("kept", testnet=True)
+		w = bw.create_wallet("w", testnet=True)
+		addresses = w.addresses()
+		# a secret Bunkr fails to delete stops the deletion, the wallet keeps its remaining accounts
+		del bunkr.secrets[addresses[2]]
+		with pytest.raises(PunkrException):
+			bw.delete_wallet(w)
+		assert [acct.address for acct in open_store(w.filepath).load()[1]] == addresses[2:]
+		assert w.addresses() == addresses[2:]
+		bunkr.secrets[addresses[2]] = {"type": "generic-gf", "content": None}
+		bw.delete_wallet(w)
+		assert not set(addresses) & set(bunkr.secrets) and "w" not in bunkr.groups
+		assert bw.list_wallets() == ["kept"] and list(bw.wallets) == ["kept"]
+		assert [f for f in os.listdir(bw.directory) if not f.startswith("kept.")] == []
+		assert set(kept.addresses()) <= set(bunkr.secrets) and "kept" in bunkr.groups
+
+def test_send_from_an_event_loop_asks_for_async_send(tmp_path):
+	wallet_path, indexer, accounts = indexed_wallet(tmp_path, 3, [30000], funded=1)
+	wallet = Wallet("w", wallet_path, "/nonexistent.sock", True, indexer)
+	wallet.punkr = FakeSigner()
+	outputs = [{"address": accounts[2]["address"], "value": 10000}]
+	async def send():
+		with pytest.raises(RuntimeError, match="async_send"):
+			wallet.send(outputs, 1000)
+		return await wallet.async_send(outputs, 1000)
+	assert asyncio.run(send())
@@ -0,0 +1,41 @@
+import json, time
+
+from bunkrwallet.cache import ChainCache
+
+class FakeClient(object):
+	def __init__(self, utxos=None):
+		self.utxos = utxos or []
+		self.calls = []
+
+	def get_unspent_many(self, addresses, testnet, priority):
+		self.calls.extend(addresses)
+		return {address: list(self.utxos) for address in addresses}
+
+	get_spent_many = get_unspent_many
+
+def test_cache_hits_and_invalidation(tmp_path):
+	client = FakeClient([{"value": 1000, "index": 0, "txid": "aa"*32}])
+	c = ChainCache(str(tmp_path / "w.cache"), True, backend=client)
+	assert c.get_unspent("addr1") == c.get_unspent("addr1")
+	assert client.calls == ["addr1"]
+	assert c.find_outpoint("aa"*32, 0) == "addr1"
+	c.get_unspent_many(["addr1", "addr2"])
+	assert client.calls == ["addr1", "addr2"]
+	c.invalidate(["addr1"])
+	c.get_unspent("addr1")
+	assert client.calls == ["addr1", "addr2", "addr1"]
+
+def test_cache_ttl_and_persistence(tmp_path, monkeypatch):
+	client = FakeClient()
+	path = str(tmp_path / "w.cache")
+	c = ChainCache(path, True, spent_ttl=60, backend=client)
+	c.get_spent("addr1")
+	c.save()
+	assert "addr1" in json.load(open(path))["spent"]
+	reloaded = ChainCache(path, True, spent_ttl=60, backend=client)
+	reloaded.get_spent("addr1")
+	assert client.calls == ["addr1"]
+	expired = ChainCache(path, True, spent_ttl=60, backend=client)
+	monkeypatch.setattr(time, "time", lambda: 1e12)
+	expired.get_spent("addr1")
+	assert client.calls == ["addr1", "addr1"]
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from bunkrwallet.chain import ChainClient
+from bunkrwallet.scheduler import RequestScheduler
+from bunkrwallet.testing import FakeChainServer
+
+def test_concurrent_pooled_queries():
+	with FakeChainServer(latency=0.05) as server:
+		addresses = [f"addr{i}" for i in range(64)]
+		for i, address in enumerate(addresses):
+			server.add_utxo(address, 1000+i)
+		server.add_utxo("addr0", 5, spent=True)
+		client = ChainClient(server.blockcypher_url, server.chainso_url, concurrency=16, batch_size=1, scheduler=RequestScheduler({}))
+		start = time.time()
+		unspent = client.get_unspent_many(addresses, True)
+		elapsed = time.time() - start
+		assert [unspent[a][0]["value"] for a in addresses] == [1000+i for i in range(64)]
+		# 64 requests at 50ms each, 16 at a time
+		assert elapsed < 64*0.05/2
+		assert server.connections <= 16
+		assert client.get_spent("addr0", True)[0]["value"] == 5
+		assert client.push_transaction("00", True)["status"] == "success"
+		assert server.pushed == ["00"]
+		client.close()
+
+def test_batched_queries():
+	with FakeChainServer() as server:
+		addresses = [f"addr{i}" for i in range(25)]
+		for address in addresses:
+			server.add_utxo(address, 7)
+		server.add_utxo("addr3", 9, spent=True)
+		client = ChainClient(server.blockcypher_url, server.chainso_url, batch_size=10, scheduler=RequestScheduler({}))
+		unspent = client.get_unspent_many(addresses + ["addr0"], True)
+		assert server.requests == 3
+		assert set(unspent) == set(addresses)
+		assert all(unspent[a][0]["value"] == 7 for a in addresses)
+		spent = client.get_spent_many(addresses, True)
+		assert spent["addr3"][0]["value"] == 9 and spent["addr4"] == []
+		assert server.requests == 6
+		client.close()
+
+def test_failed_or_partial_answers_raise_and_are_not_cached(tmp_path):
+	from bunkrwallet.cache import ChainCache
+	with FakeChainServer() as server:
+		addresses = [f"addr{i}" for i in range(5)]
+		for address in addresses:
+			server.add_utxo(address, 7)
+		client = ChainClient(server.blockcypher_url, server.chainso_url, batch_size=10, scheduler=RequestScheduler({}))
+		cache = ChainCache(str(tmp_path / "w.cache"), True, backend=client)
+		server.failing_addresses = {"addr2"}
+		with pytest.raises(RuntimeError, match="HTTP 400"):
+			cache.get_unspent_many(addresses)
+		server.failing_addresses = set()
+		server.dropped_addresses = {"addr3"}
+		with pytest.raises(RuntimeError, match="addr3"):
+			cache.get_unspent_many(addresses)
+		assert cache.cached_unspent_many(addresses) == {}
+		server.dropped_addresses = set(addresses)
+		with pytest.raises(RuntimeError, match="did not answer for addr0"):
+			cache.get_unspent_many(addresses)
+		server.dropped_addresses = set()
+		assert all(utxos[0]["value"] == 7 for utxos in cache.get_unspent_many(addresses).values())
+		client.close()
@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+from bunkrwallet.coinselect import select_coins, DUST_THRESHOLD
+from benchmarks.coinselect import run
+
+def utxos(*values):
+	return [{"value": v, "index": i, "txid": f"{i:064x}"} for i, v in enumerate(values)]
+
+def test_exact_match_is_changeless():
+	selected, change = select_coins(utxos(5000, 30000, 20000, 70000), 20000)
+	assert [u["value"] for u in selected] == [20000]
+	assert change == 0
+	selected, change = select_coins(utxos(15000, 12000, 8000, 3000), 20000)
+	assert sorted(u["value"] for u in selected) == [8000, 12000]
+	assert change == 0
+
+def test_fewest_inputs_with_change():
+	selected, change = select_coins(utxos(100, 200, 300, 90000, 40000), 50000)
+	assert [u["value"] for u in selected] == [90000]
+	assert change == 40000
+
+def test_knapsack_trims_excess():
+	# two inputs are needed, the smallest second one covering the target is picked
+	selected, change = select_coins(utxos(60000, 50000, 45000, 20000, 5000), 80000)
+	assert sorted(u["value"] for u in selected) == [20000, 60000]
+	assert change == 0 or change >= DUST_THRESHOLD
+
+def test_insufficient_funds():
+	with pytest.raises(ValueError):
+		select_coins(utxos(1000, 2000), 5000)
+
+def test_dust_excess_goes_to_fee():
+	selected, change = select_coins(utxos(10100), 10000)
+	assert len(selected) == 1 and change == 0
+
+def test_benchmark_beats_account_greedy():
+	for kind, result in run(rounds=10, n_accounts=50).items():
+		assert result["mean_inputs"] < result["greedy_mean_inputs"], kind
@@ -0,0 +1,54 @@
+from bunkrwallet.consolidate import Consolidator, transaction_size
+from bunkrwallet.testing import indexed_wallet
+from bunkrwallet.wallet import Wallet
+
+def test_dry_run_report(tmp_path):
+	wallet_path, indexer, accounts = indexed_wallet(tmp_path, 4, [5000]*7 + [100, 10**6], funded=2)
+	wallet = Wallet("w", wallet_path, "/nonexistent.sock", True, indexer)
+	consolidator = Consolidator(wallet, small_threshold=10000, min_utxos=5, max_inputs=3, max_fee_rate=10)
+	report = consolidator.run(2, dry_run=True)
+	# the 100 satoshis utxo costs more than its input, the 1000000 one is not small
+	assert report["utxos"] == 9 and report["small_utxos"] == 7
+	assert [len(batch["inputs"]) for batch in report["batches"]] == [3, 3]
+	assert report["inputs_before"] == 6 and report["inputs_after"] == 2 and report["signatures_saved"] == 4
+	assert report["batches"][0]["fee"] == transaction_size(3, 1)*2
+	assert report["worthwhile"]
+	assert not consolidator.plan(20)["worthwhile"]
+	assert consolidator.last_report is None
+
+def test_run_sends_each_batch_to_a_fresh_address(tmp_path):
+	wallet_path, indexer, accounts = indexed_wallet(tmp_path, 4, [5000]*4, funded=2)
+	wallet = Wallet("w", wallet_path, "/nonexistent.sock", True, indexer)
+	sends = []
+	wallet.send = lambda outputs, fee, inputs=None: sends.append((outputs, fee, inputs)) or f"tx{len(sends)}"
+	wallet.push_transaction = lambda tx: {"status": "success", "data": {"txid": tx + "id"}}
+	report = Consolidator(wallet, small_threshold=10000, min_utxos=2, max_inputs=2).run(1)
+	assert [batch["txid"] for batch in report["batches"]] == ["tx1id", "tx2id"]
+	used = {u["address"] for u in report["batches"][0]["inputs"] + report["batches"][1]["inputs"]}
+	destinations = [outputs[0]["address"] for outputs, _, _ in sends]
+	assert len(set(destinations)) == 2 and not used & set(destinations)
+	assert sends[0][0][0]["value"] + sends[0][1] == 10000
+
+def test_reserved_utxos_are_left_out_and_destinations_reserved(tmp_path):
+	wallet_path, indexer, accounts = indexed_wallet(tmp_path, 4, [5000]*5, funded=2)
+	wallet = Wallet("w", wallet_path, "/nonexistent.sock", True, indexer)
+	utxos = wallet.cache.get_unspent(accounts[0]["address"])
+	wallet.reservations.reserve([(utxos[0]["txid"], utxos[0]["index"])], [])
+	consolidator = Consolidator(wallet, small_threshold=10000, min_utxos=2, max_inputs=2)
+	report = consolidator.plan(1)
+	assert report["utxos"] == 4
+	assert all(u["index"] != utxos[0]["index"] for batch in report["batches"] for u in batch["inputs"])
+	destinations = []
+	def send(outputs, fee, inputs=None):
+		destinations.append(outputs[0]["address"])
+		if len(destinations) == 2:
+			raise ValueError("Signing failed")
+		return "tx"
+	wallet.send = send
+	wallet.push_transaction = lambda tx: {"status": "success", "data": {"txid": tx + "id"}}
+	report = consolidator.run(1)
+	assert [batch["txid"] for batch in report["batches"]] == ["txid", None]
+	# the destination of the failed batch is released, the other one waits for its transaction
+	_, reserved = wallet.reservations.reserved()
+	assert destinations[0] in reserved and destinations[1] not in reserved
+	assert wallet.show_fresh_addresses(1) == [destinations[1]]
@@ -0,0 +1,34 @@
+import os, sys, subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# microseconds of imports `bunkr-wallet list-wallets` may add to the interpreter startup
+LIST_WALLETS_IMPORT_BUDGET = 150000
+HEAVY_MODULES = ("requests", "bitcoin", "ecdsa", "punkr", "asyncio")
+
+def importtime(tmp_path, *args):
+	"""
+	:return: {top level module: cumulative import microseconds} reported by `python -X importtime`
+	"""
+	env = dict(os.environ, HOME=str(tmp_path), BUNKR_WALLET_SOCKET=str(tmp_path / "none.sock"),
+		PYTHONPATH=os.pathsep.join([HERE, os.environ.get("PYTHONPATH", "")]))
+	(tmp_path / ".bunkr").mkdir(exist_ok=True)
+	out = subprocess.run([sys.executable, "-X", "importtime", *args], env=env, cwd=str(tmp_path), capture_output=True, text=True, check=True)
+	modules = {}
+	for line in out.stderr.splitlines():
+		if not line.startswith("import time:") or "imported package" in line:
+			continue
+		_, cumulative, name = line.split("|")
+		modules[name[1:].rstrip()] = int(cumulative)
+	return modules
+
+def test_list_wallets_does_not_import_signing_and_chain_dependencies(tmp_path):
+	startup = importtime(tmp_path, "-c", "pass")
+	modules = importtime(tmp_path, os.path.join(HERE, "bin", "bunkr-wallet"), "list-wallets")
+	imported = {name.strip() for name in modules}
+	assert not [name for name in imported if name.split(".")[0] in HEAVY_MODULES]
+	added = sum(cumulative for name, cumulative in modules.items() if not name.startswith(" ") and name not in startup)
+	assert added < LIST_WALLETS_IMPORT_BUDGET
+
+def test_package_namespace_resolves_lazily():
+	code = "import sys, bunkrwallet; bunkrwallet.BunkrWallet; assert 'bunkrwallet.btc' not in sys.modules; bunkrwallet.EC_sign; bunkrwallet.Punkr"
+	subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True)
@@ -0,0 +1,146 @@
+import struct
+
+from bitcoin.core import CBlock, b2lx, lx
+
+from bunkrwallet.chain import set_default_backend
+from bunkrwallet.indexer import BlockIndexer
+from bunkrwallet.testing import FakeBunkrServer, address_script, indexed_wallet, keypair, new_accounts, transaction, wallet_file
+from bunkrwallet.wallet import Wallet
+
+REGTEST_MAGIC = bytes.fromhex("fabfb5da")
+
+def block(txs, prev=None, bits=0x207fffff):
+	return CBlock(hashPrevBlock=lx(prev) if prev is not None else b"\x00"*32, nBits=bits, vtx=txs)
+
+def chain(*blocks_txs, prev=None):
+	blocks = []
+	for txs in blocks_txs:
+		blocks.append(block(txs, prev))
+		prev = b2lx(blocks[-1].GetHash())
+	return blocks
+
+def write_blocks(path, *blocks):
+	with open(path, 'ab') as f:
+		for b in blocks:
+			raw = b.serialize()
+			f.write(REGTEST_MAGIC + struct.pack('<I', len(raw)) + raw)
+
+def test_indexer_on_fixture_blocks(tmp_path):
+	_, a, script_a = keypair()
+	_, b, script_b = keypair()
+	_, other, script_other = keypair()
+	coinbase = transaction([], [(50000, script_a), (7000, script_b), (1, script_other)], coinbase_tag=b"\x01")
+	coinbase_txid = b2lx(coinbase.GetTxid())
+	spend = transaction([(coinbase_txid, 0)], [(30000, script_other), (19000, script_a)])
+	spend_txid = b2lx(spend.GetTxid())
+	blocks = tmp_path / "blocks"
+	blocks.mkdir()
+	first, second = chain([coinbase], [transaction([], [], coinbase_tag=b"\x02"), spend])
+	write_blocks(str(blocks / "blk00000.dat"), first)
+
+	indexer = BlockIndexer(str(tmp_path / "index.json"), True, [a, b])
+	assert indexer.ingest_directory(str(blocks)) == 1
+	assert indexer.get_unspent(a, True) == [{"value": 50000, "index": 0, "txid": coinbase_txid}]
+	assert indexer.get_unspent_many([other], True) == {other: []}
+
+	# new blocks appended to the file are picked up from the last offset
+	write_blocks(str(blocks / "blk00000.dat"), second)
+	assert indexer.ingest_directory(str(blocks)) == 1
+	assert indexer.height == 1
+	assert indexer.tip == b2lx(second.GetHash())
+	assert indexer.get_unspent(a, True) == [{"value": 19000, "index": 1, "txid": spend_txid}]
+	assert indexer.get_spent(a, True) == [{"value": 50000, "index": 0, "txid": coinbase_txid}]
+
+	reloaded = BlockIndexer(str(tmp_path / "index.json"), True)
+	assert reloaded.get_unspent_many([a, b], True) == indexer.get_unspent_many([a, b], True)
+	assert reloaded.ingest_directory(str(blocks)) == 0
+
+	# transactions pushed locally are applied to the index right away
+	response = reloaded.push_transaction(transaction([(spend_txid, 1)], [(18000, script_b)]).serialize().hex(), True)
+	assert response["status"] == "success"
+	assert reloaded.get_unspent(a, True) == []
+	assert [u["value"] for u in reloaded.get_unspent(b, True)] == [7000, 18000]
+
+def test_wallet_on_local_indexer(tmp_path):
+	wallet_path, indexer, accounts = indexed_wallet(tmp_path, 3, [60000, 40000], funded=2)
+	wallet = Wallet("w", wallet_path, "/nonexistent.sock", True, indexer)
+	assert wallet.show_balance() == "w current balance: 0.001 BTC"
+	assert wallet.show_fresh_address() == accounts[2]["address"]
+
+def test_indexer_links_blocks_out_of_file_order(tmp_path):
+	_, a, script_a = keypair()
+	coinbase = transaction([], [(50000, script_a)], coinbase_tag=b"\x01")
+	spend = transaction([(b2lx(coinbase.GetTxid()), 0)], [(49000, script_a)])
+	first, second, third = chain([coinbase], [transaction([], [], coinbase_tag=b"\x02"), spend], [transaction([], [], coinbase_tag=b"\x03")])
+	blocks = tmp_path / "blocks"
+	blocks.mkdir()
+	write_blocks(str(blocks / "blk00000.dat"), first, third)
+	write_blocks(str(blocks / "blk00001.dat"), second)
+
+	indexer = BlockIndexer(str(tmp_path / "index.json"), True, [a])
+	assert indexer.ingest_block_file(str(blocks / "blk00000.dat")) == 2
+	# the third block waits for its parent
+	assert indexer.tip == b2lx(first.GetHash())
+	reloaded = BlockIndexer(str(tmp_path / "index.json"), True)
+	assert reloaded.ingest_directory(str(blocks)) == 1
+	assert reloaded.tip == b2lx(third.GetHash())
+	assert reloaded.height == 2
+	assert reloaded.get_unspent(a, True) == [{"value": 49000, "index": 0, "txid": b2lx(spend.GetTxid())}]
+	assert reloaded.get_confirmations(b2lx(spend.GetTxid()), True) == 2
+
+def test_indexer_reorganizes_to_the_chain_with_most_work(tmp_path):
+	_, a, script_a = keypair()
+	_, b, script_b = keypair()
+	coinbase = transaction([], [(50000, script_a)], coinbase_tag=b"\x01")
+	coinbase_txid = b2lx(coinbase.GetTxid())
+	to_b = transaction([(coinbase_txid, 0)], [(49000, script_b)])
+	to_a = transaction([(coinbase_txid, 0)], [(48000, script_a)])
+	genesis, = chain([coinbase])
+	stale, = chain([transaction([], [], coinbase_tag=b"\x02"), to_b], prev=b2lx(genesis.GetHash()))
+	best = chain([transaction([], [], coinbase_tag=b"\x03"), to_a], [transaction([], [], coinbase_tag=b"\x04")], prev=b2lx(genesis.GetHash()))
+
+	indexer = BlockIndexer(str(tmp_path / "index.json"), True, [a, b])
+	indexer.ingest_block(genesis.serialize().hex())
+	indexer.ingest_block(stale.serialize().hex())
+	assert indexer.get_unspent(a, True) == []
+	assert [u["value"] for u in indexer.get_unspent(b, True)] == [49000]
+	# a branch of the same work does not replace the tip
+	indexer.ingest_block(best[0].serialize().hex())
+	assert indexer.tip == b2lx(stale.GetHash())
+	indexer.ingest_block(best[1].serialize().hex())
+	assert indexer.tip == b2lx(best[1].GetHash())
+	assert indexer.height == 2
+	assert indexer.get_unspent(b, True) == []
+	assert indexer.get_spent(b, True) == []
+	assert indexer.get_unspent(a, True) == [{"value": 48000, "index": 0, "txid": b2lx(to_a.GetTxid())}]
+	assert indexer.get_spent(a, True) == [{"value": 50000, "index": 0, "txid": coinbase_txid}]
+
+def test_wallet_watches_the_addresses_it_adds(tmp_path):
+	accounts = new_accounts(1)
+	address = accounts[0]["address"]
+	script = address_script(address)
+	wallet_path = wallet_file(tmp_path / "w.json", accounts)
+	indexer = BlockIndexer(str(tmp_path / "index.json"), True)
+	with FakeBunkrServer(str(tmp_path / "bunkr.sock")) as bunkr:
+		wallet = Wallet("w", wallet_path, bunkr.address, True, indexer)
+		added, = wallet.add_addresses(1)
+	genesis = block([transaction([], [(60000, script)], coinbase_tag=b"\x01")])
+	indexer.ingest_block(genesis.serialize().hex())
+	indexer.ingest_block(block([transaction([], [(40000, address_script(added))], coinbase_tag=b"\x02")], b2lx(genesis.GetHash())).serialize().hex())
+	assert wallet.show_balance() == "w current balance: 0.001 BTC"
+
+def test_wallet_on_the_default_backend_watches_its_addresses(tmp_path):
+	accounts = new_accounts(1)
+	address = accounts[0]["address"]
+	script = address_script(address)
+	wallet_path = wallet_file(tmp_path / "w.json", accounts)
+	index_path = str(tmp_path / "index.json")
+	set_default_backend(BlockIndexer(index_path, True))
+	try:
+		Wallet("w", wallet_path, "/nonexistent.sock", True)
+	finally:
+		set_default_backend(None)
+	# the watched addresses are persisted, a restarted indexer keeps indexing them
+	indexer = BlockIndexer(index_path, True)
+	indexer.ingest_block(block([transaction([], [(60000, script)], coinbase_tag=b"\x01")]).serialize().hex())
+	assert [u["value"] for u in indexer.get_unspent(address, True)] == [60000]
@@ -0,0 +1,53 @@
+import time, threading
+
+from bitcoin.core import CTransaction, x, b2lx
+
+from bunkrwallet.storage import open_store
+from bunkrwallet.locking import ReservationBook, FileLock
+from bunkrwallet.testing import FakePunkr, FakeSigner, indexed_wallet
+from bunkrwallet.wallet import Wallet
+
+def test_concurrent_sends_do_not_share_inputs_or_change(tmp_path):
+	wallet_path, indexer, accounts = indexed_wallet(tmp_path, 6, [50000, 50000])
+	# two Wallet objects on the same file stand for two bunkr-wallet processes
+	wallets = [Wallet("w", wallet_path, "/nonexistent.sock", True, indexer) for _ in range(2)]
+	for w in wallets:
+		w.punkr = FakeSigner(0.2)
+	sent = []
+	threads = [threading.Thread(target=lambda w=w: sent.append(CTransaction.deserialize(x(w.send([{"address": accounts[5]["address"], "value": 10000}], 1000))))) for w in wallets]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	assert len(sent) == 2
+	prevouts = [(b2lx(tx.vin[0].prevout.hash), tx.vin[0].prevout.n) for tx in sent]
+	assert prevouts[0] != prevouts[1]
+	assert sent[0].vout[1].scriptPubKey != sent[1].vout[1].scriptPubKey
+	# a rejected transaction gives its inputs back
+	indexer.relay = type("Rejecting", (), {"push_transaction": lambda self, tx, testnet: {"status": "fail"}})()
+	assert wallets[0].push_transaction(sent[0].serialize().hex())["status"] == "fail"
+	reserved, _ = wallets[1].reservations.reserved()
+	assert f"{prevouts[0][0]}:{prevouts[0][1]}" not in reserved
+	assert f"{prevouts[1][0]}:{prevouts[1][1]}" in reserved
+
+def test_reservation_leases_expire(tmp_path):
+	book = ReservationBook(str(tmp_path / "w.reservations"), FileLock(str(tmp_path / "w.lock")))
+	book.reserve([("aa", 0)], ["addr"], lease=0.1)
+	try:
+		book.reserve([("aa", 0)], [])
+		assert False
+	except ValueError:
+		pass
+	time.sleep(0.2)
+	token = book.reserve([("aa", 0)], ["addr"])
+	book.release(token)
+	assert book.reserved() == (set(), set())
+
+def test_no_lost_updates_between_wallets(tmp_path):
+	wallet_path, indexer, accounts = indexed_wallet(tmp_path, 3)
+	first, second = [Wallet("w", wallet_path, "/nonexistent.sock", True, indexer) for _ in range(2)]
+	for w in (first, second):
+		w.punkr = FakePunkr()
+	first.delete(accounts[0])
+	second.delete(accounts[1])
+	assert [acct["address"] for acct in open_store(wallet_path).load()[1]] == [accounts[2]["address"]]
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from bunkrwallet.btc import gen_EC_keypair, convert_public_to_address
+from bunkrwallet.coinselect import DUST_THRESHOLD
+from bunkrwallet.payouts import PayoutQueue, SENT, FAILED, SIGNED
+
+ADDRESSES = [convert_public_to_address(gen_EC_keypair()[1], True) for _ in range(2)]
+
+class FakeWallet(object):
+	testnet = True
+
+	def __init__(self, balance):
+		self.balance = balance
+		self.sends = []
+
+	def send(self, outputs, fee):
+		total = sum(o["value"] for o in outputs) + fee
+		if total > self.balance:
+			raise ValueError("Not enough funds")
+		self.balance -= total
+		self.sends.append((outputs, fee))
+		return f"tx{len(self.sends)}"
+
+	def push_transaction(self, transaction):
+		return {"status": "success", "data": {"txid": transaction + "id"}}
+
+def test_size_window():
+	wallet = FakeWallet(10**8)
+	queue = PayoutQueue(wallet, fee=lambda n: 1000 + 100*n, max_batch=3)
+	payments = [queue.submit(ADDRESSES[i % 2], 1000) for i in range(7)]
+	queue.flush()
+	assert [p.status for p in payments] == [SENT]*7
+	assert [p.txid for p in payments] == ["tx1id"]*3 + ["tx2id"]*3 + ["tx3id"]
+	assert wallet.sends[0] == ([{"address": ADDRESSES[0], "value": 2000}, {"address": ADDRESSES[1], "value": 1000}], 1200)
+
+def test_time_window_and_failures():
+	wallet = FakeWallet(5000)
+	queue = PayoutQueue(wallet, fee=500, max_batch=100, max_wait=0.1, broadcast=False).start()
+	first = queue.submit(ADDRESSES[0], 1000)
+	assert first.wait(2)
+	assert first.status == SIGNED and first.transaction == "tx1"
+	second = queue.submit(ADDRESSES[1], 10000)
+	assert second.wait(2)
+	assert second.status == FAILED and "Not enough funds" in second.error
+	queue.stop()
+	assert queue.pending() == 0
+
+def test_invalid_addresses_are_rejected_on_submit():
+	wallet = FakeWallet(10**8)
+	queue = PayoutQueue(wallet, fee=500, max_batch=2)
+	mainnet = convert_public_to_address(gen_EC_keypair()[1], False)
+	for address in ("addr0", mainnet, ADDRESSES[0][:-1] + ("1" if ADDRESSES[0][-1] != "1" else "2")):
+		with pytest.raises(ValueError):
+			queue.submit(address, 1000)
+	assert queue.pending() == 0
+	queue.submit(ADDRESSES[0], 1000)
+	assert queue.flush()[0].status == SENT
+
+def test_dust_payments_are_rejected_on_submit():
+	queue = PayoutQueue(FakeWallet(10**8), fee=500, max_batch=2)
+	for value in (0, -1, DUST_THRESHOLD - 1):
+		with pytest.raises(ValueError):
+			queue.submit(ADDRESSES[0], value)
+	assert queue.pending() == 0
+	queue.submit(ADDRESSES[0], DUST_THRESHOLD)
+	assert queue.flush()[0].status == SENT
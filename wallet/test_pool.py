@@ -0,0 +1,82 @@
+import os, time
+
+from bunkrwallet import pool as address_pool
+from bunkrwallet.pool import AddressPool
+from bunkrwallet.testing import FakePunkr, indexed_wallet
+from bunkrwallet.wallet import Wallet
+
+def pooled_wallet(tmp_path, n, low=2, high=5, batch=2):
+	wallet_path, indexer, accounts = indexed_wallet(tmp_path, n)
+	wallet = Wallet("w", wallet_path, "/nonexistent.sock", True, indexer)
+	wallet.punkr = FakePunkr()
+	wallet.pool = AddressPool(wallet, wallet.pool.filepath, low, high, batch)
+	return wallet, accounts
+
+def test_refill_adopts_unused_accounts_before_provisioning(tmp_path):
+	wallet, accounts = pooled_wallet(tmp_path, 3)
+	assert wallet.pool.refill() == 5
+	assert wallet.pool.size() == 5 and len(wallet.punkr.secrets) == 2
+	assert set(acct["address"] for acct in accounts) <= wallet.pool.reserved()
+	assert len(wallet.wallet) == 5 and wallet.pool.refill() == 0
+
+def test_concurrent_refills_do_not_queue_an_address_twice(tmp_path):
+	wallet, accounts = pooled_wallet(tmp_path, 3)
+	# a second pool on the same file stands for the pool of another process
+	other = AddressPool(wallet, wallet.pool.filepath, 2, 5, 2)
+	show_fresh_addresses = wallet.show_fresh_addresses
+	def racing(n, partial=False):
+		wallet.show_fresh_addresses = show_fresh_addresses
+		fresh = show_fresh_addresses(n, partial)
+		# the other process refills between the lookup and the push
+		assert other.refill() == 5
+		return fresh
+	wallet.show_fresh_addresses = racing
+	assert wallet.pool.refill() == 0
+	queued = [wallet.pool.pop() for _ in range(5)]
+	assert len(set(queued)) == 5 and wallet.pool.pop() is None
+	assert len(wallet.punkr.secrets) == 2
+
+def test_pops_are_persisted_and_never_reused(tmp_path):
+	wallet, accounts = pooled_wallet(tmp_path, 5)
+	wallet.pool.refill()
+	first = wallet.show_fresh_address()
+	again = AddressPool(wallet, wallet.pool.filepath, 2, 5)
+	assert again.size() == 4 and first in again.reserved()
+	# queued and handed out addresses are neither change nor consolidation targets
+	assert wallet.show_fresh_addresses(1, partial=True) == []
+	wallet.update_statuses({first: "in use"})
+	wallet.pool.refill()
+	assert first not in wallet.pool.reserved() and wallet.pool.size() == 5
+
+def test_worker_wakes_up_under_low_watermark(tmp_path):
+	wallet, accounts = pooled_wallet(tmp_path, 5)
+	wallet.pool.refill()
+	wallet.pool.start(interval=3600)
+	try:
+		popped = [wallet.show_fresh_address() for _ in range(4)]
+		deadline = time.time() + 5
+		while wallet.pool.size() < 5 and time.time() < deadline:
+			time.sleep(0.01)
+	finally:
+		wallet.pool.stop()
+	assert wallet.pool.size() == 5 and len(wallet.punkr.secrets) == 4
+	assert not set(popped) & set(wallet.show_fresh_addresses(5, partial=True))
+
+def test_pool_file_is_a_bounded_journal(tmp_path, monkeypatch):
+	monkeypatch.setattr(address_pool, "COMPACT_AFTER", 4)
+	wallet, accounts = pooled_wallet(tmp_path, 5)
+	wallet.pool.refill()
+	other = AddressPool(wallet, wallet.pool.filepath, 2, 5)
+	assert other.size() == 5
+	size = os.path.getsize(wallet.pool.filepath)
+	first = wallet.pool.pop()
+	# a pop appends a line, other instances only read it
+	assert os.path.getsize(wallet.pool.filepath) > size
+	assert other.pop() != first and other.size() == 3
+	wallet.update_statuses({first: "in use"})
+	popped = [wallet.pool.pop() for _ in range(3)]
+	# compacted: a snapshot line without the used address
+	with open(wallet.pool.filepath) as f:
+		lines = f.read().splitlines()
+	assert len(lines) < 4 and first not in lines[0]
+	assert other.size() == 0 and first not in other.reserved() and set(popped) <= other.reserved()
@@ -0,0 +1,38 @@
+import pstats
+
+from bunkrwallet.chain import ChainClient
+from bunkrwallet.scheduler import RequestScheduler
+from bunkrwallet.testing import FakeChainServer, FakeSigner, indexed_wallet
+from bunkrwallet.wallet import Wallet
+
+def test_profiled_send_reports_phases_and_counters(tmp_path):
+	wallet_path, _, accounts = indexed_wallet(tmp_path, 4)
+	with FakeChainServer() as chain:
+		for account in accounts[:2]:
+			chain.add_utxo(account["address"], 30000)
+		client = ChainClient(chain.blockcypher_url, chain.chainso_url, scheduler=RequestScheduler({}))
+		wallet = Wallet("w", wallet_path, "/nonexistent.sock", True, client)
+		wallet.punkr = FakeSigner(0.05)
+		requests = chain.requests
+		transaction, profile = wallet.profile_send([{"address": accounts[3]["address"], "value": 40000}], 1000, cprofile=True)
+		requests = chain.requests - requests
+	report = profile.to_dict()
+	assert list(report["phases"]) == ["fetch_utxos", "choose_inputs", "fresh_account", "unsigned_transaction", "prepare_signatures", "sign", "apply_signatures"]
+	assert report["phases"]["sign"] >= 0.05 and report["elapsed"] >= sum(report["phases"].values())
+	# the utxos of the 4 addresses, then the history of the change candidates: the 4 of them are still fresh
+	assert requests == 2
+	assert report["counters"] == {"chain_lookups": 2, "chain_requests": 2, "chain_addresses": 8, "inputs": 2, "outputs": 2, "rpcs": 2, "bytes": len(transaction) // 2}
+	profile.dump(str(tmp_path / "send.prof"))
+	assert any(name == "prepare_signatures" for _, _, name in pstats.Stats(str(tmp_path / "send.prof")).stats)
+	assert "sign" in str(profile)
+
+def test_profile_counts_every_batch_request(tmp_path):
+	wallet_path, _, accounts = indexed_wallet(tmp_path, 4)
+	with FakeChainServer() as chain:
+		chain.add_utxo(accounts[0]["address"], 30000)
+		client = ChainClient(chain.blockcypher_url, chain.chainso_url, batch_size=2, scheduler=RequestScheduler({}))
+		wallet = Wallet("w", wallet_path, "/nonexistent.sock", True, client)
+		wallet.punkr = FakeSigner(0)
+		_, profile = wallet.profile_send([{"address": accounts[3]["address"], "value": 10000}], 1000)
+		assert profile.counters["chain_requests"] == chain.requests == 4
+	assert profile.counters["chain_lookups"] == 2 and profile.counters["chain_addresses"] == 8
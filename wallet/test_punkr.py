@@ -0,0 +1,224 @@
+import os, sys, time, zlib, socket, struct, base64, hashlib, threading, subprocess, multiprocessing
+
+import pytest
+
+from ecdsa import VerifyingKey, NIST256p
+from ecdsa.ecdsa import Signature
+
+from punkr import Punkr, Command, PunkrException, SecretType
+from punkr.pool import ConnectionPool
+from punkr.shared_cache import SharedResultCache
+from punkr.ssh_agent import SSHAgent, unpack_string, SSH_AGENTC_REQUEST_IDENTITIES, SSH_AGENTC_SIGN_REQUEST, SSH_AGENT_IDENTITIES_ANSWER, SSH_AGENT_SIGN_RESPONSE
+from bunkrwallet.testing import FakeBunkrServer
+
+def agent_request(address, message):
+	"""
+	:return: response payload of an ssh agent request, sent over a new connection
+	"""
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+		client.connect(address)
+		client.sendall(struct.pack(">I", len(message)) + message)
+		data = b""
+		while len(data) < 4 or len(data) < 4 + struct.unpack_from(">I", data)[0]:
+			chunk = client.recv(4096)
+			assert chunk
+			data += chunk
+	return data[4:]
+
+def forked(target, n):
+	"""
+	run target(i, barrier) in n forked processes, the barrier lets them start together
+	:return: [results] ordered by i
+	"""
+	context = multiprocessing.get_context("fork")
+	queue, barrier = context.Queue(), context.Barrier(n)
+	def run(i):
+		try:
+			queue.put((i, target(i, barrier), None))
+		except BaseException as e:
+			queue.put((i, None, repr(e)))
+	workers = [context.Process(target=run, args=(i,)) for i in range(n)]
+	for worker in workers:
+		worker.start()
+	results = sorted(queue.get(timeout=30) for _ in workers)
+	for worker in workers:
+		worker.join()
+	assert [error for _, _, error in results if error] == []
+	return [result for _, result, _ in results]
+
+def unpack_mpint(data, offset):
+	value, offset = unpack_string(data, offset)
+	return int.from_bytes(value, "big"), offset
+
+def test_agent_lists_identities_and_signs_with_bunkr_keys(tmp_path):
+	with FakeBunkrServer(str(tmp_path / "bunkr.sock")) as bunkr:
+		for name in ("key1", "key2"):
+			bunkr.handle_command("new-ssh-key", [name])
+		agent = SSHAgent(bunkr.address, str(tmp_path / "agent.sock"), str(tmp_path / "index.json")).start()
+		try:
+			assert os.stat(agent.address).st_mode & 0o777 == 0o600
+			public_keys = {name: agent.import_key(name) for name in ("key1", "key2")}
+			calls = dict(bunkr.calls)
+			response = agent_request(agent.address, bytes([SSH_AGENTC_REQUEST_IDENTITIES]))
+			# identities are listed from the index, without a daemon round trip
+			assert bunkr.calls == calls
+			assert response[0] == SSH_AGENT_IDENTITIES_ANSWER
+			count, = struct.unpack_from(">I", response, 1)
+			identities, offset = {}, 5
+			for _ in range(count):
+				blob, offset = unpack_string(response, offset)
+				comment, offset = unpack_string(response, offset)
+				identities[comment.decode()] = blob
+			assert offset == len(response)
+			assert identities == {name: base64.b64decode(line.split()[1]) for name, line in public_keys.items()}
+
+			data = b"session id and userauth request"
+			blob = identities["key2"]
+			response = agent_request(agent.address, bytes([SSH_AGENTC_SIGN_REQUEST]) + struct.pack(">I", len(blob)) + blob + struct.pack(">I", len(data)) + data + struct.pack(">I", 0))
+			assert bunkr.calls["sign-ecdsa"] == 1
+			assert response[0] == SSH_AGENT_SIGN_RESPONSE
+			signature, end = unpack_string(response, 1)
+			assert end == len(response)
+			key_type, offset = unpack_string(signature)
+			assert key_type == b"ecdsa-sha2-nistp256"
+			rs, end = unpack_string(signature, offset)
+			assert end == len(signature)
+			r, offset = unpack_mpint(rs, 0)
+			s, end = unpack_mpint(rs, offset)
+			assert end == len(rs)
+			# a nistp256 key blob is string(type) + string("nistp256") + string(uncompressed point)
+			_, offset = unpack_string(blob)
+			curve, offset = unpack_string(blob, offset)
+			point, _ = unpack_string(blob, offset)
+			assert curve == b"nistp256"
+			public = VerifyingKey.from_string(point[1:], curve=NIST256p).pubkey
+			assert public.verifies(int.from_bytes(hashlib.sha256(data).digest(), "big"), Signature(r, s))
+
+			# an unknown key is refused without asking the daemon
+			unknown = bytes([SSH_AGENTC_SIGN_REQUEST]) + struct.pack(">I", 3) + b"abc" + struct.pack(">I", len(data)) + data
+			assert agent_request(agent.address, unknown) == bytes([5])
+			assert bunkr.calls["sign-ecdsa"] == 1
+		finally:
+			agent.stop()
+		assert not os.path.exists(agent.address)
+
+def test_agent_replaces_only_stale_sockets(tmp_path):
+	address = str(tmp_path / "agent.sock")
+	with FakeBunkrServer(str(tmp_path / "bunkr.sock")) as bunkr:
+		stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		stale.bind(address)
+		stale.close()
+		agent = SSHAgent(bunkr.address, address).start()
+		try:
+			with pytest.raises(RuntimeError, match="already running"):
+				SSHAgent(bunkr.address, address)
+			assert agent_request(address, bytes([SSH_AGENTC_REQUEST_IDENTITIES]))[0] == SSH_AGENT_IDENTITIES_ANSWER
+		finally:
+			agent.stop()
+		with open(address, "w") as f:
+			f.write("not a socket")
+		with pytest.raises(RuntimeError, match="not a socket"):
+			SSHAgent(bunkr.address, address)
+		assert os.path.isfile(address)
+
+def test_pool_reuses_connections_up_to_its_size(tmp_path):
+	with FakeBunkrServer(str(tmp_path / "bunkr.sock"), latency=0.05) as bunkr:
+		with ConnectionPool(bunkr.address, size=2) as pool:
+			for _ in range(3):
+				assert pool.execute(Command.NOOP) == {"msg": "noop"}
+			assert bunkr.connections == 1
+			# a failing command gives its connection back
+			with pytest.raises(PunkrException):
+				pool.execute(Command.ACCESS, "missing")
+			assert bunkr.connections == 1
+			results = []
+			threads = [threading.Thread(target=lambda: results.append(pool.execute(Command.NOOP))) for _ in range(6)]
+			for t in threads:
+				t.start()
+			for t in threads:
+				t.join()
+			assert len(results) == 6
+			assert bunkr.connections == 2
+
+def test_pool_reconnects_when_the_daemon_drops_idle_connections(tmp_path):
+	with FakeBunkrServer(str(tmp_path / "bunkr.sock")) as bunkr:
+		with ConnectionPool(bunkr.address, size=2) as pool:
+			pool.execute(Command.NOOP)
+			bunkr.drop_connections()
+			assert pool.execute(Command.NOOP) == {"msg": "noop"}
+			assert bunkr.connections == 2
+			assert bunkr.calls["noop-test"] == 2
+			pool.execute(Command.NOOP)
+			assert bunkr.connections == 2
+
+def test_pool_retries_only_read_only_commands_on_a_broken_connection(tmp_path):
+	with FakeBunkrServer(str(tmp_path / "bunkr.sock")) as bunkr:
+		bunkr.handle_command("create", ["secret", "GENERIC-GF256"])
+		with ConnectionPool(bunkr.address, size=2) as pool:
+			pool.execute(Command.NOOP)
+			bunkr.hang_ups = 1
+			assert pool.execute(Command.NOOP) == {"msg": "noop"}
+			assert bunkr.calls["noop-test"] == 3
+			# the daemon may have run the write, it is not sent again
+			bunkr.hang_ups = 1
+			with pytest.raises((OSError, ValueError)):
+				pool.execute(Command.WRITE, "secret", "text", "content")
+			assert bunkr.calls["write"] == 1
+
+def test_punkr_imports_its_optional_modules_lazily():
+	code = "import sys, punkr; punkr.Punkr; assert not {'punkr.pool', 'punkr.shared_cache', 'punkr.ssh_agent'} & set(sys.modules); punkr.SSHAgent; punkr.SharedResultCache"
+	subprocess.run([sys.executable, "-c", code], check=True)
+
+def test_shared_cache_makes_one_fetch_for_all_the_workers(tmp_path):
+	with FakeBunkrServer(str(tmp_path / "bunkr.sock"), latency=0.1) as bunkr:
+		bunkr.handle_command("create", ["secret1", "HMAC"])
+		punkr = Punkr(bunkr.address, SharedResultCache(str(tmp_path / "punkr.cache")))
+		def lookups(i, barrier):
+			barrier.wait()
+			return punkr.list_secrets(), punkr.list_secrets()
+		results = forked(lookups, 4)
+		# the concurrent misses waited for a single fetch
+		assert bunkr.calls["list-secrets"] == 1
+	assert all(result["content"]["secrets"] == ["secret1"] for pair in results for result in pair)
+
+def test_shared_cache_is_invalidated_by_a_write_of_any_worker(tmp_path):
+	with FakeBunkrServer(str(tmp_path / "bunkr.sock")) as bunkr:
+		punkr = Punkr(bunkr.address, SharedResultCache(str(tmp_path / "punkr.cache")))
+		lookup = lambda i, barrier: punkr.list_secrets()["content"]["secrets"]
+		assert forked(lookup, 3) == [[], [], []]
+		assert bunkr.calls["list-secrets"] == 1
+		forked(lambda i, barrier: punkr.create("secret1", SecretType.HMACKey), 1)
+		assert forked(lookup, 3) == [["secret1"]] * 3
+		assert bunkr.calls["list-secrets"] == 2
+
+def test_shared_cache_concurrent_writers_keep_every_entry(tmp_path):
+	path = str(tmp_path / "punkr.cache")
+	cache = SharedResultCache(path)
+	def writes(i, barrier):
+		counter = cache.counter()
+		barrier.wait()
+		for n in range(50):
+			cache.put("shared", [i, n], counter)
+			cache.put(f"worker{i}-{n}", n, counter)
+	forked(writes, 6)
+	reader = SharedResultCache(path)
+	assert all(reader.get(f"worker{i}-{n}") == (True, n) for i in range(6) for n in range(50))
+	found, last = reader.get("shared")
+	assert found and last[1] == 49
+
+	# keys sharing a fetch slot are fetched once each, by whichever worker comes first
+	keys = ["key0", next(f"key{n}" for n in range(1, 100000) if zlib.crc32(f"key{n}".encode()) % 1024 == zlib.crc32(b"key0") % 1024)]
+	fetches = str(tmp_path / "fetches")
+	def fetch(key):
+		with open(fetches, "a") as f:
+			f.write(key + "\n")
+		time.sleep(0.1)
+		return key.upper()
+	def lookup(i, barrier):
+		key = keys[i % 2]
+		barrier.wait()
+		return cache.get_or_fetch(key, lambda: fetch(key))
+	results = forked(lookup, 6)
+	assert results == [key.upper() for key in keys] * 3
+	with open(fetches) as f:
+		assert sorted(f.read().split()) == sorted(keys)
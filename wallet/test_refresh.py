@@ -0,0 +1,59 @@
+import time
+
+from bunkrwallet.chain import ChainClient
+from bunkrwallet.refresh import account_status, aged_activity
+from bunkrwallet.scheduler import RequestScheduler
+from bunkrwallet.testing import FakeChainServer, new_accounts, wallet_file
+from bunkrwallet.wallet import Wallet
+
+def test_incremental_refresh_resumes_and_skips_settled_accounts(tmp_path):
+	with FakeChainServer() as server:
+		accounts = new_accounts(4)
+		funded, settled, unconfirmed, unused = [acct["address"] for acct in accounts]
+		server.add_utxo(funded, 5000)
+		server.add_utxo(settled, 7000, spent=True, confirmations=10)
+		server.add_utxo(unconfirmed, 3000, spent=True, confirmations=2)
+		wallet_path = wallet_file(tmp_path / "w.db", accounts, updated=time.time() - 2*86400)
+		client = ChainClient(server.blockcypher_url, server.chainso_url, scheduler=RequestScheduler({}))
+		activity = client.get_activity_many([settled], True)[settled]
+		assert activity == {"n_tx": 1, "balance": 0, "height": 991, "confirmations": 10}
+
+		wallet = Wallet("w", wallet_path, "/nonexistent.sock", True, client)
+		wallet.refresher.budget = 2
+		# an interrupted pass does not mark the wallet as refreshed, and resumes from disk
+		assert not wallet.refresher.step()
+		assert wallet.refresher.pending() == 2 and wallet.is_stale()
+		wallet = Wallet("w", wallet_path, "/nonexistent.sock", True, client)
+		assert wallet.refresher.pending() == 2
+		requests = server.requests
+		assert wallet.refresh()
+		assert server.requests == requests + 1
+		assert [acct["status"] for acct in wallet.wallet] == ["in use", "used", "in use", "fresh"]
+		assert not wallet.is_stale() and not wallet.refresh()
+
+		# confirmed used accounts are not queried again until used_recheck_after
+		checked = wallet.refresher.last_seen(settled)["checked"]
+		server.add_utxo(unconfirmed, 1, spent=True, confirmations=7)
+		wallet.refresh(force=True)
+		assert wallet.refresher.last_seen(settled)["checked"] == checked
+		assert wallet.refresher.last_seen(unconfirmed)["n_tx"] == 2
+
+		# once the tip buries its last transaction the account settles without an address query
+		server.mine(4)
+		checked = wallet.refresher.last_seen(unconfirmed)["checked"]
+		queried = []
+		get_activity_many = client.get_activity_many
+		client.get_activity_many = lambda addresses, *args: queried.extend(addresses) or get_activity_many(addresses, *args)
+		wallet.refresh(force=True)
+		assert sorted(queried) == sorted([funded, unused])
+		assert wallet.get_account(unconfirmed)["status"] == "used"
+		assert wallet.refresher.last_seen(unconfirmed)["checked"] == checked
+		client.close()
+
+def test_unknown_confirmations_are_in_use():
+	assert account_status({"n_tx": 3, "balance": 0, "height": None, "confirmations": None}) == "in use"
+	assert account_status({"n_tx": 3, "balance": 0, "height": 10, "confirmations": 0}) == "in use"
+	assert account_status({"n_tx": 0, "balance": 0, "height": None, "confirmations": None}) == "fresh"
+	assert aged_activity({"n_tx": 1, "balance": 0, "height": 10, "confirmations": 2}, 20)["confirmations"] == 11
+	# an unconfirmed transaction does not age
+	assert aged_activity({"n_tx": 2, "balance": 0, "height": 10, "confirmations": 0}, 20)["confirmations"] == 0
@@ -0,0 +1,50 @@
+import time, threading
+
+import pytest
+
+from bunkrwallet.scheduler import RequestScheduler, ThrottledError, PRIORITY_SEND, PRIORITY_BACKGROUND
+
+class FakeResponse(object):
+	def __init__(self, status_code, headers=None):
+		self.status_code = status_code
+		self.headers = headers or {}
+
+def test_token_bucket_rate():
+	scheduler = RequestScheduler({"api": (20, 1)})
+	start = time.monotonic()
+	for _ in range(6):
+		scheduler.submit("api", lambda: FakeResponse(200))
+	assert time.monotonic() - start >= 5/20 * 0.9
+	assert scheduler.metrics()["api"]["requests"] == 6
+
+def test_retry_after_is_honored():
+	answers = [FakeResponse(429, {"Retry-After": "0.2"}), FakeResponse(200)]
+	scheduler = RequestScheduler({"api": (100, 10)})
+	start = time.monotonic()
+	assert scheduler.submit("api", lambda: answers.pop(0)).status_code == 200
+	assert time.monotonic() - start >= 0.2
+	metrics = scheduler.metrics()["api"]
+	assert metrics["throttled"] == 1 and metrics["retries"] == 1
+
+def test_retries_exhausted():
+	scheduler = RequestScheduler({}, max_retries=2, base_delay=0.01)
+	with pytest.raises(ThrottledError):
+		scheduler.submit("api", lambda: FakeResponse(503))
+	assert scheduler.metrics()["api"]["requests"] == 3
+
+def test_priorities():
+	scheduler = RequestScheduler({"api": (10, 1)})
+	order = []
+	scheduler.submit("api", lambda: FakeResponse(200))
+	def run(name, priority):
+		scheduler.submit("api", lambda: order.append(name) or FakeResponse(200), priority)
+	threads = [threading.Thread(target=run, args=(f"background{i}", PRIORITY_BACKGROUND)) for i in range(3)]
+	for t in threads:
+		t.start()
+	time.sleep(0.02)
+	assert scheduler.metrics()["api"]["queue_depth"] == 3
+	send = threading.Thread(target=run, args=("send", PRIORITY_SEND))
+	send.start()
+	for t in threads + [send]:
+		t.join()
+	assert order.index("send") <= 1
@@ -0,0 +1,131 @@
+import os, stat, time, socket, threading, pytest
+
+from bunkrwallet.service import ServiceClient, WalletOperations, WalletService
+from bunkrwallet.testing import CountingBackend, FakeBunkrServer, new_accounts, wallet_file
+from bunkrwallet.wallet import BunkrWallet
+
+def test_service_keeps_wallets_warm(tmp_path):
+	directory = tmp_path / ".BunkrWallet"
+	directory.mkdir()
+	accounts = new_accounts(1)
+	address = accounts[0]["address"]
+	wallet_file(directory / "a.db", accounts)
+	backend = CountingBackend()
+	bw = BunkrWallet(bunkr_address="/nonexistent.sock", bunkr_path=str(tmp_path), backend=backend)
+	socket_path = str(tmp_path / "wallet.sock")
+	assert ServiceClient.connect(socket_path) is None
+	umask = os.umask(0o022)
+	try:
+		service = WalletService(bw, socket_path, workers=()).start()
+		# the socket is created owner only and the process umask is restored
+		assert os.umask(0o022) == 0o022
+	finally:
+		os.umask(umask)
+	assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+	try:
+		with pytest.raises(RuntimeError):
+			WalletService(bw, socket_path)
+		client = ServiceClient.connect(socket_path)
+		assert client.call("list_wallets") == ["a"]
+		assert client.call("get_address", name="a") == address
+		assert client.call("check_balance", name="a") == "a current balance: 0.0 BTC"
+		client.close()
+		# a new connection is served by the already loaded wallet
+		client = ServiceClient.connect(socket_path)
+		assert client.call("check_balance", name="a") == "a current balance: 0.0 BTC"
+		assert list(bw.wallets) == ["a"]
+		with pytest.raises(RuntimeError, match="KeyError"):
+			client.call("check_balance", name="missing")
+		with pytest.raises(RuntimeError, match="Unknown operation"):
+			client.call("_WalletOperations__wallet", name="a")
+		client.close()
+	finally:
+		service.stop()
+	assert ServiceClient.connect(socket_path) is None
+
+def test_sockets_open_to_other_users_are_refused(tmp_path):
+	socket_path = str(tmp_path / "wallet.sock")
+	squatter = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	squatter.bind(socket_path)
+	squatter.listen()
+	os.chmod(socket_path, 0o666)
+	try:
+		with pytest.raises(RuntimeError, match="Refusing"):
+			ServiceClient.connect(socket_path)
+		bw = BunkrWallet(bunkr_address="/nonexistent.sock", bunkr_path=str(tmp_path), backend=CountingBackend())
+		with pytest.raises(RuntimeError, match="Refusing"):
+			WalletService(bw, socket_path, workers=())
+		assert os.path.exists(socket_path)
+	finally:
+		squatter.close()
+
+class BlockingBackend(CountingBackend):
+	def __init__(self):
+		super().__init__()
+		self.entered = threading.Event()
+		self.release = threading.Event()
+
+	def get_unspent_many(self, addresses, testnet, priority=None):
+		self.entered.set()
+		assert self.release.wait(10)
+		return super().get_unspent_many(addresses, testnet, priority)
+
+def test_portfolio_does_not_hold_the_wallets_during_chain_lookups(tmp_path):
+	directory = tmp_path / ".BunkrWallet"
+	directory.mkdir()
+	accounts = new_accounts(1)
+	for name in ("a", "b"):
+		wallet_file(directory / f"{name}.db", accounts)
+	backend = BlockingBackend()
+	operations = WalletOperations(BunkrWallet(bunkr_address="/nonexistent.sock", bunkr_path=str(tmp_path), backend=backend))
+	reports = []
+	portfolio = threading.Thread(target=lambda: reports.append(operations.portfolio(["a"])))
+	portfolio.start()
+	try:
+		assert backend.entered.wait(10)
+		# other wallets are loaded while the portfolio waits for the chain
+		operations.export_wallet("b", str(tmp_path / "b.json"))
+	finally:
+		backend.release.set()
+		portfolio.join()
+	assert reports[0]["totals"] == {"BTCTEST": 0}
+
+def test_service_refreshes_wallets_in_the_background(tmp_path):
+	directory = tmp_path / ".BunkrWallet"
+	directory.mkdir()
+	wallet_file(directory / "a.db", new_accounts(1), updated=time.time() - 2*86400)
+	backend = CountingBackend()
+	bw = BunkrWallet(bunkr_address="/nonexistent.sock", bunkr_path=str(tmp_path), backend=backend)
+	service = WalletService(bw, str(tmp_path / "wallet.sock"), workers=("refresher",)).start()
+	try:
+		deadline = time.time() + 5
+		while ("a" not in bw.wallets or bw.wallets["a"].is_stale()) and time.time() < deadline:
+			time.sleep(0.05)
+		assert not bw.get_wallet("a").is_stale() and backend.calls == 2
+	finally:
+		service.stop()
+	assert bw.get_wallet("a").refresher.pending() == 0
+
+def test_service_tops_address_pools_up(tmp_path):
+	with FakeBunkrServer(str(tmp_path / "bunkr.sock")) as bunkr:
+		bw = BunkrWallet(bunkr_address=bunkr.address, bunkr_path=str(tmp_path), backend=CountingBackend())
+		pool = bw.create_wallet("a", testnet=True).pool
+		pool.low, pool.high = 3, 8
+		service = WalletService(bw, str(tmp_path / "wallet.sock")).start()
+		try:
+			client = ServiceClient.connect(service.address)
+			deadline = time.time() + 10
+			while pool.size() < pool.high and time.time() < deadline:
+				time.sleep(0.05)
+			assert pool.size() == pool.high
+			# addresses are handed out from the pool, and the queue is topped up again
+			queued = list(pool.reserved())
+			for _ in range(pool.high - pool.low + 1):
+				assert client.call("get_address", name="a") in queued
+			deadline = time.time() + 10
+			while pool.size() < pool.high and time.time() < deadline:
+				time.sleep(0.05)
+			assert pool.size() == pool.high
+			client.close()
+		finally:
+			service.stop()
@@ -0,0 +1,52 @@
+import json
+
+from bunkrwallet.storage import open_store, import_json, export_json, JsonWalletStore, SQLiteWalletStore
+
+HEADER = {"NETWORK": "BTCTEST", "LAST_UPDATE_TIME": "1500000000"}
+ACCOUNTS = [{"address": f"addr{i}", "pubkey_hex": f"02{i:064x}", "secret_name": f"addr{i}", "status": "fresh"} for i in range(3)]
+
+def test_json_import_and_export(tmp_path):
+	(tmp_path / "legacy.json").write_text(json.dumps([HEADER, *ACCOUNTS]))
+	store = open_store(str(tmp_path / "w.db"))
+	assert isinstance(store, SQLiteWalletStore) and isinstance(open_store(str(tmp_path / "legacy.json")), JsonWalletStore)
+	import_json(store, str(tmp_path / "legacy.json"))
+	with store.transaction():
+		store.update_statuses({"addr1": "in use"})
+		store.remove_accounts(["addr0"])
+		store.add_accounts([dict(ACCOUNTS[0], address="addr3", secret_name="addr3")])
+	assert store.get_account("addr1")["status"] == "in use"
+	assert [acct["address"] for acct in store.accounts_with_status("fresh")] == ["addr2", "addr3"]
+	export_json(store, str(tmp_path / "exported.json"))
+	with open(tmp_path / "exported.json") as f:
+		exported = json.load(f)
+	assert exported[0] == HEADER
+	assert [acct["address"] for acct in exported[1:]] == ["addr1", "addr2", "addr3"]
+
+def test_failed_transactions_leave_no_trace(tmp_path):
+	for path in (tmp_path / "w.db", tmp_path / "w.json"):
+		store = open_store(str(path))
+		store.create(HEADER, ACCOUNTS)
+		try:
+			with store.transaction():
+				store.update_statuses({"addr0": "used"})
+				store.update_header({"LAST_UPDATE_TIME": "1600000000"})
+				raise RuntimeError("crash")
+		except RuntimeError:
+			pass
+		header, accounts = open_store(str(path)).load()
+		assert header == HEADER and accounts == ACCOUNTS
+		store.update_header({"LAST_UPDATE_TIME": "1600000000"})
+		assert open_store(str(path)).load()[0] == dict(HEADER, LAST_UPDATE_TIME="1600000000")
+
+def test_changes_of_other_connections_are_detected(tmp_path):
+	for path in (tmp_path / "w.db", tmp_path / "w.json"):
+		first = open_store(str(path))
+		first.create(HEADER, ACCOUNTS)
+		first.load()
+		second = open_store(str(path))
+		second.load()
+		second.update_statuses({"addr2": "used"})
+		assert not second.changed()
+		assert first.changed()
+		assert first.load()[1][2]["status"] == "used"
+		assert not first.changed()
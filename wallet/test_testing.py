@@ -0,0 +1,24 @@
+from bitcoin import SelectParams
+from bitcoin.core import CTransaction, b2lx, x
+from bitcoin.core.scripteval import VerifyScript
+from bitcoin.wallet import CBitcoinAddress
+
+from bunkrwallet.chain import ChainClient
+from bunkrwallet.scheduler import RequestScheduler
+from bunkrwallet.testing import FakeBunkrServer, FakeChainServer
+from bunkrwallet.wallet import BunkrWallet
+
+def test_wallet_sends_offline_against_fake_bunkr(tmp_path):
+	with FakeChainServer() as chain, FakeBunkrServer(str(tmp_path / "bunkr.sock")) as bunkr:
+		backend = ChainClient(chain.blockcypher_url, chain.chainso_url, scheduler=RequestScheduler({}))
+		wallet = BunkrWallet("wallets", bunkr.address, str(tmp_path), backend).create_wallet("w", testnet=True)
+		addresses = wallet.addresses()
+		assert set(addresses) <= set(bunkr.secrets) and bunkr.groups["w"] == set(addresses)
+		funding = {chain.add_utxo(addresses[0], 50000): addresses[0], chain.add_utxo(addresses[1], 30000): addresses[1]}
+		transaction = wallet.send([{"address": addresses[4], "value": 60000}], 1000)
+		assert bunkr.calls["sign-ecdsa"] == 2
+		tx = CTransaction.deserialize(x(transaction))
+		SelectParams("testnet")
+		for index, txin in enumerate(tx.vin):
+			VerifyScript(txin.scriptSig, CBitcoinAddress(funding[b2lx(txin.prevout.hash)]).to_scriptPubKey(), tx, index)
+		assert wallet.push_transaction(transaction)["status"] == "success"